@@ -0,0 +1,41 @@
+"""Gunicorn settings for LPS2.
+
+Usage (from the project root):
+    gunicorn -c gunicorn.conf.py
+
+Worker tuning notes:
+ - gthread workers keep one interpreter per process and serve requests on a thread
+   pool; LLM calls are I/O bound, so threads give most of the concurrency cheaply.
+ - Runs exactly one worker (on_starting refuses more); scale with LPS2_THREADS.
+   Chat history lives in the worker's memory (utils.history_store), so a second
+   worker would serve a session's turns without its earlier context. The memory store, KB
+   index, ingest job status and rate limits are all per process, so extra workers
+   would not see each other's writes (and memory-store compaction in one worker
+   would drop entries appended by another).
+ - preload_app imports the app once in the master so startup work (password hashing,
+   store loading) is paid once and shared copy-on-write with the workers.
+ - The timeout is generous because long generations with auto-continue can take minutes.
+"""
+import os
+
+pythonpath = 'src'
+wsgi_app = 'app:app'
+
+bind = os.environ.get('LPS2_BIND', f"0.0.0.0:{os.environ.get('LPS2_PORT', '5000')}")
+workers = int(os.environ.get('LPS2_WORKERS', '1'))
+# Read by utils.embeddings to split torch threads across workers
+os.environ.setdefault('LPS2_WORKERS', str(workers))
+worker_class = 'gthread'
+threads = int(os.environ.get('LPS2_THREADS', '8'))
+preload_app = True
+timeout = int(os.environ.get('LPS2_WORKER_TIMEOUT', '120'))
+keepalive = 5
+
+
+def on_starting(server):
+    # Also catches -w / WEB_CONCURRENCY overriding the value above
+    if server.cfg.workers != 1:
+        raise RuntimeError(
+            f"LPS2 needs a single gunicorn worker (got {server.cfg.workers}): chat history and "
+            "the stores are per process. Raise LPS2_THREADS for concurrency instead."
+        )
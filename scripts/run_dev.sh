@@ -96,4 +96,5 @@ if [ "${LPS2_ENABLE_TLS:-}" != "" ] && [[ "${LPS2_ENABLE_TLS}" =~ ^(1|true|yes|o
 else
   echo "[run_dev] TLS disabled (set LPS2_ENABLE_TLS=1 to enable)." >&2
 fi
+export LPS2_DEV=1
 exec python src/app.py
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 import http.server
-import socketserver
+import concurrent.futures
+import hashlib
 import os
 import sys
+from email.utils import formatdate
 from pathlib import Path
 
 PORT = 8081
@@ -19,6 +21,22 @@ if not preview_html_path.exists():
     print(f"Error: {preview_html_path} not found!")
     sys.exit(1)
 
+def _load_static(path, content_type):
+    """Read a file once and precompute the headers used to serve it."""
+    body = path.read_bytes()
+    return {
+        'body': body,
+        'content_type': content_type,
+        'etag': '"' + hashlib.sha256(body).hexdigest() + '"',
+        'last_modified': formatdate(path.stat().st_mtime, usegmt=True),
+    }
+
+# Both files are served from memory; restart the server to pick up edits
+STATIC_FILES = {
+    '/readme_preview.html': _load_static(preview_html_path, 'text/html; charset=utf-8'),
+    '/README.md': _load_static(readme_path, 'text/markdown; charset=utf-8'),
+}
+
 class MyHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
         if self.path == '/':
@@ -26,15 +44,67 @@ class MyHandler(http.server.SimpleHTTPRequestHandler):
             self.send_response(302)
             self.send_header('Location', '/readme_preview.html')
             self.end_headers()
-        else:
+            return
+        if not self._send_cached(include_body=True):
             return http.server.SimpleHTTPRequestHandler.do_GET(self)
-            
+
+    def do_HEAD(self):
+        if not self._send_cached(include_body=False):
+            return http.server.SimpleHTTPRequestHandler.do_HEAD(self)
+
+    def _send_cached(self, include_body):
+        entry = STATIC_FILES.get(self.path)
+        if entry is None:
+            return False
+        if self.headers.get('If-None-Match') == entry['etag']:
+            self.send_response(304)
+            self.send_header('ETag', entry['etag'])
+            self.end_headers()
+            return True
+        self.send_response(200)
+        self.send_header('Content-Type', entry['content_type'])
+        self.send_header('Content-Length', str(len(entry['body'])))
+        self.send_header('ETag', entry['etag'])
+        self.send_header('Last-Modified', entry['last_modified'])
+        self.send_header('Cache-Control', 'public, max-age=60')
+        self.end_headers()
+        if include_body:
+            self.wfile.write(entry['body'])
+        return True
+
+class PooledHTTPServer(http.server.ThreadingHTTPServer):
+    """HTTP server that handles requests on a fixed-size thread pool."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, max_workers=None, **kwargs):
+        if max_workers is None:
+            max_workers = int(os.environ.get('LPS2_HTTP_WORKERS', '16'))
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
 print(f"Starting server at http://localhost:{PORT}")
 print(f"Preview available at http://localhost:{PORT}/readme_preview.html")
-httpd = socketserver.TCPServer(("", PORT), MyHandler)
+httpd = PooledHTTPServer(("", PORT), MyHandler)
 
 try:
     httpd.serve_forever()
 except KeyboardInterrupt:
     print("\nShutting down server...")
-    httpd.shutdown()
\ No newline at end of file
+finally:
+    httpd.server_close()
@@ -1,7 +1,15 @@
-from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for
+from flask import Flask, request, session, redirect, url_for
 import time
 import secrets
+import hmac
+import hashlib
+import re
+import threading
+from functools import wraps
 from routes.chat import init_chat_route
+from utils.embeddings import start_embedding_warmup
+from utils.json_utils import OrjsonProvider, dumps_bytes
+from utils.history_store import clear_history
 import sys
 import warnings
 from datetime import timedelta
@@ -19,6 +27,12 @@ if 'LPS2_API_KEY' not in os.environ:
     os.environ['LPS2_API_KEY'] = default_api_key
 
 app = Flask(__name__, static_folder="static")
+# jsonify() across all blueprints encodes with orjson when available
+app.json = OrjsonProvider(app)
+
+def ojson(obj, status=200, headers=None):
+    """Build a JSON response directly from orjson bytes (skips jsonify's argument handling)."""
+    return app.response_class(dumps_bytes(obj), status=status, mimetype='application/json', headers=headers)
 
 # SECURITY WARNING: Default secret key for development only
 default_secret_key = 'dev-insecure-secret-key'
@@ -46,120 +60,223 @@ if os.environ.get('LPS2_FORCE_HTTPS', '').lower() in ('1','true','yes','on'):
     @app.before_request
     def _enforce_https():
         # Respect common proxy header; fall back to request.scheme
-        proto = request.headers.get('X-Forwarded-Proto', request.scheme)
-        if proto != 'https':
-            url = request.url.replace('http://', 'https://', 1)
-            return redirect(url, code=301)
+        proto = request.headers.get('X-Forwarded-Proto') or request.scheme
+        if proto == 'https':
+            return None
+        # Assemble from host + path directly rather than rebuilding request.url from the environ
+        url = 'https://' + request.host + (request.full_path if request.query_string else request.path)
+        return redirect(url, code=301)
 
 # --- Simple in-memory user store (for local dev) ---
 from werkzeug.security import generate_password_hash, check_password_hash
+from config import PASSWORD_HASH_METHOD
+
+# Login validation is optional; fall back to schema-less checks if marshmallow is unavailable
+try:
+    from utils.schemas import LOGIN_SCHEMA
+    from utils.validation import validate_data
+    _HAVE_VALIDATION = True
+except ImportError:
+    _HAVE_VALIDATION = False
 
 DEFAULT_USER = os.environ.get('LPS2_ADMIN_USER', 'admin')
 _pwd_plain = os.environ.get('LPS2_ADMIN_PASSWORD')
 _pwd_hash_env = os.environ.get('LPS2_ADMIN_PASSWORD_HASH')
-if _pwd_hash_env:
-    DEFAULT_HASH = _pwd_hash_env
-else:
-    if not _pwd_plain:
-        _pwd_plain = 'admin123'  # Dev fallback
-        warnings.warn(
-            "\n\n‼️  SECURITY WARNING: Using default admin password 'admin123'.\n"
-            "    This is only for development and MUST be changed in production.\n"
-            "    Set the LPS2_ADMIN_PASSWORD environment variable to a strong, unique password.\n",
-            category=RuntimeWarning, stacklevel=2
-        )
-    DEFAULT_HASH = generate_password_hash(_pwd_plain)
-USERS = {DEFAULT_USER: DEFAULT_HASH}
-ADMIN_USERS = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS', DEFAULT_USER).split(',') if u.strip()}
-
-def login_required(fn):
-    def _wrap(*args, **kwargs):
-        if not session.get('user'):
-            return redirect(url_for('login_page'))
-        return fn(*args, **kwargs)
-    _wrap.__name__ = fn.__name__
-    return _wrap
+# Real passwords use LPS2_PASSWORD_HASH_METHOD or Werkzeug's default (slow) method; the
+# throwaway dev password gets a cheap hash
+_pwd_method = PASSWORD_HASH_METHOD or None
+if not _pwd_hash_env and not _pwd_plain:
+    _pwd_plain = 'admin123'  # Dev fallback
+    _pwd_method = 'pbkdf2:sha256:50000'
+    warnings.warn(
+        "\n\n‼️  SECURITY WARNING: Using default admin password 'admin123'.\n"
+        "    This is only for development and MUST be changed in production.\n"
+        "    Set the LPS2_ADMIN_PASSWORD environment variable to a strong, unique password.\n",
+        category=RuntimeWarning, stacklevel=2
+    )
+DEFAULT_HASH = None
+# Checked against when a login names an unknown user so both paths pay the same hashing cost
+DUMMY_HASH = None
+USERS = {}
+_HASHES_READY = threading.Event()
+# Longest a login waits for the warm-up before answering 503
+_HASH_WARMUP_TIMEOUT = 30
 
-def admin_required(fn):
-    def _wrap(*args, **kwargs):
-        if not session.get('user'):
-            return redirect(url_for('login_page'))
-        if session.get('user') not in ADMIN_USERS:
-            return jsonify({'error': 'forbidden'}), 403
-        return fn(*args, **kwargs)
-    _wrap.__name__ = fn.__name__
-    return _wrap
+def _warm_password_hashes():
+    """Compute the startup password hashes off the import path (pbkdf2 is deliberately slow)."""
+    global DEFAULT_HASH, DUMMY_HASH
+    try:
+        if _pwd_hash_env:
+            default_hash = _pwd_hash_env
+        elif _pwd_method:
+            default_hash = generate_password_hash(_pwd_plain, method=_pwd_method)
+        else:
+            default_hash = generate_password_hash(_pwd_plain)
+        USERS[DEFAULT_USER] = default_hash
+        DEFAULT_HASH = default_hash
+        # Match the dummy's cost to the real hash so unknown-user logins take as long as known ones
+        try:
+            DUMMY_HASH = generate_password_hash(secrets.token_urlsafe(16), method=default_hash.split('$', 1)[0])
+        except Exception as e:
+            # A hash without a Werkzeug 'method$' prefix (e.g. bcrypt) never verifies; it must
+            # not leave unknown-user logins without a dummy either
+            warnings.warn(
+                f"\n\n‼️  LPS2_ADMIN_PASSWORD_HASH is not a Werkzeug hash ({e}); admin logins will fail.\n",
+                category=RuntimeWarning, stacklevel=2
+            )
+            DUMMY_HASH = generate_password_hash(secrets.token_urlsafe(16), method='scrypt')
+    except Exception as e:
+        # Fail closed: no user entry means every login is rejected
+        warnings.warn(f"\n\n‼️  Password hash warm-up failed ({e}); all logins will be rejected.\n",
+                      category=RuntimeWarning, stacklevel=2)
+    finally:
+        # Logins wait on this event; it must be set even when hashing failed
+        _HASHES_READY.set()
+
+def _start_hash_warmup():
+    if not _HASHES_READY.is_set():
+        threading.Thread(target=_warm_password_hashes, name='lps2-pwhash', daemon=True).start()
+
+_start_hash_warmup()
+# A worker forked mid-warmup would never see the event set; redo the work in the child
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_start_hash_warmup)
+
+ADMIN_USERS = frozenset(u.strip() for u in os.environ.get('LPS2_ADMIN_USERS', DEFAULT_USER).split(',') if u.strip())
+ADMIN_USERS_BYTES = tuple(u.encode('utf-8') for u in ADMIN_USERS)
+
+def is_admin_user(user) -> bool:
+    """Constant-time admin membership check (compares against every admin name)."""
+    if not user:
+        return False
+    candidate = user.encode('utf-8')
+    matched = 0
+    for admin in ADMIN_USERS_BYTES:
+        matched |= hmac.compare_digest(candidate, admin)
+    return bool(matched)
+
+def session_is_admin() -> bool:
+    """Admin flag for the current session, computed once at login and cached in the cookie."""
+    user = session.get('user')
+    if not user:
+        return False
+    cached = session.get('is_admin')
+    if cached is None:
+        # Session predates the cached flag
+        cached = is_admin_user(user)
+        session['is_admin'] = cached
+    return cached
+
+def require(role=None):
+    """Decorator factory: require a session user, and admin rights when role='admin'."""
+    def deco(fn):
+        @wraps(fn)
+        def _wrap(*args, **kwargs):
+            if not session.get('user'):
+                return redirect(url_for('login_page'))
+            if role == 'admin' and not session_is_admin():
+                return ojson({'error': 'forbidden'}, 403)
+            return fn(*args, **kwargs)
+        return _wrap
+    return deco
+
+login_required = require()
+admin_required = require('admin')
 
 
 # Initialize chat route
 init_chat_route(app)
 
 # Serve the UI
+# HTML shells are read once at startup and revalidated by ETag; debug mode re-reads them so edits show up
+_HTML_SHELLS = ('index.html', 'login.html', 'admin.html')
+_STATIC_CACHE = {}
+
+def _load_html(name):
+    with open(os.path.join(app.static_folder, name), 'rb') as f:
+        body = f.read()
+    entry = (body, hashlib.sha256(body).hexdigest())
+    _STATIC_CACHE[name] = entry
+    return entry
+
+for _name in _HTML_SHELLS:
+    _load_html(_name)
+
+def _cached_html(name):
+    body, tag = _load_html(name) if app.debug else _STATIC_CACHE[name]
+    if request.if_none_match.contains(tag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(body, mimetype='text/html')
+    resp.set_etag(tag)
+    resp.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return resp
+
 @app.route('/')
-@login_required
+@require()
 def index():
-    return send_from_directory(app.static_folder, 'index.html')
+    return _cached_html('index.html')
 
 @app.route('/login', methods=['GET'])
 def login_page():
     # If already logged in, redirect to app
     if session.get('user'):
         return redirect('/')
-    return send_from_directory(app.static_folder, 'login.html')
+    return _cached_html('login.html')
 
 @app.route('/login', methods=['POST'])
 def login_post():
     # Step 1: Extract and validate credentials
-    try:
-        # Import here to avoid circular imports
-        from utils.schemas import LoginSchema
-        from utils.validation import validate_data
-        data = request.json if request.is_json else request.form
-        is_valid, validated_data, errors = validate_data(data, LoginSchema)
+    data = (request.json if request.is_json else request.form) or {}
+    if _HAVE_VALIDATION:
+        is_valid, validated_data, errors = validate_data(data, LOGIN_SCHEMA)
         if not is_valid:
-            return jsonify({'error': 'validation_error', 'message': 'Invalid login credentials', 'details': errors}), 400
+            return ojson({'error': 'validation_error', 'message': 'Invalid login credentials', 'details': errors}, 400)
         username = validated_data['username'].strip()
         password = validated_data['password']
-    except ImportError:
-        # Fallback if validation module is not available
-        data = request.json if request.is_json else request.form
-        username = (data.get('username') or '').strip()
-        password = data.get('password') or ''
-        if not username or not password:
-            return jsonify({'error': 'missing_credentials'}), 400
-    except Exception as e:
-        # Log the error but continue with a simple schema-less validation
-        app.logger.error(f"Login validation error: {str(e)}")
-        data = request.json if request.is_json else request.form
+    else:
         username = (data.get('username') or '').strip()
         password = data.get('password') or ''
         if not username or not password:
-            return jsonify({'error': 'missing_credentials'}), 400
+            return ojson({'error': 'missing_credentials'}, 400)
+    return _verify_and_login(username, password)
 
+def _verify_and_login(username, password):
+    """Check credentials in constant time and establish the session on success."""
     # Step 2: Verify credentials
+    if not _HASHES_READY.wait(_HASH_WARMUP_TIMEOUT):
+        return ojson({'error': 'starting_up'}, 503, headers={'Retry-After': '5'})
     stored = USERS.get(username)
-    if not stored or not check_password_hash(stored, password):
-        return jsonify({'error': 'invalid_credentials'}), 401
+    ok_user = stored is not None
+    try:
+        ok_pw = check_password_hash(stored if ok_user else DUMMY_HASH, password)
+    except Exception:
+        # Malformed stored hash (or no dummy after a failed warm-up): reject, never raise
+        ok_pw = False
+    if not (ok_user and ok_pw):
+        return ojson({'error': 'invalid_credentials'}, 401)
 
     # Step 3: Establish session
     session['user'] = username
+    session['is_admin'] = is_admin_user(username)
     session['csrf_token'] = secrets.token_urlsafe(32)
     session['login_time'] = int(time.time())
     session['last_activity'] = int(time.time())
     session.permanent = True
-    return jsonify({'ok': True, 'user': username})
+    return ojson({'ok': True, 'user': username})
 
 @app.route('/logout', methods=['POST'])
 def logout():
-    session.pop('user', None)
-    session.pop('csrf_token', None)
-    session.pop('login_time', None)
-    session.pop('last_activity', None)
-    return jsonify({'ok': True})
+    clear_history(session.get('sid'))
+    session.clear()
+    return ojson({'ok': True})
+
+# Probes hit this constantly; the body never changes so it is encoded once
+_HEALTH_RESP_BODY = b'{"status":"ok"}'
 
 @app.route('/health')
 def health():
-    return jsonify({'status': 'ok'})
+    return app.response_class(_HEALTH_RESP_BODY, mimetype='application/json', headers={'Cache-Control': 'no-store'})
 
 @app.route('/auth/status')
 def auth_status():
@@ -173,29 +290,107 @@ def auth_status():
     if user and not token:
         token = secrets.token_urlsafe(32)
         session['csrf_token'] = token
-    is_admin = bool(user in ADMIN_USERS) if user else False
-    return jsonify({'authenticated': bool(user), 'user': user, 'csrf_token': token, 'is_admin': is_admin})
+    is_admin = session_is_admin()
+    # The payload only changes on login/logout, so let polling clients revalidate with If-None-Match
+    tag = hashlib.blake2b(f"{user}|{token}|{is_admin}".encode('utf-8'), digest_size=16).hexdigest()
+    if request.if_none_match.contains(tag):
+        resp = app.response_class(status=304)
+    else:
+        resp = ojson({'authenticated': bool(user), 'user': user, 'csrf_token': token, 'is_admin': is_admin})
+    resp.set_etag(tag)
+    resp.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return resp
+
+@app.after_request
+def _vary_on_cookie(response):
+    # Session-dependent pages must never be shared between users by caches
+    if request.endpoint in {'auth_status', 'index', 'login_page', 'admin_page'}:
+        response.vary.add('Cookie')
+    return response
+
+class NoSessionForStatic:
+    """WSGI middleware that drops the Cookie header for requests that never read the session.
+
+    Flask verifies the signed session cookie on every request that carries one; static
+    assets and health probes do not need it. Static HTML shells are left alone because
+    the login redirect in _enforce_login_and_timeouts depends on the session.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == '/health' or (path.startswith('/static/') and not path.lower().endswith('.html')):
+            environ.pop('HTTP_COOKIE', None)
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = NoSessionForStatic(app.wsgi_app)
 
 # --- Session enforcement and timeouts ---
+# Absolute session lifetime for Flask's permanent session cookie behavior
+try:
+    app.permanent_session_lifetime = timedelta(seconds=int(os.environ.get('LPS2_SESSION_ABSOLUTE_SECONDS', '28800')))
+except Exception:
+    pass
+
+# Whole-second clock refreshed by a daemon thread so requests read a list slot instead of calling time.time()
+_NOW = [int(time.time())]
+# Only re-sign the session cookie for idle tracking once this many seconds have passed
+ACTIVITY_REFRESH_SECONDS = 30
+
+def _tick():
+    while True:
+        _NOW[0] = int(time.time())
+        time.sleep(1)
+
+def _start_ticker():
+    _NOW[0] = int(time.time())
+    threading.Thread(target=_tick, name='lps2-clock', daemon=True).start()
+
+_start_ticker()
+# Threads do not survive fork (e.g. gunicorn --preload); restart the ticker in each worker
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_start_ticker)
+
+# Werkzeug rejects larger bodies with 413 before any view runs; sized for the
+# biggest route limit (10MB /kb/ingest) plus multipart overhead
+app.config['MAX_CONTENT_LENGTH'] = 11 * 1024 * 1024
+
+# Avoid rewriting the permanent session cookie on requests that did not modify it
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+
+# Endpoints reachable without a session (no timeout bookkeeping either)
+_OPEN_ENDPOINTS = frozenset({'health', 'auth_status', 'login_page', 'login_post'})
+_STATIC_HTML_RE = re.compile(r'^/static/.*\.html$', re.IGNORECASE)
+
 @app.before_request
 def _enforce_login_and_timeouts():
+    endpoint = request.endpoint
     # Allow health and auth status without auth
-    if request.endpoint in {'health', 'auth_status', 'login_page', 'login_post'}:
+    if endpoint in _OPEN_ENDPOINTS:
         return None
 
     path = request.path or ''
+    is_static_html = False
+    if endpoint == 'static':
+        # JS/CSS/images need no session checks; only the HTML shells are guarded
+        is_static_html = bool(_STATIC_HTML_RE.match(path))
+        if not is_static_html:
+            return None
+
     # Block direct access to static HTML except login.html when not authenticated
     if not session.get('user'):
         if path in {'/', '/admin'}:
             return redirect(url_for('login_page'))
-        if path.startswith('/static/') and path.lower().endswith('.html') and not path.endswith('/login.html') and not path.endswith('login.html'):
+        if is_static_html and not path.endswith('login.html'):
             return redirect(url_for('login_page'))
         # For API routes without session, allow existing key-based flows to proceed.
         # UI routes will be guarded by above conditions.
         return None
 
     # Session present: enforce idle and absolute timeouts
-    now_ts = int(time.time())
+    now_ts = _NOW[0]
     try:
         idle_limit = int(os.environ.get('LPS2_SESSION_IDLE_SECONDS', '1800'))  # 30 minutes default
     except Exception:
@@ -219,32 +414,23 @@ def _enforce_login_and_timeouts():
 
     if expired:
         # Clear session and respond appropriately (JSON vs HTML)
-        session.pop('user', None)
-        session.pop('csrf_token', None)
-        session.pop('login_time', None)
-        session.pop('last_activity', None)
-        wants_json = request.is_json or (request.accept_mimetypes.best == 'application/json')
-        if wants_json or request.path.startswith('/chat') or request.path.startswith('/admin/llm-endpoints'):
-            return jsonify({'error': 'session_expired', 'reason': reason}), 401
+        session.clear()
+        if path.startswith(('/chat', '/admin/llm-endpoints')) or request.is_json or request.accept_mimetypes.best == 'application/json':
+            return ojson({'error': 'session_expired', 'reason': reason}, 401)
         return redirect(url_for('login_page'))
 
-    # Refresh idle timer
-    session['last_activity'] = now_ts
+    # Refresh idle timer (coarse-grained to keep most requests from touching the cookie)
+    if now_ts - last_activity >= ACTIVITY_REFRESH_SECONDS:
+        session['last_activity'] = now_ts
     return None
 
 @app.route('/admin')
-@login_required
-@admin_required
+@require('admin')
 def admin_page():
-    return send_from_directory(app.static_folder, 'admin.html')
+    return _cached_html('admin.html')
 
-if __name__ == '__main__':
-    # Configure absolute session lifetime for Flask's permanent session cookie behavior
-    try:
-        _abs_secs = int(os.environ.get('LPS2_SESSION_ABSOLUTE_SECONDS', '28800'))
-        app.permanent_session_lifetime = timedelta(seconds=_abs_secs)
-    except Exception:
-        pass
+def main():
+    """Run Flask's built-in development server (single process; set LPS2_DEV=1)."""
     enable_tls = os.environ.get('LPS2_ENABLE_TLS', '').lower() in ('1','true','yes','on')
     cert_path = os.environ.get('LPS2_TLS_CERT')
     key_path = os.environ.get('LPS2_TLS_KEY')
@@ -259,5 +445,15 @@ if __name__ == '__main__':
     else:
         print('[TLS] Running without TLS (HTTP). Set LPS2_ENABLE_TLS=1 and provide LPS2_TLS_CERT/LPS2_TLS_KEY to enable.')
     print(f"[LPS2] Listening on port {port} (TLS={'on' if ssl_context else 'off'})")
+    # No fork happens here, so the embedding warm-up runs in this process
+    start_embedding_warmup()
     # NOTE: Built-in Flask server is not production grade; for production use gunicorn/uwsgi behind a real web server.
-    app.run(host='0.0.0.0', port=port, ssl_context=ssl_context)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, ssl_context=ssl_context)
+
+if __name__ == '__main__':
+    if os.environ.get('LPS2_DEV', '').lower() in ('1','true','yes','on'):
+        main()
+    else:
+        print('[LPS2] The built-in server is for development only (set LPS2_DEV=1 to use it).')
+        print('[LPS2] Production: gunicorn -c gunicorn.conf.py   (gthread workers, see gunicorn.conf.py)')
+        sys.exit(1)
@@ -4,11 +4,16 @@ Loads environment variables and provides defaults for demo.
 In production, never hard-code secrets; rely on env / secret manager.
 """
 from __future__ import annotations
+import hashlib
 import os
+import re
 
 # --- Simple .env loader (no external dependency) ---------------------------
 # Loads key=value lines from a .env file located at project root (parent of src)
 # Only sets variables that are not already present in the environment.
+# Comment lines never match: the key must start with a letter or underscore.
+_ENV_LINE_RE = re.compile(r'^[ \t]*([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*(.*?)[ \t]*$', re.MULTILINE)
+
 def _load_dotenv():
     try:
         root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -16,17 +21,10 @@ def _load_dotenv():
         if not os.path.exists(env_path):
             return
         with open(env_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                if '=' not in line:
-                    continue
-                k, v = line.split('=', 1)
-                k = k.strip()
-                # Preserve existing explicit exports
-                if k and k not in os.environ:
-                    os.environ[k] = v.strip()
+            content = f.read()
+        for m in _ENV_LINE_RE.finditer(content):
+            # Preserve existing explicit exports
+            os.environ.setdefault(m.group(1), m.group(2))
     except Exception:
         # Fail silently – config falls back to defaults
         pass
@@ -55,28 +53,70 @@ ADMIN_RATE_LIMIT_MAX = int(os.environ.get('LPS2_ADMIN_RATE_MAX', '600'))
 ADMIN_RATE_LIMIT_BURST = int(os.environ.get('LPS2_ADMIN_RATE_BURST', '120'))
 
 CSRF_TOKEN_EXPIRY = int(os.environ.get('LPS2_CSRF_EXPIRY', '3600'))  # CSRF token expires after 1 hour by default
+# Werkzeug method for stored password hashes; empty keeps Werkzeug's default (scrypt).
+# 'pbkdf2:sha256:<iterations>' runs as one OpenSSL call (SHA-NI accelerated where present)
+PASSWORD_HASH_METHOD = os.environ.get('LPS2_PASSWORD_HASH_METHOD', '').strip()
+
+def _valid_hash_method(method: str) -> bool:
+    """Mirror Werkzeug's method parsing without paying for a hash at import."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        return not args or (len(args) == 3 and all(a.isdigit() for a in args))
+    if name == 'pbkdf2':
+        if len(args) > 2 or (args and args[0] not in hashlib.algorithms_available):
+            return False
+        return len(args) < 2 or args[1].isdigit()
+    return False
+
+if PASSWORD_HASH_METHOD and not _valid_hash_method(PASSWORD_HASH_METHOD):
+    raise ValueError(
+        f"Invalid LPS2_PASSWORD_HASH_METHOD {PASSWORD_HASH_METHOD!r}; "
+        "use 'scrypt', 'scrypt:<n>:<r>:<p>' or 'pbkdf2:<hash>:<iterations>'"
+    )
+
+# Server-side chat history: idle entries are evicted after this long (defaults to the absolute session lifetime)
+HISTORY_TTL_SECONDS = int(os.environ.get('LPS2_HISTORY_TTL', os.environ.get('LPS2_SESSION_ABSOLUTE_SECONDS', '28800')))
+HISTORY_MAX_MESSAGES = int(os.environ.get('LPS2_HISTORY_MAX', '20'))
+HISTORY_MAX_SESSIONS = int(os.environ.get('LPS2_HISTORY_SESSIONS', '10000'))
 
 QUARANTINE_ENABLED = os.environ.get('LPS2_QUARANTINE', '1') not in ('0','false','no')
 PII_REDACT_ENABLED = os.environ.get('LPS2_PII_REDACT', '1') not in ('0','false','no')
 
 # Simple regex patterns for PII/Secrets (MVP heuristic)
+# Flags are scoped inline so the patterns can be fused into a single alternation below.
 PII_PATTERNS = {
     'email': r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}',
     'ipv4': r'\b(?:\d{1,3}\.){3}\d{1,3}\b',
     'ssn_like': r'\b\d{3}-\d{2}-\d{4}\b',
     'credit_card': r'\b(?:\d[ -]*?){13,16}\b',
     'aws_access_key': r'AKIA[0-9A-Z]{16}',
-    'generic_secret': r'(?i)(api|secret|token|key)[=: ]+[A-Za-z0-9-_]{8,}'
+    'generic_secret': r'(?i:(?:api|secret|token|key)[=: ]+[A-Za-z0-9-_]{8,})'
 }
 
 REDACTION_REPLACEMENT = '[REDACTED]'
 
+# Compiled once at import; PII_COMBINED scans text in a single pass (match.lastgroup names the pattern)
+PII_PATTERNS_COMPILED = {name: re.compile(pat) for name, pat in PII_PATTERNS.items()}
+PII_COMBINED = re.compile('|'.join(f'(?P<{name}>{pat})' for name, pat in PII_PATTERNS.items()))
+
+def redact(text: str) -> str:
+    """Replace every PII/secret match in text with REDACTION_REPLACEMENT."""
+    return PII_COMBINED.sub(REDACTION_REPLACEMENT, text)
+
 # LLM generation controls (tunable via environment)
 MAX_OUTPUT_TOKENS = int(os.environ.get('LPS2_MAX_TOKENS', '2048'))  # per single request (default increased)
 AUTO_CONTINUE = os.environ.get('LPS2_AUTO_CONTINUE', '1') not in ('0','false','no')
 CONTINUE_ROUNDS = int(os.environ.get('LPS2_CONTINUE_ROUNDS', '2'))  # max follow-up continuations if length-capped
 GEN_TEMPERATURE = float(os.environ.get('LPS2_TEMPERATURE', '0.7'))
 TOP_P = float(os.environ.get('LPS2_TOP_P', '0.95'))
+# Semantic response cache (temperature 0 only): reuse an answer when a new final user message
+# is at least this cosine-similar to a cached one under the same prior context; 0 disables
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('LPS2_SEMANTIC_CACHE', '0'))
+SEMANTIC_CACHE_SIZE = int(os.environ.get('LPS2_SEMANTIC_CACHE_SIZE', '1000'))
+SEMANTIC_CACHE_TTL = int(os.environ.get('LPS2_SEMANTIC_CACHE_TTL', '3600'))
+# Exact-match response cache (temperature 0 only): identical endpoint, messages, tools and
+# generation settings replay the stored answer; 0 disables
+EXACT_CACHE_SIZE = int(os.environ.get('LPS2_EXACT_CACHE_SIZE', '2000'))
 
 # LLM server base URL (OpenAI-compatible). Override with LPS2_LLM_ENDPOINT env var.
 # Default local LM Studio (or other OpenAI-compatible) endpoint.
@@ -1,23 +1,46 @@
-from flask import Blueprint, request, jsonify, session
-import io
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context
 from utils.llm_client import LLMClient
 from utils.memory_store import get_memory_store
-from utils.knowledge_store import get_knowledge_store
-from utils.security_utils import sanitize_text, build_guardrail_preamble, redact_pii
+from utils.knowledge_store import get_knowledge_store, CURRENT_EMBEDDING_MODEL_NAME
+from utils.security_utils import sanitize_text, sanitize_texts, build_guardrail_preamble, redact_pii
 from config import API_KEY, QUARANTINE_ENABLED, LLM_SERVER_URL
 from utils.rate_limiter import check_rate
 from utils.audit_logger import audit, read_audit  # added
+from utils.history_store import get_history, append_history, clear_history
+from utils.json_utils import loads as json_loads, dumps_bytes
+from utils.embeddings import start_embedding_warmup
+from utils.document_extract import extract_pdf_text, hash_stream, ExtractionError
 import os
+import re
+import json
+import time
+import atexit
+import queue
+import secrets
+import shutil
+import stat
+import tempfile
+import threading
+import concurrent.futures
 from functools import wraps
-import base64
 from io import BytesIO
 import logging
-from collections import deque
+import array
+from typing import Optional
+import requests
+from requests.adapters import HTTPAdapter
 try:
-    from PIL import Image
+    from PIL import Image, ImageOps
     _PIL_AVAILABLE = True
 except Exception:
     _PIL_AVAILABLE = False
+# Chat request validation is optional; skipped when marshmallow is unavailable
+try:
+    from utils.schemas import CHAT_MESSAGE_SCHEMA
+    from utils.validation import validate_data
+    _HAVE_VALIDATION = True
+except ImportError:
+    _HAVE_VALIDATION = False
 
 # Basic logger setup (idempotent)
 logger = logging.getLogger("chat")
@@ -30,11 +53,36 @@ logger.setLevel(logging.INFO)
 
 chat_bp = Blueprint('chat', __name__)
 llm_client = LLMClient(LLM_SERVER_URL)
-_MODEL_LATENCIES = deque(maxlen=50)  # seconds
+# Last _LAT_WINDOW model latencies (seconds) as packed doubles; _LAT_IDX counts
+# samples ever written and _LAT_SUM is the window's running total. Writers take
+# _LAT_LOCK (a lost update would skew the sum for good); readers do not.
+_LAT_WINDOW = 50
+_LAT_BUF = array.array('d', [0.0] * _LAT_WINDOW)
+_LAT_IDX = 0
+_LAT_SUM = 0.0
+_LAT_LOCK = threading.Lock()
+
+def _record_latency(seconds: float):
+    global _LAT_IDX, _LAT_SUM
+    with _LAT_LOCK:
+        i = _LAT_IDX
+        slot = i % _LAT_WINDOW
+        _LAT_SUM += seconds - _LAT_BUF[slot]  # slot holds 0.0 until the window fills
+        _LAT_BUF[slot] = seconds
+        if slot == _LAT_WINDOW - 1:
+            _LAT_SUM = sum(_LAT_BUF)  # resync once per lap so float error cannot accumulate
+        _LAT_IDX = i + 1
+
+def _avg_latency():
+    """Mean of the recorded window, or None before the first sample (O(1))."""
+    n = min(_LAT_IDX, _LAT_WINDOW)
+    if not n:
+        return None
+    return _LAT_SUM / n
 
 # --- Inference Endpoint Profiles (Option 5) ---------------------------------
-import json, time, threading
 _PROFILES_LOCK = threading.Lock()
+_HTTP_SCHEMES = ('http://', 'https://')
 _PROFILES_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'inference_profiles.json'))
 _ENDPOINT_PROFILES = { 'profiles': {}, 'active': None }
 
@@ -60,28 +108,32 @@ def _save_profiles():
 
 _load_profiles()
 
+# Shared session so repeated probes reuse keep-alive connections (and TLS sessions)
+_HTTP = requests.Session()
+_HTTP.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_HTTP.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
 def _test_endpoint_connectivity(endpoint: str, timeout: float = 4.0):
     """Attempt to fetch /v1/models and measure latency.
 
     Returns dict: {ok: bool, latency_ms?, model?, error?, detail?, checked_at}
     """
     start = time.time()
-    import requests as _req
     endpoint_clean = (endpoint or '').strip().rstrip('/')
     if not endpoint_clean:
         return {'ok': False, 'error': 'invalid', 'detail': 'empty', 'checked_at': time.time()}
-    if not (endpoint_clean.startswith('http://') or endpoint_clean.startswith('https://')):
+    if not endpoint_clean.startswith(_HTTP_SCHEMES):
         return {'ok': False, 'error': 'invalid_scheme', 'detail': 'must start http:// or https://', 'checked_at': time.time()}
     url = endpoint_clean + '/v1/models'
     try:
-        resp = _req.get(url, timeout=timeout)
-    except _req.exceptions.ConnectTimeout:
+        resp = _HTTP.get(url, timeout=timeout)
+    except requests.exceptions.ConnectTimeout:
         return {'ok': False, 'error': 'timeout', 'detail': 'connect_timeout', 'checked_at': time.time()}
-    except _req.exceptions.ReadTimeout:
+    except requests.exceptions.ReadTimeout:
         return {'ok': False, 'error': 'timeout', 'detail': 'read_timeout', 'checked_at': time.time()}
-    except _req.exceptions.SSLError as e:
+    except requests.exceptions.SSLError as e:
         return {'ok': False, 'error': 'ssl_error', 'detail': str(e), 'checked_at': time.time()}
-    except _req.exceptions.ConnectionError as e:
+    except requests.exceptions.ConnectionError as e:
         return {'ok': False, 'error': 'connection_refused', 'detail': str(e), 'checked_at': time.time()}
     except Exception as e:
         return {'ok': False, 'error': 'request_failed', 'detail': str(e), 'checked_at': time.time()}
@@ -89,7 +141,7 @@ def _test_endpoint_connectivity(endpoint: str, timeout: float = 4.0):
     if resp.status_code != 200:
         return {'ok': False, 'error': 'http_error', 'detail': f'status {resp.status_code}', 'latency_ms': round(elapsed_ms,1), 'checked_at': time.time()}
     try:
-        data = resp.json()
+        data = json_loads(resp.content)
     except Exception:
         return {'ok': False, 'error': 'invalid_response', 'detail': 'non-json', 'latency_ms': round(elapsed_ms,1), 'checked_at': time.time()}
     models = data.get('data') or []
@@ -99,18 +151,69 @@ def _test_endpoint_connectivity(endpoint: str, timeout: float = 4.0):
     return {'ok': True, 'endpoint': endpoint_clean, 'model': model_id, 'latency_ms': round(elapsed_ms,1), 'checked_at': time.time()}
 
 
-def _validate_csrf_if_session():
+# Probes run on a small bounded pool so each request waits a uniform wall-clock
+# budget (requests' own timeout applies per connect/read, not in total)
+_PROBE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm-probe')
+_PROBE_DEADLINE = 5.0
+
+# /chat runs its memory and knowledge searches side by side on this pool
+_RETRIEVAL_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='retr')
+
+# Background /kb/ingest uploads (async=1). Job state is a small JSON file per job,
+# swept after _INGEST_JOB_TTL; a job interrupted by a restart stays 'pending'
+# until then, so the admin page stops polling after a deadline.
+_INGEST_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='kb-ingest')
+# Next to the stores rather than in the shared temp dir, where another local user could pre-create it
+_INGEST_JOB_DIR = os.environ.get('LPS2_INGEST_JOB_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils', 'ingest_jobs'))
+_INGEST_JOB_TTL = 3600
+_JOB_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+_KB_UPLOAD_MAX = 10 * 1024 * 1024
+# Async job copies stay in memory up to this size, then spill to a temp file
+_KB_SPOOL_MEMORY = 2 * 1024 * 1024
+
+def _probe_endpoint(endpoint: str) -> dict:
+    """Run _test_endpoint_connectivity on the probe pool, bounded by _PROBE_DEADLINE."""
+    future = _PROBE_POOL.submit(_test_endpoint_connectivity, endpoint)
+    try:
+        return future.result(timeout=_PROBE_DEADLINE)
+    except concurrent.futures.TimeoutError:
+        return {'ok': False, 'error': 'timeout', 'detail': 'probe_deadline', 'checked_at': time.time()}
+
+
+def _json_body() -> dict:
+    """Parse the request body as a JSON object once.
+
+    Falls back to a manual parse when the client sent JSON without a JSON
+    Content-Type. Returns {} when there is no usable object body.
+    """
+    data = request.get_json(silent=True)
+    if data is None and request.data:
+        try:
+            raw = request.get_data()
+            if raw.lstrip().startswith(b'{'):
+                data = json_loads(raw)
+        except Exception as e:
+            logger.error(f"Error with manual JSON parse of request body: {str(e)}")
+    return data if isinstance(data, dict) else {}
+
+
+def _validate_csrf_if_session(body: Optional[dict] = None, user: Optional[str] = None):
     """Validate CSRF token for unsafe methods when using session auth.
 
     Skips validation for safe methods or when no session user is present (API key only flows).
     Expects token in header 'X-CSRF-Token' or JSON body field 'csrf_token'.
+    Pass the already-parsed JSON body as ``body`` and the session user as ``user``
+    to avoid re-reading them.
     Returns a Flask response on failure, or None on success.
     """
     if request.method in ('GET','HEAD','OPTIONS'):
         logger.debug("Skipping CSRF validation for safe method")
         return None
         
-    if not session.get('user'):
+    if user is None:
+        user = session.get('user')
+    if not user:
         logger.debug("Skipping CSRF validation for non-session request")
         return None
     
@@ -118,10 +221,9 @@ def _validate_csrf_if_session():
     expected = session.get('csrf_token')
     if not expected:
         # Generate a token if missing - useful for development
-        from secrets import token_urlsafe
-        expected = token_urlsafe(32)
+        expected = secrets.token_urlsafe(32)
         session['csrf_token'] = expected
-        logger.warning(f"Generated new CSRF token in session for user {session.get('user')}")
+        logger.warning(f"Generated new CSRF token in session for user {user}")
     
     # Look for token in headers first (preferred)
     provided = request.headers.get('X-CSRF-Token')
@@ -131,30 +233,14 @@ def _validate_csrf_if_session():
         logger.debug("CSRF from header: (none)")
     
     # Fall back to JSON body if not in headers
-    if not provided and request.is_json:
-        try:
-            provided = (request.json or {}).get('csrf_token')
-            if provided:
-                logger.debug(f"CSRF from JSON: {provided[:5]}... (if present)")
-            else:
-                logger.debug("CSRF from JSON: (none)")
-        except Exception as e:
-            logger.error(f"Error extracting CSRF from JSON: {str(e)}")
-            provided = None
-    
-    # Try manual JSON parse if all else fails (handles Content-Type issues)
-    if not provided and request.data:
-        try:
-            body = request.get_data().decode('utf-8')
-            if body.strip().startswith('{'):
-                data = json.loads(body)
-                provided = data.get('csrf_token')
-                if provided:
-                    logger.debug(f"CSRF from manual parse: {provided[:5]}... (if present)")
-                else:
-                    logger.debug("CSRF from manual parse: (none)")
-        except Exception as e:
-            logger.error(f"Error with manual JSON parse for CSRF: {str(e)}")
+    if not provided:
+        if body is None:
+            body = _json_body()
+        provided = body.get('csrf_token')
+        if provided:
+            logger.debug(f"CSRF from JSON: {provided[:5]}... (if present)")
+        else:
+            logger.debug("CSRF from JSON: (none)")
     
     # Try form data as last resort
     if not provided and request.form:
@@ -166,15 +252,15 @@ def _validate_csrf_if_session():
     
     # Check if token is valid - log full details for debugging
     if not provided:
-        logger.warning(f"CSRF validation failed: No CSRF token provided in request for user {session.get('user')}")
-        logger.warning(f"Headers: {dict(request.headers)}")
+        logger.warning(f"CSRF validation failed: No CSRF token provided in request for user {user}")
         logger.warning(f"Request method: {request.method}")
         logger.warning(f"Content-Type: {request.content_type}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("CSRF failure headers: %s", dict(request.headers))
         
         # In development, regenerate token and continue
         if os.environ.get('FLASK_ENV') == 'development' or os.environ.get('LPS2_DEBUG_CSRF'):
-            from secrets import token_urlsafe
-            new_token = token_urlsafe(32)
+            new_token = secrets.token_urlsafe(32)
             session['csrf_token'] = new_token
             logger.warning(f"Development mode: Generated new token and continuing")
             return None
@@ -202,20 +288,81 @@ def _validate_csrf_if_session():
     return None
 
 # --- Runtime LLM endpoint management helpers ---------------------------------
+# .env persistence is debounced on a background thread: rapid endpoint updates
+# coalesce into one rewrite per _ENV_FLUSH_INTERVAL instead of one per request
+_ENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
+_ENV_FLUSH_INTERVAL = 1.0
+_ENV_PENDING = {'endpoint': None}
+_ENV_DIRTY = threading.Event()
+_ENV_LOCK = threading.Lock()
+_ENV_FLUSHER = None
+
+def _write_env_endpoint(clean: str):
+    """Upsert LPS2_LLM_ENDPOINT in the project .env file (atomic replace)."""
+    lines = []
+    found = False
+    if os.path.exists(_ENV_PATH):
+        with open(_ENV_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                stripped = line.strip()
+                if stripped.startswith('LPS2_LLM_ENDPOINT='):
+                    lines.append(f'LPS2_LLM_ENDPOINT={clean}\n')
+                    found = True
+                else:
+                    lines.append(line)
+    if not found:
+        lines.append(f'LPS2_LLM_ENDPOINT={clean}\n')
+    tmp = _ENV_PATH + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    os.replace(tmp, _ENV_PATH)
+
+def _flush_env():
+    """Write the pending endpoint, if any."""
+    with _ENV_LOCK:
+        clean = _ENV_PENDING['endpoint']
+        _ENV_PENDING['endpoint'] = None
+    if clean:
+        try:
+            _write_env_endpoint(clean)
+        except Exception as e:
+            logger.error(f"env_persist_failed: {e}")
+
+def _env_flusher():
+    while True:
+        _ENV_DIRTY.wait()
+        _ENV_DIRTY.clear()
+        _flush_env()
+        time.sleep(_ENV_FLUSH_INTERVAL)
+
+def _schedule_env_persist(clean: str):
+    """Queue clean for the .env file; the flusher thread starts on first use (after any fork)."""
+    global _ENV_FLUSHER
+    with _ENV_LOCK:
+        _ENV_PENDING['endpoint'] = clean
+        if _ENV_FLUSHER is None or not _ENV_FLUSHER.is_alive():
+            _ENV_FLUSHER = threading.Thread(target=_env_flusher, name='env-flusher', daemon=True)
+            _ENV_FLUSHER.start()
+    _ENV_DIRTY.set()
+
+# Daemon threads die with the interpreter; write anything still pending on exit
+atexit.register(_flush_env)
+
 def _update_llm_endpoint(new_endpoint: str, persist: bool = False):
     """Update the global llm_client base URL at runtime. Optionally persist to .env.
 
     Args:
         new_endpoint: Base URL like http://host:port
-        persist: If True, upsert LPS2_LLM_ENDPOINT in project .env file (idempotent)
+        persist: If True, schedule an upsert of LPS2_LLM_ENDPOINT in the project .env file
+            (written in the background, at most once per second)
     """
     global llm_client
     clean = (new_endpoint or '').strip().rstrip('/')
     if not clean:
         raise ValueError('empty endpoint')
-    if not (clean.startswith('http://') or clean.startswith('https://')):
+    if not clean.startswith(_HTTP_SCHEMES):
         raise ValueError('endpoint must start with http:// or https://')
-    # Live mutate existing client to avoid losing latency deque
+    # Live mutate existing client rather than swapping instances
     try:
         llm_client.server_base = clean
         llm_client.api_url = clean + '/v1/chat/completions'
@@ -224,28 +371,7 @@ def _update_llm_endpoint(new_endpoint: str, persist: bool = False):
         llm_client = LLMClient(clean)
     os.environ['LPS2_LLM_ENDPOINT'] = clean  # For any child processes / subsequent imports
     if persist:
-        try:
-            root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-            env_path = os.path.join(root, '.env')
-            lines = []
-            found = False
-            if os.path.exists(env_path):
-                with open(env_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        stripped = line.strip()
-                        if stripped.startswith('LPS2_LLM_ENDPOINT='):
-                            lines.append(f'LPS2_LLM_ENDPOINT={clean}\n')
-                            found = True
-                        else:
-                            lines.append(line)
-            if not found:
-                lines.append(f'LPS2_LLM_ENDPOINT={clean}\n')
-            tmp = env_path + '.tmp'
-            with open(tmp, 'w', encoding='utf-8') as f:
-                f.writelines(lines)
-            os.replace(tmp, env_path)
-        except Exception as e:
-            raise RuntimeError(f'persist_failed: {e}')
+        _schedule_env_persist(clean)
     return clean
 def require_api_key(fn):
     """Decorator that enforces API key unless a logged-in session user exists.
@@ -269,79 +395,68 @@ def require_api_key(fn):
         return fn(*args, **kwargs)
     return _wrap
 
+# Parsed once at import; admin membership does not change while the process runs
+_ADMINS = frozenset(u.strip() for u in os.environ.get('LPS2_ADMIN_USERS', '').split(',') if u.strip())
+
+def require_admin(fn):
+    """Decorator restricting a route to LPS2_ADMIN_USERS when a session user is present.
+
+    API-key callers (no session) and deployments without LPS2_ADMIN_USERS are
+    left to require_api_key, matching the previous per-route checks.
+    """
+    @wraps(fn)
+    def _wrap(*args, **kwargs):
+        user = session.get('user')
+        if user and _ADMINS and user not in _ADMINS:
+            logger.warning(f"Admin check failed: {user} not in LPS2_ADMIN_USERS")
+            return jsonify({'error':'forbidden'}), 403
+        return fn(*args, **kwargs)
+    return _wrap
+
 # --- Profile management routes (placed after require_api_key definition) ---
 @chat_bp.route('/admin/llm-endpoints/profiles', methods=['GET'])
 @require_api_key
+@require_admin
 def list_profiles():
-    # Admin-only (session user must be admin if session present)
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
+    # Shallow per-profile copies suffice: nested last_test dicts are replaced, never mutated in place
     with _PROFILES_LOCK:
-        data = json.loads(json.dumps(_ENDPOINT_PROFILES))
-    return jsonify(data)
+        snapshot = {
+            'active': _ENDPOINT_PROFILES.get('active'),
+            'profiles': {k: dict(v) for k, v in _ENDPOINT_PROFILES.get('profiles', {}).items()},
+        }
+    return jsonify(snapshot)
 
 @chat_bp.route('/admin/llm-endpoints/profiles/test', methods=['POST'])
 @require_api_key
+@require_admin
 def test_profile_endpoint():
     """Test the connectivity of an LLM endpoint.
     
     This route takes an endpoint URL, tries to connect to it,
     and returns information about the connection test.
     """
-    # Comprehensive debugging for troubleshooting
-    logger.info(f"==== TEST ENDPOINT REQUEST ====")
-    logger.info(f"Method: {request.method}")
-    logger.info(f"Content-Type: {request.content_type}")
-    logger.info(f"Headers: {dict(request.headers)}")
-    logger.info(f"Is JSON: {request.is_json}")
-    logger.info(f"Session user: {session.get('user')}")
-    logger.info(f"Session CSRF token: {session.get('csrf_token', 'None')[:10] if session.get('csrf_token') else 'None'}")
-    
-    # Dump raw request body for debugging
-    try:
-        body = request.get_data().decode('utf-8')
-        logger.info(f"Raw request body: {body}")
-    except Exception as e:
-        logger.warning(f"Could not decode request body: {e}")
-    
-    # Admin check
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            logger.warning(f"Admin check failed: {session.get('user')} not in {admins}")
-            return jsonify({'error':'forbidden'}), 403
+    user = session.get('user')
+    data = _json_body()
+    # Comprehensive debugging for troubleshooting (formatted only when DEBUG is on)
+    if logger.isEnabledFor(logging.DEBUG):
+        csrf_token = session.get('csrf_token')
+        logger.debug("test_profile_endpoint: method=%s content_type=%s is_json=%s user=%s csrf=%s headers=%s json=%s",
+                     request.method, request.content_type, request.is_json, user,
+                     csrf_token[:10] if csrf_token else 'None', dict(request.headers), data)
     
     # Export LPS2_DEBUG_CSRF=1 to bypass CSRF validation during development
     if os.environ.get('LPS2_DEBUG_CSRF'):
         logger.warning("⚠️ CSRF validation bypassed due to LPS2_DEBUG_CSRF=1")
     else:
         # Normal CSRF validation
-        fail = _validate_csrf_if_session()
+        fail = _validate_csrf_if_session(data, user=user)
         if fail:
             logger.warning(f"CSRF validation failed in test_profile_endpoint")
             return fail
     
     # Get endpoint from request
-    try:
-        if request.is_json:
-            data = request.json or {}
-            endpoint = (data.get('endpoint') or '').strip()
-            logger.info(f"JSON endpoint: {endpoint}")
-        else:
-            # Try to parse JSON manually as fallback
-            try:
-                body = request.get_data().decode('utf-8')
-                data = json.loads(body)
-                endpoint = (data.get('endpoint') or '').strip()
-                logger.info(f"Manually parsed endpoint: {endpoint}")
-            except:
-                endpoint = ''
-                logger.warning(f"Failed to parse request body as JSON")
-    except Exception as e:
-        logger.error(f"Error extracting endpoint: {e}")
-        endpoint = ''
+    endpoint = (data.get('endpoint') or '').strip() if isinstance(data.get('endpoint'), str) else ''
+    logger.info(f"Requested endpoint: {endpoint}")
     
     if not endpoint:
         logger.warning("No endpoint provided")
@@ -349,7 +464,7 @@ def test_profile_endpoint():
     
     # Test endpoint
     try:
-        result = _test_endpoint_connectivity(endpoint)
+        result = _probe_endpoint(endpoint)
         logger.info(f"Test result: {result}")
         audit('endpoint_test', endpoint=endpoint, ok=result.get('ok'), error=result.get('error'))
         return jsonify(result), (200 if result.get('ok') else 400)
@@ -359,30 +474,25 @@ def test_profile_endpoint():
 
 @chat_bp.route('/admin/llm-endpoints/profiles', methods=['POST'])
 @require_api_key
+@require_admin
 def upsert_profile():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
-    
+    data = _json_body()
     # Log request for debugging
-    logger.info(f"upsert_profile: headers={dict(request.headers)}")
-    if request.is_json:
-        logger.info(f"upsert_profile: json={request.json}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("upsert_profile: headers=%s json=%s", dict(request.headers), data)
     
-    fail = _validate_csrf_if_session()
+    fail = _validate_csrf_if_session(data)
     if fail:
         logger.warning(f"CSRF validation failed in upsert_profile")
         return fail
     
-    data = request.json or {}
     name = (data.get('name') or '').strip()
     endpoint = (data.get('endpoint') or '').strip()
     persist = bool(data.get('persist'))
     
     if not name or not endpoint:
         return jsonify({'error':'name_and_endpoint_required'}), 400
-    test_res = _test_endpoint_connectivity(endpoint)
+    test_res = _probe_endpoint(endpoint)
     with _PROFILES_LOCK:
         _ENDPOINT_PROFILES['profiles'][name] = {
             'endpoint': endpoint.rstrip('/'),
@@ -395,23 +505,18 @@ def upsert_profile():
 
 @chat_bp.route('/admin/llm-endpoints/profiles/activate', methods=['POST'])
 @require_api_key
+@require_admin
 def activate_profile():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
-    
+    data = _json_body()
     # Log request for debugging
-    logger.info(f"activate_profile: headers={dict(request.headers)}")
-    if request.is_json:
-        logger.info(f"activate_profile: json={request.json}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("activate_profile: headers=%s json=%s", dict(request.headers), data)
     
-    fail = _validate_csrf_if_session()
+    fail = _validate_csrf_if_session(data)
     if fail:
         logger.warning(f"CSRF validation failed in activate_profile")
         return fail
     
-    data = request.json or {}
     name = (data.get('name') or '').strip()
     persist = bool(data.get('persist'))
     
@@ -424,7 +529,7 @@ def activate_profile():
             return jsonify({'error':'not_found'}), 404
         endpoint = prof['endpoint']
     
-    test_res = _test_endpoint_connectivity(endpoint)
+    test_res = _probe_endpoint(endpoint)
     if not test_res.get('ok'):
         return jsonify({'error':'activation_failed', 'test': test_res}), 400
     
@@ -444,23 +549,18 @@ def activate_profile():
 
 @chat_bp.route('/admin/llm-endpoints/profiles/delete', methods=['POST'])
 @require_api_key
+@require_admin
 def delete_profile():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
-    
+    data = _json_body()
     # Log request for debugging
-    logger.info(f"delete_profile: headers={dict(request.headers)}")
-    if request.is_json:
-        logger.info(f"delete_profile: json={request.json}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("delete_profile: headers=%s json=%s", dict(request.headers), data)
     
-    fail = _validate_csrf_if_session()
+    fail = _validate_csrf_if_session(data)
     if fail:
         logger.warning(f"CSRF validation failed in delete_profile")
         return fail
     
-    data = request.json or {}
     name = (data.get('name') or '').strip()
     persist = bool(data.get('persist'))
     
@@ -517,6 +617,91 @@ def maybe_summarize(memory_store):
         logger.error(f"Summarization failed: {e}")
         return None
 
+# Memory writes (redact + sanitize + embed + summarize) run after the reply is sent.
+# One worker keeps them in arrival order, so summarization sees turns in sequence; prompts
+# that queue up while it is busy are embedded together in one batch.
+_MEMORY_WRITER = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='mem-write')
+_MEMORY_PENDING: "queue.SimpleQueue" = queue.SimpleQueue()
+_MEMORY_BATCH_MAX = 64
+
+def _remember_prompt_later(memory_store, prompt, file_content, file_type):
+    """Queue _remember_prompts off the request thread."""
+    if memory_store:
+        _MEMORY_PENDING.put((memory_store, prompt, file_content, file_type))
+        _MEMORY_WRITER.submit(_drain_memory_queue)
+
+def _drain_memory_queue():
+    # Each submit drains whatever is queued; later submits then find it empty and return
+    batch = []
+    while len(batch) < _MEMORY_BATCH_MAX:
+        try:
+            batch.append(_MEMORY_PENDING.get_nowait())
+        except queue.Empty:
+            break
+    start = 0
+    while start < len(batch):
+        store = batch[start][0]
+        end = start
+        while end < len(batch) and batch[end][0] is store:
+            end += 1
+        _remember_prompts(store, [item[1:] for item in batch[start:end]])
+        start = end
+
+def _remember_prompts(memory_store, items):
+    """Store sanitized, PII-redacted prompts ((prompt, file_content, file_type) tuples) in one batch."""
+    if not memory_store:
+        return
+    try:
+        texts, metas = [], []
+        for prompt, file_content, file_type in items:
+            enrich = ''
+            if file_content and file_type and file_type.startswith('text'):
+                enrich = f"\n[AttachedFile]\n{file_content[:800]}"  # limit
+            full_text = prompt + enrich
+            # PII redaction before sanitize
+            redacted_full, pii_stats = redact_pii(full_text)
+            sanitized_full, meta = sanitize_text(redacted_full)
+            meta_out = {"file_type": file_type or None}
+            if meta.get('suspicious'):
+                meta_out['suspicious'] = True
+            if pii_stats:
+                meta_out['pii_redacted'] = pii_stats
+            texts.append(sanitized_full)
+            metas.append(meta_out)
+        # Store sanitized versions (originals discarded to avoid poisoning)
+        memory_store.add_memories(texts, metas)
+        maybe_summarize(memory_store)
+    except Exception as e:
+        logger.error(f"Memory add failed: {e}")
+
+def _stream_chat(prompt, messages, context, memory_store, file_content, file_type, sid, user_content,
+                 auto_continue=None):
+    """Yield SSE frames for a streamed /chat reply.
+
+    Each content fragment is sent as ``data: {"delta": ...}`` and each executed
+    tool call as ``data: {"tool_result": ...}``; ``data: {"reset": true}`` means
+    text streamed before a tool call is not part of the reply and should be
+    cleared. The last frame carries the retrieval context, tool results, metrics
+    and ``"done": true``; its ``response`` is the text added to the conversation
+    history once the reply is complete.
+    """
+    for event in llm_client.send_prompt_stream(prompt, messages, auto_continue=auto_continue,
+                                               file_content=file_content, file_type=file_type):
+        if not event.get('done'):
+            yield b'data: ' + dumps_bytes(event) + b'\n\n'
+            continue
+        metrics = event.get('metrics') or {}
+        if isinstance(metrics.get('duration'), (int, float)):
+            _record_latency(float(metrics['duration']))
+        append_history(sid, {"role": "user", "content": user_content},
+                       {"role": "assistant", "content": event.get('response', '')})
+        final = dict(context, **event)
+        yield b'data: ' + dumps_bytes(final) + b'\n\n'
+    _remember_prompt_later(memory_store, prompt, file_content, file_type)
+
+_CHAT_UPLOAD_MAX = 2 * 1024 * 1024
+_MULTIPART_SLACK = 64 * 1024  # prompt field + multipart boundaries/headers
+
 @chat_bp.route('/chat', methods=['POST'])
 def chat():
     # Rate limiting (per IP)
@@ -525,11 +710,8 @@ def chat():
         return jsonify({'error': 'rate_limited'}), 429
     
     # Validate request if not multipart (multipart will be validated separately)
-    if not request.content_type or not request.content_type.startswith('multipart/form-data'):
+    if _HAVE_VALIDATION and (not request.content_type or not request.content_type.startswith('multipart/form-data')):
         try:
-            from utils.schemas import ChatMessageSchema
-            from utils.validation import validate_data
-            
             # Direct validation
             data = request.json or {}
             # If request.json is empty due to content-type quirks, try manual JSON parse
@@ -537,7 +719,7 @@ def chat():
                 try:
                     body_txt = request.get_data(as_text=True)
                     if body_txt and body_txt.strip().startswith('{'):
-                        data = json.loads(body_txt)
+                        data = json_loads(body_txt)
                 except Exception:
                     pass
             # Backward-compat: if client sent 'prompt' but not 'message', mirror it so schema passes
@@ -552,7 +734,7 @@ def chat():
                 logger.info(f"/chat validation: incoming json keys={list(data.keys())}")
             except Exception:
                 pass
-            is_valid, validated_data, errors = validate_data(data, ChatMessageSchema)
+            is_valid, validated_data, errors = validate_data(data, CHAT_MESSAGE_SCHEMA)
             
             if not is_valid:
                 # Backward-compat: if client sent 'prompt' instead of 'message', adapt and retry
@@ -560,7 +742,7 @@ def chat():
                     compat = dict(data)
                     compat['message'] = compat.get('prompt')
                     logger.info("/chat validation: applying compat mapping prompt->message and retrying")
-                    is_valid, validated_data, errors2 = validate_data(compat, ChatMessageSchema)
+                    is_valid, validated_data, errors2 = validate_data(compat, CHAT_MESSAGE_SCHEMA)
                     if is_valid:
                         data = compat
                     else:
@@ -591,9 +773,6 @@ def chat():
                 
             # For convenience in the rest of the function
             request.validated_data = validated_data
-        except ImportError:
-            # Validation module not available, continue with normal flow
-            logger.debug("Validation module not available, skipping validation")
         except Exception as e:
             # Log but continue with the request to maintain backward compatibility
             logger.exception(f"Validation error: {e}")
@@ -611,52 +790,57 @@ def chat():
     image_sanitized = None  # Will become True/False when image processed
     extended_flag = False
     if request.content_type and request.content_type.startswith('multipart/form-data'):
+        # Enforce a hard server-side size limit (2MB) even though client validates.
+        # Check the declared length first so oversize bodies are never parsed or spooled.
+        if request.content_length and request.content_length > _CHAT_UPLOAD_MAX + _MULTIPART_SLACK:
+            return jsonify({'error': 'File too large (max 2MB).'}), 413
         prompt = request.form.get('prompt', '')
         extended_flag = request.form.get('extended') in ('1','true','on','yes')
         file = request.files.get('file')
         if file:
             file_type = file.content_type or ''
-            # Enforce a hard server-side size limit (2MB) even though client validates
-            file.seek(0, 2)  # move to end
-            size_bytes = file.tell()
-            file.seek(0)
-            MAX_BYTES = 2 * 1024 * 1024
-            if size_bytes > MAX_BYTES:
-                return jsonify({'error': 'File too large (max 2MB).'}), 400
+            # Single bounded read: one byte past the cap is enough to detect oversize
+            raw_bytes = file.read(_CHAT_UPLOAD_MAX + 1)
+            if len(raw_bytes) > _CHAT_UPLOAD_MAX:
+                return jsonify({'error': 'File too large (max 2MB).'}), 413
             if file_type.startswith('text'):
                 try:
-                    file_content = file.read().decode('utf-8', errors='replace')
+                    file_content = raw_bytes.decode('utf-8', errors='replace')
                 except Exception:
                     return jsonify({'error': 'Failed to decode text file as UTF-8.'}), 400
             elif file_type.startswith('image'):
                 if not _PIL_AVAILABLE:
                     return jsonify({'error': 'Image processing not available (Pillow missing).'}), 500
-                raw_bytes = file.read()
                 before_size = len(raw_bytes)
                 try:
                     img = Image.open(BytesIO(raw_bytes))
-                    img.load()
                     original_format = (img.format or 'PNG').upper()
                     target_format = 'PNG' if original_format not in ('PNG', 'JPEG', 'JPG', 'WEBP') else original_format
+                    if target_format in ('JPEG', 'JPG'):
+                        # Let libjpeg decode straight to RGB instead of via an intermediate mode
+                        img.draft('RGB', img.size)
+                    img.load()
+                    # Metadata is dropped on re-encode, so bake the EXIF orientation into the pixels
+                    ImageOps.exif_transpose(img, in_place=True)
                     buf = BytesIO()
                     save_kwargs = {}
                     if target_format in ('JPEG', 'JPG'):
-                        if img.mode in ('RGBA', 'LA'):
-                            from PIL import Image as _Image
-                            bg = _Image.new('RGB', img.size, (255, 255, 255))
-                            bg.paste(img, mask=img.split()[-1])
-                            img = bg
-                        elif img.mode != 'RGB':
+                        # JPEG sources decode to L/RGB/CMYK; never an alpha mode
+                        if img.mode != 'RGB':
                             img = img.convert('RGB')
                         save_kwargs.update({'quality': 90, 'optimize': True, 'progressive': True})
                     else:
                         if img.mode not in ('RGB', 'L', 'RGBA') and target_format == 'PNG':
                             img = img.convert('RGBA') if 'A' in img.mode else img.convert('RGB')
+                        if target_format == 'PNG':
+                            # Fast zlib level: a few percent larger output for far less worker CPU
+                            save_kwargs.update({'optimize': False, 'compress_level': 1})
                     # Re-encode WITHOUT metadata
                     img.save(buf, format=target_format, **save_kwargs)
                     sanitized_bytes = buf.getvalue()
                     after_size = len(sanitized_bytes)
-                    file_content = base64.b64encode(sanitized_bytes).decode('utf-8')
+                    # Raw bytes; LLMClient base64-encodes once when building the upstream message
+                    file_content = sanitized_bytes
                     image_sanitized = True
                     logger.info(f"Image sanitized: format={target_format} size_before={before_size} size_after={after_size}")
                 except Exception as e:
@@ -677,42 +861,41 @@ def chat():
     if not prompt and not file_content:
         return jsonify({'error': 'Prompt or file is required'}), 400
         
-    # Initialize conversation history in session if it doesn't exist
-    if 'conversation_history' not in session:
-        session['conversation_history'] = []
-        
-    # Get existing conversation history
-    conversation_history = session.get('conversation_history', [])
+    # Conversation history lives server-side; the cookie only carries its id
+    sid = session.get('sid')
+    if not sid:
+        sid = session['sid'] = secrets.token_urlsafe(16)
+    session.pop('conversation_history', None)  # drop history from pre-upgrade cookies
         
     # -------- Retrieval (Memory) --------
     memory_used_ids = []
     knowledge_used = []
     system_blocks = []
     memory_store = get_memory_store()
-    if memory_store:
+    knowledge_store = get_knowledge_store()
+    # The two lookups are independent; run them concurrently so their latencies overlap
+    mem_fut = _RETRIEVAL_POOL.submit(memory_store.search, prompt, top_k=5) if memory_store else None
+    kn_fut = _RETRIEVAL_POOL.submit(knowledge_store.search, prompt, top_k=5) if knowledge_store else None
+    if mem_fut:
         try:
-            retrieved_m = memory_store.search(prompt, top_k=5)
+            retrieved_m = mem_fut.result()
             if retrieved_m:
                 memory_used_ids = [r['id'] for r in retrieved_m]
-                snippets = []
-                for r in retrieved_m:
-                    txt = r['text']
-                    if len(txt) > 500:
-                        txt = txt[:500] + '...'
-                    sanitized, meta = sanitize_text(txt)
-                    flag = ' !' if meta.get('suspicious') else ''
-                    snippets.append(f"[{r['id'][:8]} | score={r['score']:.3f}{flag}] {sanitized}")
+                texts = [r['text'][:500] + ('...' if len(r['text']) > 500 else '') for r in retrieved_m]
+                snippets = [
+                    f"[{r['id'][:8]} | score={r['score']:.3f}{' !' if meta.get('suspicious') else ''}] {sanitized}"
+                    for r, (sanitized, meta) in zip(retrieved_m, sanitize_texts(texts))
+                ]
                 system_blocks.append("MEMORY SNIPPETS:\n" + "\n".join(snippets))
         except Exception as e:
             logger.error(f"Memory retrieval failed: {e}")
-    knowledge_store = get_knowledge_store()
     knowledge_block = None
     citations = []
     knowledge_confidence = None
     refusal = False
-    if knowledge_store:
+    if kn_fut:
         try:
-            retrieved_k = knowledge_store.search(prompt, top_k=5)
+            retrieved_k = kn_fut.result()
             if retrieved_k:
                 knowledge_used = [rk['chunk_id'] for rk in retrieved_k]
                 top_score = retrieved_k[0]['score']
@@ -726,28 +909,30 @@ def chat():
                     knowledge_confidence = 'low'
                 if knowledge_confidence == 'low':
                     refusal = True
-                kb_snippets = []
-                for i, rk in enumerate(retrieved_k, start=1):
-                    txt = rk['text']
-                    preview = txt[:160] + ('...' if len(txt) > 160 else '')
-                    if len(txt) > 600:
-                        txt = txt[:600] + '...'
-                    sanitized, meta = sanitize_text(txt)
-                    flag = ' !' if meta.get('suspicious') else ''
-                    kb_snippets.append(f"[S{i}{flag} score={rk['score']:.3f} src={rk['source']} idx={rk['index']}]\n{sanitized}")
-                    citations.append({
-                        's': i,
-                        'chunk_id': rk['chunk_id'],
-                        'doc_id': rk['doc_id'],
-                        'source': rk['source'],
-                        'index': rk['index'],
-                        'score': rk['score'],
-                        'preview': preview
-                    })
-                if not refusal:
-                    knowledge_block = (
-                        "KNOWLEDGE BASE CONTEXT (use strictly; cite sources as [S#]):\n" + "\n---\n".join(kb_snippets)
-                    )
+                # A refusal with no memory context returns early below; skip building
+                # citations and snippets for it
+                if system_blocks or not refusal:
+                    for i, rk in enumerate(retrieved_k, start=1):
+                        txt = rk['text']
+                        citations.append({
+                            's': i,
+                            'chunk_id': rk['chunk_id'],
+                            'doc_id': rk['doc_id'],
+                            'source': rk['source'],
+                            'index': rk['index'],
+                            'score': rk['score'],
+                            'preview': txt[:160] + ('...' if len(txt) > 160 else '')
+                        })
+                    if not refusal:
+                        # Snippets only feed the knowledge block, so skip sanitizing on refusal
+                        texts = [rk['text'][:600] + ('...' if len(rk['text']) > 600 else '') for rk in retrieved_k]
+                        kb_snippets = [
+                            f"[S{i}{' !' if meta.get('suspicious') else ''} score={rk['score']:.3f} src={rk['source']} idx={rk['index']}]\n{sanitized}"
+                            for i, (rk, (sanitized, meta)) in enumerate(zip(retrieved_k, sanitize_texts(texts)), start=1)
+                        ]
+                        knowledge_block = (
+                            "KNOWLEDGE BASE CONTEXT (use strictly; cite sources as [S#]):\n" + "\n---\n".join(kb_snippets)
+                        )
         except Exception as e:
             logger.error(f"Knowledge retrieval failed: {e}")
     if knowledge_block:
@@ -773,37 +958,44 @@ def chat():
 
     # Map extended flag to auto continuation override (extended => enable, else use default config)
     
-    # Prepare messages with conversation history
-    messages = []
+    # Prepare messages with conversation history (up to last 10 messages to avoid
+    # context overflow). get_history returns a fresh list, so it is used as-is.
+    max_history = 10  # Adjust as needed based on token limits
+    messages = get_history(sid, limit=max_history)
     
-    # Add system message first if present
+    # System message first if present (history is at most max_history long)
     if system_content:
-        messages.append({"role": "system", "content": system_content})
-    
-    # Add conversation history (up to last 10 messages to avoid context overflow)
-    max_history = 10  # Adjust as needed based on token limits
-    history_messages = conversation_history[-max_history:] if len(conversation_history) > max_history else conversation_history
-    messages.extend(history_messages)
+        messages.insert(0, {"role": "system", "content": system_content})
     
     # Add the current user message
-    if file_content and file_type and file_type.startswith('image'):
-        # Handle image content
-        data_url = f"data:{file_type};base64,{file_content}"
-        user_msg = {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": data_url}}
-            ]
-        }
-        messages.append(user_msg)
+    messages.append(llm_client.build_user_message(prompt, file_content, file_type))
+
+    # Summary of the user turn kept in conversation history
+    if file_content and file_type and file_type.startswith('text'):
+        user_content = f"{prompt}\n\n[Attached text file]"
+    elif file_content and file_type and file_type.startswith('image'):
+        user_content = f"{prompt}\n\n[Attached image]"
     else:
-        if file_content and file_type and file_type.startswith('text'):
-            augmented = f"{prompt}\n\n---\nAttached file content:\n{file_content}\n---"
-        else:
-            augmented = prompt
-        messages.append({"role": "user", "content": augmented})
-    
+        user_content = prompt
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        context = {
+            'memory_used': memory_used_ids,
+            'knowledge_used': knowledge_used,
+            'citations': citations,
+            'knowledge_confidence': knowledge_confidence,
+            'refusal': False,
+            'extended': extended_flag,
+        }
+        if image_sanitized is not None:
+            context['image_sanitized'] = image_sanitized
+        return Response(
+            stream_with_context(_stream_chat(prompt, messages, context, memory_store, file_content, file_type, sid,
+                                             user_content, auto_continue=(True if extended_flag else None))),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
     # Send prompt with conversation history
     result = llm_client.send_prompt(prompt, file_content=file_content, file_type=file_type, 
                                    system_content=system_content, messages=messages,
@@ -812,10 +1004,10 @@ def chat():
     # If tool_calls are present, execute them and continue the conversation
     tool_calls = result.get('tool_calls')
     
-    # Capture messages used for tool processing if needed
-    tool_messages = messages.copy()
     tool_results = []
     if tool_calls:
+        # Extend a copy so the tool round-trip carries the call and its result
+        tool_messages = messages.copy()
         for call in tool_calls:
             tool_result = llm_client.execute_tool(call)
             tool_results.append({
@@ -823,47 +1015,28 @@ def chat():
                 "result": tool_result
             })
             # Add assistant tool call and tool result to messages
-            messages.append({
+            tool_messages.append({
                 "role": "assistant",
                 "tool_calls": [call]
             })
-            messages.append({
+            tool_messages.append({
                 "role": "tool",
                 "content": tool_result,
                 "tool_call_id": call["id"]
             })
         # Send updated messages to LLM for final response
-    final_result = llm_client.send_prompt(prompt, messages=tool_messages, auto_continue=(True if extended_flag else None))
+        final_result = llm_client.send_prompt(prompt, messages=tool_messages, auto_continue=(True if extended_flag else None))
+    else:
+        # No tools requested: the first response is already final
+        final_result = result
     metrics = final_result.get('metrics') or {}
     # Record latency metric (duration) if available
     if metrics and isinstance(metrics.get('duration'), (int, float)):
-        try:
-            _MODEL_LATENCIES.append(float(metrics['duration']))
-        except Exception:
-            pass
+        _record_latency(float(metrics['duration']))
             
     # Update conversation history with the new exchange
-    # Add user message to history
-    if file_content and file_type and file_type.startswith('text'):
-        user_content = f"{prompt}\n\n[Attached text file]"
-    elif file_content and file_type and file_type.startswith('image'):
-        user_content = f"{prompt}\n\n[Attached image]"
-    else:
-        user_content = prompt
-    
-    # Add to conversation history
-    conversation_history.append({"role": "user", "content": user_content})
-    
-    # Add assistant response to history
     response_text = final_result.get('response', '')
-    conversation_history.append({"role": "assistant", "content": response_text})
-    
-    # Store updated conversation history in session (limit to last 20 messages to manage session size)
-    if len(conversation_history) > 20:
-        conversation_history = conversation_history[-20:]
-    session['conversation_history'] = conversation_history
-    # Make sure session is saved
-    session.modified = True
+    append_history(sid, {"role": "user", "content": user_content}, {"role": "assistant", "content": response_text})
     resp = {
         'response': final_result.get('response'),
         'tool_results': tool_results,
@@ -881,28 +1054,9 @@ def chat():
     if image_sanitized is not None:
         resp['image_sanitized'] = image_sanitized
     # Store new memory AFTER final response (user prompt only for now)
-    if memory_store:
-        try:
-            enrich = ''
-            if file_content and file_type and file_type.startswith('text'):
-                enrich = f"\n[AttachedFile]\n{file_content[:800]}"  # limit
-            full_text = prompt + enrich
-            # PII redaction before sanitize
-            redacted_full, pii_stats = redact_pii(full_text)
-            sanitized_full, meta = sanitize_text(redacted_full)
-            meta_out = {"file_type": file_type or None}
-            if meta.get('suspicious'):
-                meta_out['suspicious'] = True
-            if pii_stats:
-                meta_out['pii_redacted'] = pii_stats
-            # Store sanitized version (original discarded to avoid poisoning)
-            memory_store.add_memory(sanitized_full, metadata=meta_out)
-            maybe_summarize(memory_store)
-        except Exception as e:
-            logger.error(f"Memory add failed: {e}")
+    _remember_prompt_later(memory_store, prompt, file_content, file_type)
     return jsonify(resp)
 
-import os
 APP_VERSION = os.environ.get('LPS2_APP_VERSION', '0.1.0')
 
 @chat_bp.route('/model', methods=['GET'])
@@ -911,12 +1065,7 @@ def current_model():
     model_id = info.get('model') or llm_client.get_current_model() or 'Unknown'
     created = info.get('created')
     obj_type = info.get('object')
-    avg_latency = None
-    if _MODEL_LATENCIES:
-        try:
-            avg_latency = sum(_MODEL_LATENCIES) / len(_MODEL_LATENCIES)
-        except Exception:
-            avg_latency = None
+    avg_latency = _avg_latency()
     return jsonify({
         'model': model_id,
         'created': created,
@@ -960,12 +1109,11 @@ def full_health():
         'endpoint': getattr(llm_client, 'server_base', None),
         'reachable': False
     }
-    import time as _time
-    start = _time.time()
+    start = time.time()
     try:
         # Attempt model listing for lightweight probe
         model_id = llm_client.get_current_model()
-        elapsed = (_time.time() - start) * 1000.0
+        elapsed = (time.time() - start) * 1000.0
         upstream['latency_ms'] = round(elapsed, 1)
         upstream['reachable'] = model_id is not None
         upstream['model'] = model_id
@@ -990,7 +1138,7 @@ def full_health():
         'upstream': upstream,
         'memory': memory_status,
         'knowledge': knowledge_status,
-        'avg_latency': (sum(_MODEL_LATENCIES)/len(_MODEL_LATENCIES)) if _MODEL_LATENCIES else None
+        'avg_latency': _avg_latency()
     })
 
 @chat_bp.route('/memory/search', methods=['GET'])
@@ -1001,7 +1149,38 @@ def memory_search():
     if not store:
         return jsonify({'results': [], 'enabled': False})
     results = store.search(q, top_k=top_k)
-    return jsonify({'results': results, 'enabled': True})
+    return Response(_stream_results(results), mimetype='application/json')
+
+def _stream_results(items, project=None):
+    """Yield {"enabled":true,"results":[...]} one encoded element at a time."""
+    yield b'{"enabled":true,"results":['
+    for i, item in enumerate(items):
+        if i:
+            yield b','
+        yield dumps_bytes(project(item) if project else item)
+    yield b']}\n'
+
+def _kb_preview(r):
+    """Search hit with text replaced by a 300-char preview."""
+    txt = r['text']
+    if len(txt) > 300:
+        txt = txt[:300] + '...'
+    return {k: v for k, v in r.items() if k != 'text'} | {'preview': txt}
+
+def _memory_row(m):
+    """Admin list projection of a memory record (text shortened to 160 chars)."""
+    txt = m.get('text', '')
+    meta = m.get('metadata', {})
+    return {
+        'id': m.get('id'),
+        'text': txt[:160] + '…' if len(txt) > 160 else txt,
+        'is_summary': bool(meta.get('summary')),
+        'created': m.get('created'),
+        'file_type': meta.get('file_type'),
+        'source_ids': meta.get('source_ids'),
+        'suspicious': bool(meta.get('suspicious')),
+        'pii_redacted': meta.get('pii_redacted')
+    }
 
 @chat_bp.route('/memory/list', methods=['GET'])
 def memory_list():
@@ -1009,35 +1188,14 @@ def memory_list():
     store = get_memory_store()
     if not store:
         return jsonify({'memories': [], 'enabled': False})
-    mems = store.list_memories()
-    mems_sorted = sorted(mems, key=lambda m: m.get('created', 0), reverse=True)
-    out = []
-    for m in mems_sorted[:limit]:
-        txt = m.get('text', '')
-        if len(txt) > 160:
-            txt_short = txt[:160] + '…'
-        else:
-            txt_short = txt
-        meta = m.get('metadata', {})
-        out.append({
-            'id': m.get('id'),
-            'text': txt_short,
-            'is_summary': bool(meta.get('summary')),
-            'created': m.get('created'),
-            'file_type': meta.get('file_type'),
-            'source_ids': meta.get('source_ids'),
-            'suspicious': bool(meta.get('suspicious')),
-            'pii_redacted': meta.get('pii_redacted')
-        })
-    return jsonify({'memories': out, 'count': len(mems), 'enabled': True})
+    top, total = store.recent_memories(limit)
+    out = [_memory_row(m) for m in top]
+    return jsonify({'memories': out, 'count': total, 'enabled': True})
 
 @chat_bp.route('/memory/delete', methods=['POST'])
 @require_api_key
+@require_admin
 def memory_delete():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
     fail = _validate_csrf_if_session();
     if fail: return fail
     data = request.json or {}
@@ -1057,124 +1215,153 @@ def kb_stats():
     store = get_knowledge_store()
     if not store:
         return jsonify({'enabled': False})
-    base_stats = store.stats()
-    # Obtain detailed documents list for model distribution
-    docs_list = store.list_documents()
-    base_stats['documents'] = len(docs_list)
-    base_stats['embedding_models'] = list({d.get('embedding_model') for d in docs_list if d.get('embedding_model')})
-    try:
-        from utils.knowledge_store import CURRENT_EMBEDDING_MODEL_NAME as ACTIVE_MODEL
-    except Exception:
-        ACTIVE_MODEL = None
-    base_stats['active_embedding_model'] = ACTIVE_MODEL
+    base_stats = store.stats_full()
+    base_stats['active_embedding_model'] = CURRENT_EMBEDDING_MODEL_NAME
     return jsonify({'enabled': True, **base_stats})
 
 @chat_bp.route('/kb/ingest', methods=['POST'])
 @require_api_key
+@require_admin
 def kb_ingest():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
     fail = _validate_csrf_if_session();
     if fail: return fail
     store = get_knowledge_store()
     if not store:
         return jsonify({'error': 'knowledge store unavailable'}), 500
-    text = None
-    source = None
     if request.content_type and request.content_type.startswith('multipart/form-data'):
+        # Reject on the declared length before the multipart body is parsed and spooled
+        if request.content_length and request.content_length > _KB_UPLOAD_MAX + _MULTIPART_SLACK:
+            return jsonify({'error': 'file too large (max 10MB)'}), 400
         file = request.files.get('file')
         if not file:
             return jsonify({'error': 'file missing'}), 400
         source = file.filename or 'uploaded.txt'
-        raw = file.read()
-        # Basic size guard (10MB)
-        if len(raw) > 10 * 1024 * 1024:
+        # Werkzeug has already spooled the part (to disk past 500KB); hash and size it
+        # from the stream so oversized or duplicate uploads are never read into memory
+        raw_hash, size = hash_stream(file.stream)
+        if size > _KB_UPLOAD_MAX:
             return jsonify({'error': 'file too large (max 10MB)'}), 400
         fname_lower = (source or '').lower()
         ctype = (file.mimetype or file.content_type or '').lower()
+        is_pdf = fname_lower.endswith('.pdf') or 'pdf' in ctype
         ocr_requested = (request.form.get('ocr') in ('1','true','on','yes'))
-        if fname_lower.endswith('.pdf') or 'pdf' in ctype:
-            # PDF extraction
-            try:
-                try:
-                    import PyPDF2  # type: ignore
-                except Exception as e:
-                    return jsonify({'error': f'PDF support not available: {e}'}), 400
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(raw))
-                pages = []
-                for p in pdf_reader.pages:
-                    try:
-                        pages.append(p.extract_text() or '')
-                    except Exception:
-                        pages.append('')
-                extracted = '\n\n'.join([p.strip() for p in pages if p and p.strip()])
-                text = extracted
-                # OCR fallback when no/low text or explicitly requested
-                need_ocr = ocr_requested or (len((extracted or '').strip()) < 40)
-                if need_ocr:
-                    ocr_text = []
-                    ocr_errors = []
-                    try:
-                        try:
-                            from pdf2image import convert_from_bytes  # type: ignore
-                            import pytesseract  # type: ignore
-                        except Exception as e:
-                            if not extracted.strip():
-                                return jsonify({'error': f'no extractable text and OCR unavailable: {e}'}), 400
-                            # Keep extracted text only
-                        else:
-                            max_pages = int(os.environ.get('LPS2_OCR_MAX_PAGES', '50'))
-                            dpi = int(os.environ.get('LPS2_OCR_DPI', '200'))
-                            try:
-                                images = convert_from_bytes(raw, dpi=dpi, fmt='png', first_page=1, last_page=min(len(pages), max_pages))
-                            except Exception as e:
-                                images = []
-                                ocr_errors.append(f'convert_failed:{e}')
-                            if images:
-                                for idx, img in enumerate(images, start=1):
-                                    try:
-                                        txt_page = pytesseract.image_to_string(img)
-                                    except Exception as e:
-                                        ocr_errors.append(f'page{idx}:{e}')
-                                        txt_page = ''
-                                    if txt_page and txt_page.strip():
-                                        ocr_text.append(f"# OCR Page {idx}\n{txt_page.strip()}")
-                            if ocr_text:
-                                # Merge original extracted (if any) plus OCR
-                                combined = []
-                                if extracted.strip():
-                                    combined.append('# Extracted Text (Parser)\n' + extracted.strip())
-                                combined.append('\n'.join(ocr_text))
-                                text = '\n\n'.join(combined)
-                                if ocr_errors:
-                                    text += f"\n\n# OCR Warnings\n{'; '.join(ocr_errors)}"
-                            else:
-                                if not extracted.strip():
-                                    return jsonify({'error': 'no extractable text found (parser & OCR)'}), 400
-                    except Exception as e:
-                        if not extracted.strip():
-                            return jsonify({'error': f'OCR process failed and no parser text: {e}'}), 400
-            except Exception as e:
-                return jsonify({'error': f'pdf parse failed: {e}'}), 400
-        else:
-            # Assume UTF-8 text
+        # Identical bytes were ingested before: skip extraction, OCR and embedding
+        existing = store.get_doc_id_by_hash(raw_hash)
+        if existing:
+            audit('kb_ingest', source=source, doc_id=existing, deduped=True)
+            return jsonify({'doc_id': existing, 'deduped': True})
+        if _truthy(request.form.get('async') or request.args.get('async')):
+            # The request's temp file goes away with the request; the job gets its own copy
+            spool = tempfile.SpooledTemporaryFile(max_size=_KB_SPOOL_MEMORY)
+            shutil.copyfileobj(file.stream, spool)
+            spool.seek(0)
             try:
-                text = raw.decode('utf-8', errors='replace')
-            except Exception:
-                return jsonify({'error': 'decode failed'}), 400
-    else:
-        data = request.json or {}
-        text = data.get('text')
-        source = data.get('source', 'inline')
+                job_id = _submit_ingest_job(store, spool, source, is_pdf, ocr_requested, raw_hash)
+            except OSError as e:
+                spool.close()
+                logger.error(f"Async ingest unavailable: {e}")
+                return jsonify({'error': 'async ingest unavailable'}), 500
+            return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+        body, status = _ingest_upload(store, file.stream, source, is_pdf, ocr_requested, raw_hash)
+        return jsonify(body), status
+    data = request.json or {}
+    text = data.get('text')
+    source = data.get('source', 'inline')
+    if isinstance(text, str) and text:
+        existing = store.get_doc_id_by_text(text)
+        if existing:
+            audit('kb_ingest', source=source, doc_id=existing, deduped=True)
+            return jsonify({'doc_id': existing, 'deduped': True})
+    body, status = _ingest_text(store, text, source)
+    return jsonify(body), status
+
+@chat_bp.route('/kb/ingest/status/<job_id>', methods=['GET'])
+@require_api_key
+@require_admin
+def kb_ingest_status(job_id):
+    job = _read_ingest_job(job_id) if _JOB_ID_RE.match(job_id) else None
+    if not job:
+        return jsonify({'error': 'unknown job'}), 404
+    status = job.pop('http_status', 202)
+    return jsonify({'job_id': job_id, **job}), status
+
+def _truthy(v):
+    return v in ('1', 'true', 'on', 'yes')
+
+def _ingest_text(store, text, source, raw_hash=None):
+    """Ingest extracted text; returns (body, status)."""
     if not text:
-        return jsonify({'error': 'no text provided'}), 400
-    result = store.ingest_text(text, source=source)
+        return {'error': 'no text provided'}, 400
+    result = store.ingest_text(text, source=source, raw_hash=raw_hash)
     audit('kb_ingest', source=source, doc_id=result.get('doc_id'), quarantined=result.get('quarantined', False), chunks=result.get('chunks'))
     if 'error' in result:
-        return jsonify(result), 400
-    return jsonify(result)
+        return result, 400
+    return result, 200
+
+def _ingest_upload(store, stream, source, is_pdf, ocr_requested, raw_hash=None):
+    """Extract text from an uploaded file stream and ingest it; returns (body, status)."""
+    stream.seek(0)
+    if is_pdf:
+        try:
+            text = extract_pdf_text(stream, ocr_requested, digest=raw_hash)
+        except ExtractionError as e:
+            return {'error': str(e)}, 400
+    else:
+        # Assume UTF-8 text
+        text = stream.read().decode('utf-8', errors='replace')
+    return _ingest_text(store, text, source, raw_hash)
+
+def _write_ingest_job(job_id, state):
+    path = os.path.join(_INGEST_JOB_DIR, job_id + '.json')
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(dumps_bytes(state))
+    os.replace(tmp, path)
+
+def _read_ingest_job(job_id):
+    try:
+        with open(os.path.join(_INGEST_JOB_DIR, job_id + '.json'), 'rb') as f:
+            return json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def _sweep_ingest_jobs(now):
+    try:
+        for name in os.listdir(_INGEST_JOB_DIR):
+            path = os.path.join(_INGEST_JOB_DIR, name)
+            try:
+                if now - os.path.getmtime(path) > _INGEST_JOB_TTL:
+                    os.remove(path)
+            except OSError:
+                pass
+    except OSError:
+        pass
+
+def _run_ingest_job(job_id, store, spool, source, is_pdf, ocr_requested, raw_hash):
+    try:
+        body, status = _ingest_upload(store, spool, source, is_pdf, ocr_requested, raw_hash)
+    except Exception as e:
+        body, status = {'error': f'ingest failed: {e}'}, 500
+    finally:
+        spool.close()
+    _write_ingest_job(job_id, {'status': 'done' if status == 200 else 'failed', 'http_status': status, **body})
+
+def _ensure_ingest_job_dir():
+    """Create the job dir owner-only; refuse one that is a symlink or owned by another user."""
+    os.makedirs(_INGEST_JOB_DIR, mode=0o700, exist_ok=True)
+    st = os.lstat(_INGEST_JOB_DIR)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid():
+        raise PermissionError(f'ingest job dir {_INGEST_JOB_DIR} is not a directory owned by this user')
+    if st.st_mode & 0o077:
+        os.chmod(_INGEST_JOB_DIR, 0o700)
+
+def _submit_ingest_job(store, spool, source, is_pdf, ocr_requested, raw_hash):
+    _ensure_ingest_job_dir()
+    _sweep_ingest_jobs(time.time())
+    job_id = secrets.token_urlsafe(12)
+    _write_ingest_job(job_id, {'status': 'pending', 'source': source})
+    _INGEST_POOL.submit(_run_ingest_job, job_id, store, spool, source, is_pdf, ocr_requested, raw_hash)
+    return job_id
 
 @chat_bp.route('/kb/search', methods=['GET'])
 def kb_search():
@@ -1185,13 +1372,7 @@ def kb_search():
         return jsonify({'results': [], 'enabled': False})
     res = store.search(q, top_k=k)
     # Truncate text for response preview
-    out = []
-    for r in res:
-        txt = r['text']
-        if len(txt) > 300:
-            txt = txt[:300] + '...'
-        out.append({k: v for k, v in r.items() if k != 'text'} | {'preview': txt})
-    return jsonify({'results': out, 'enabled': True})
+    return Response(_stream_results(res, _kb_preview), mimetype='application/json')
 
 @chat_bp.route('/kb/documents', methods=['GET'])
 def kb_documents():
@@ -1202,11 +1383,8 @@ def kb_documents():
 
 @chat_bp.route('/kb/delete', methods=['POST'])
 @require_api_key
+@require_admin
 def kb_delete():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
     fail = _validate_csrf_if_session();
     if fail: return fail
     data = request.json or {}
@@ -1222,11 +1400,8 @@ def kb_delete():
 
 @chat_bp.route('/kb/reingest', methods=['POST'])
 @require_api_key
+@require_admin
 def kb_reingest():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
     fail = _validate_csrf_if_session();
     if fail: return fail
     store = get_knowledge_store()
@@ -1246,11 +1421,8 @@ def kb_reingest():
 
 @chat_bp.route('/kb/rebuild', methods=['POST'])
 @require_api_key
+@require_admin
 def kb_rebuild():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
     fail = _validate_csrf_if_session();
     if fail: return fail
     store = get_knowledge_store()
@@ -1275,11 +1447,7 @@ def security_stats():
     mem_total = 0
     if mem_store:
         try:
-            for m in mem_store.list_memories():
-                mem_total += 1
-                meta = m.get('metadata', {})
-                if meta.get('suspicious'):
-                    mem_suspicious += 1
+            mem_total, mem_suspicious = mem_store.count_suspicious()
         except Exception:
             pass
     kb_docs = 0
@@ -1287,15 +1455,7 @@ def security_stats():
     kb_suspicious = 0
     if kn_store:
         try:
-            docs = kn_store.list_documents()
-            kb_docs = len(docs)
-            # Need raw internal for chunk suspicion counts
-            internal = getattr(kn_store, '_data', {}).get('documents', [])
-            for d in internal:
-                for c in d.get('chunks', []):
-                    kb_chunks += 1
-                    if c.get('suspicious'):
-                        kb_suspicious += 1
+            kb_docs, kb_chunks, kb_suspicious = kn_store.chunk_stats()
         except Exception:
             pass
     return jsonify({
@@ -1305,127 +1465,81 @@ def security_stats():
 
 @chat_bp.route('/kb/quarantine', methods=['GET'])
 @require_api_key
+@require_admin
 def kb_quarantine_list():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
     store = get_knowledge_store()
     if not store:
         return jsonify({'enabled': False, 'records': []})
-    qpath = store.path + '.quarantine'
-    if not os.path.exists(qpath):
-        return jsonify({'enabled': True, 'records': []})
     try:
-        import json
-        with open(qpath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify({'enabled': True, 'records': data})
+        records = store.quarantine_records()
+        return jsonify({'enabled': True, 'records': records or []})
     except Exception as e:
         return jsonify({'enabled': True, 'error': str(e), 'records': []}), 500
 
-@chat_bp.route('/kb/quarantine/approve', methods=['POST'])
-@require_api_key
-def kb_quarantine_approve():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
+def _quarantine_remove(action):
+    """Shared body of approve/discard: returns (doc_id, error response)."""
     fail = _validate_csrf_if_session();
-    if fail: return fail
+    if fail: return None, fail
     store = get_knowledge_store()
     if not store:
-        return jsonify({'error': 'knowledge store unavailable'}), 500
+        return None, (jsonify({'error': 'knowledge store unavailable'}), 500)
     data = request.json or {}
     doc_id = data.get('doc_id')
     if not doc_id:
-        return jsonify({'error': 'doc_id required'}), 400
-    qpath = store.path + '.quarantine'
-    import json
-    if not os.path.exists(qpath):
-        return jsonify({'error': 'no quarantine file'}), 400
+        return None, (jsonify({'error': 'doc_id required'}), 400)
     try:
-        with open(qpath, 'r', encoding='utf-8') as f:
-            records = json.load(f)
+        removed = store.quarantine_remove(doc_id)
     except Exception as e:
-        return jsonify({'error': f'load failed: {e}'}), 500
-    rec = None
-    for r in records:
-        if r.get('doc_id') == doc_id:
-            rec = r
-            break
-    if not rec:
-        return jsonify({'error': 'doc not in quarantine'}), 404
-    new_records = [r for r in records if r.get('doc_id') != doc_id]
-    try:
-        with open(qpath + '.tmp', 'w', encoding='utf-8') as f:
-            json.dump(new_records, f)
-        os.replace(qpath + '.tmp', qpath)
-    except Exception as e:
-        return jsonify({'error': f'write failed: {e}'}), 500
+        return None, (jsonify({'error': f'{action} failed: {e}'}), 500)
+    if removed is None:
+        return None, (jsonify({'error': 'no quarantine file'}), 400)
+    if not removed:
+        return None, (jsonify({'error': 'doc not in quarantine'}), 404)
+    return doc_id, None
+
+@chat_bp.route('/kb/quarantine/approve', methods=['POST'])
+@require_api_key
+@require_admin
+def kb_quarantine_approve():
+    doc_id, fail = _quarantine_remove('approve')
+    if fail: return fail
     audit('kb_quarantine_approve', doc_id=doc_id)
     return jsonify({'approved': doc_id, 'note': 'quarantine record removed; re-ingest required to add content'})
 
 @chat_bp.route('/kb/quarantine/discard', methods=['POST'])
 @require_api_key
+@require_admin
 def kb_quarantine_discard():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
-    fail = _validate_csrf_if_session();
+    doc_id, fail = _quarantine_remove('discard')
     if fail: return fail
-    store = get_knowledge_store()
-    if not store:
-        return jsonify({'error': 'knowledge store unavailable'}), 500
-    data = request.json or {}
-    doc_id = data.get('doc_id')
-    if not doc_id:
-        return jsonify({'error': 'doc_id required'}), 400
-    qpath = store.path + '.quarantine'
-    import json
-    if not os.path.exists(qpath):
-        return jsonify({'error': 'no quarantine file'}), 400
-    try:
-        with open(qpath, 'r', encoding='utf-8') as f:
-            records = json.load(f)
-    except Exception as e:
-        return jsonify({'error': f'load failed: {e}'}), 500
-    if not any(r.get('doc_id') == doc_id for r in records):
-        return jsonify({'error': 'doc not in quarantine'}), 404
-    new_records = [r for r in records if r.get('doc_id') != doc_id]
-    try:
-        with open(qpath + '.tmp', 'w', encoding='utf-8') as f:
-            json.dump(new_records, f)
-        os.replace(qpath + '.tmp', qpath)
-    except Exception as e:
-        return jsonify({'error': f'write failed: {e}'}), 500
     audit('kb_quarantine_discard', doc_id=doc_id)
     return jsonify({'discarded': doc_id})
 
 @chat_bp.route('/security/audit', methods=['GET'])
 @require_api_key
+@require_admin
 def security_audit():
-    if session.get('user') and os.environ.get('LPS2_ADMIN_USERS'):
-        admins = {u.strip() for u in os.environ.get('LPS2_ADMIN_USERS','').split(',') if u.strip()}
-        if session.get('user') not in admins:
-            return jsonify({'error':'forbidden'}), 403
     limit = int(request.args.get('limit', '200'))
     events = read_audit(limit=limit)
     return jsonify({'events': events, 'count': len(events)})
 
 @chat_bp.route('/conversation/clear', methods=['POST'])
 def clear_conversation():
-    """Clear the conversation history stored in the session."""
+    """Clear the conversation history for this session."""
     fail = _validate_csrf_if_session()
     if fail: return fail
     
     # Clear conversation history
-    if 'conversation_history' in session:
-        session['conversation_history'] = []
-        session.modified = True
+    clear_history(session.get('sid'))
+    session.pop('conversation_history', None)
     
     return jsonify({'status': 'success', 'message': 'Conversation history cleared'})
 
 def init_chat_route(app):
-    app.register_blueprint(chat_bp)
\ No newline at end of file
+    app.register_blueprint(chat_bp)
+    # Load and exercise the embedding model before the first /chat or /kb/search needs it.
+    # Only in forked workers: under gunicorn preload this runs in the master, and ONNX
+    # Runtime / OpenMP thread pools used before a fork can hang the child's first encode.
+    # The single-process dev server warms up from app.main().
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=start_embedding_warmup)
\ No newline at end of file
@@ -1,31 +1,124 @@
-"""Simple JSON lines audit logger for security-relevant events."""
+"""Simple JSON lines audit logger for security-relevant events.
+
+audit() only enqueues; a per-process daemon thread encodes records and appends
+them to a persistent buffered handle, flushing after each drained burst.
+"""
 from __future__ import annotations
-import json, os, threading, time
+import atexit, json, os, queue, threading, time
+
+from utils.json_utils import dumps_bytes, loads
 
-_LOCK = threading.Lock()
 AUDIT_PATH = os.environ.get('LPS2_AUDIT_LOG', os.path.join(os.path.dirname(__file__), 'audit.log'))
 
+_QUEUE: queue.SimpleQueue = queue.SimpleQueue()
+_WRITE_LOCK = threading.Lock()   # held while writing/flushing the handle
+_START_LOCK = threading.Lock()
+_FH = None
+_WRITER_PID = None
+# Bytes read per requested record when tailing; the window doubles until enough lines are found
+_TAIL_BYTES_PER_RECORD = 256
+
+def _encode(rec: dict) -> bytes:
+    try:
+        return dumps_bytes(rec) + b'\n'
+    except Exception:
+        # Never lose an event (or the writer thread) over an unserializable field
+        return json.dumps(rec, ensure_ascii=False, default=str).encode('utf-8') + b'\n'
+
+def _write_pending(first=None) -> None:
+    global _FH
+    with _WRITE_LOCK:
+        if _FH is None:
+            _FH = open(AUDIT_PATH, 'ab', buffering=1 << 16)
+        if first is not None:
+            _FH.write(_encode(first))
+        while True:
+            try:
+                rec = _QUEUE.get_nowait()
+            except queue.Empty:
+                break
+            _FH.write(_encode(rec))
+        _FH.flush()
+
+def _writer() -> None:
+    while True:
+        rec = _QUEUE.get()
+        try:
+            _write_pending(rec)
+        except Exception:
+            time.sleep(1)
+
+def _ensure_writer() -> None:
+    global _WRITER_PID
+    if _WRITER_PID == os.getpid():
+        return
+    with _START_LOCK:
+        if _WRITER_PID != os.getpid():
+            threading.Thread(target=_writer, name='lps2-audit', daemon=True).start()
+            _WRITER_PID = os.getpid()
+
 def audit(event: str, **fields):
-    rec = {
+    _QUEUE.put({
         'ts': time.time(),
         'event': event,
         **fields
-    }
-    line = json.dumps(rec, ensure_ascii=False)
-    with _LOCK:
-        with open(AUDIT_PATH, 'a', encoding='utf-8') as f:
-            f.write(line + '\n')
+    })
+    _ensure_writer()
+
+def flush_audit() -> None:
+    """Write out any queued records now (used at exit and before reads)."""
+    try:
+        _write_pending()
+    except Exception:
+        pass
+
+atexit.register(flush_audit)
+
+def _before_fork():
+    _WRITE_LOCK.acquire()
+    if _FH is not None:
+        _FH.flush()  # a child must not inherit (and later re-flush) buffered parent bytes
+
+def _after_fork_parent():
+    _WRITE_LOCK.release()
+
+def _after_fork_child():
+    global _QUEUE, _WRITE_LOCK, _START_LOCK, _FH
+    # Records still queued belong to the parent's writer; start clean in the child
+    _QUEUE = queue.SimpleQueue()
+    _WRITE_LOCK = threading.Lock()
+    _START_LOCK = threading.Lock()
+    _FH = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_parent,
+                        after_in_child=_after_fork_child)
 
 def read_audit(limit: int = 500):
+    """Newest `limit` records, oldest first; reads only a tail window of the log."""
+    if limit <= 0:
+        return []  # lines[-0:] below would otherwise return the whole window
     try:
         if not os.path.exists(AUDIT_PATH):
             return []
-        with open(AUDIT_PATH, 'r', encoding='utf-8') as f:
-            lines = f.readlines()[-limit:]
+        if _WRITER_PID == os.getpid():
+            flush_audit()
+        with open(AUDIT_PATH, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            window = limit * _TAIL_BYTES_PER_RECORD
+            while True:
+                start = max(0, size - window)
+                f.seek(start)
+                lines = f.read(size - start).splitlines()
+                if start > 0:
+                    lines = lines[1:]  # first line is likely partial
+                if start == 0 or len(lines) >= limit:
+                    break
+                window *= 2
         out = []
-        for ln in lines:
+        for ln in lines[-limit:]:
             try:
-                out.append(json.loads(ln))
+                out.append(loads(ln))
             except Exception:
                 continue
         return out
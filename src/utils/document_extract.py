@@ -0,0 +1,193 @@
+"""Text extraction for knowledge-base uploads (PDF parser with OCR fallback).
+
+OCR runs page-parallel: pdf2image renders with several poppler threads and each
+page goes to a thread pool for pytesseract. Both tools shell out to native
+binaries, so threads run truly in parallel without a process pool. Results are
+cached by content hash so re-uploading the same PDF skips extraction.
+
+Typical usage:
+    ```python
+    from utils.document_extract import extract_pdf_text, ExtractionError
+
+    try:
+        text = extract_pdf_text(raw, ocr_requested=False)
+    except ExtractionError as e:
+        return jsonify({'error': str(e)}), 400
+    ```
+"""
+from __future__ import annotations
+
+import concurrent.futures
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+try:
+    import blake3  # type: ignore
+    _BLAKE3_AVAILABLE = True
+except ImportError:
+    blake3 = None  # type: ignore
+    _BLAKE3_AVAILABLE = False
+
+OCR_MAX_PAGES = int(os.environ.get('LPS2_OCR_MAX_PAGES', '50'))
+OCR_DPI = int(os.environ.get('LPS2_OCR_DPI', '200'))
+# Concurrent tesseract/poppler processes per app process
+OCR_WORKERS = int(os.environ.get('LPS2_OCR_WORKERS', str(os.cpu_count() or 2)))
+# Tesseract options: LSTM engine only, one uniform text block per page (cheaper
+# than full layout analysis); use '--psm 3' for multi-column scans
+OCR_CONFIG = os.environ.get('LPS2_OCR_CONFIG', '--oem 1 --psm 6')
+OCR_LANG = os.environ.get('LPS2_OCR_LANG', 'eng')
+# Extracted texts kept in memory, keyed by upload hash
+EXTRACT_CACHE_SIZE = 16
+# Read size when hashing upload streams
+_HASH_CHUNK = 1024 * 1024
+
+_OCR_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr')
+_CACHE: "OrderedDict[Tuple[str, bool], str]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+class ExtractionError(Exception):
+    """Raised when no usable text can be produced; the message is client-safe."""
+
+
+def content_hash(raw: bytes) -> str:
+    """Hex digest of raw bytes (blake3 when installed, else blake2b)."""
+    if _BLAKE3_AVAILABLE:
+        return blake3.blake3(raw).hexdigest()
+    return hashlib.blake2b(raw, digest_size=32).hexdigest()
+
+
+def _new_hasher():
+    return blake3.blake3() if _BLAKE3_AVAILABLE else hashlib.blake2b(digest_size=32)
+
+
+def hash_stream(stream: BinaryIO) -> Tuple[str, int]:
+    """content_hash of a seekable stream read in chunks, plus its size; rewinds it."""
+    h = _new_hasher()
+    size = 0
+    stream.seek(0)
+    while True:
+        chunk = stream.read(_HASH_CHUNK)
+        if not chunk:
+            break
+        h.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return h.hexdigest(), size
+
+
+def _read_all(src: Union[bytes, BinaryIO]) -> bytes:
+    if isinstance(src, (bytes, bytearray)):
+        return bytes(src)
+    src.seek(0)
+    return src.read()
+
+
+def _ocr_page(img) -> str:
+    import pytesseract  # type: ignore
+    return pytesseract.image_to_string(img, lang=OCR_LANG, config=OCR_CONFIG)
+
+
+def _ocr_pages(raw: bytes, page_count: int) -> Tuple[List[str], List[str]]:
+    """OCR up to OCR_MAX_PAGES pages; returns (page texts, warnings)."""
+    from pdf2image import convert_from_bytes  # type: ignore
+    errors: List[str] = []
+    try:
+        images = convert_from_bytes(
+            raw, dpi=OCR_DPI, fmt='png', first_page=1,
+            last_page=min(page_count, OCR_MAX_PAGES), thread_count=OCR_WORKERS
+        )
+    except Exception as e:
+        return [], [f'convert_failed:{e}']
+    # Each page is its own tesseract process; results are merged in page order
+    futures = [_OCR_POOL.submit(_ocr_page, img) for img in images]
+    texts = []
+    for idx, fut in enumerate(futures, start=1):
+        try:
+            txt_page = fut.result()
+        except Exception as e:
+            errors.append(f'page{idx}:{e}')
+            txt_page = ''
+        if txt_page and txt_page.strip():
+            texts.append(f"# OCR Page {idx}\n{txt_page.strip()}")
+    return texts, errors
+
+
+def _extract(src: Union[bytes, BinaryIO], ocr_requested: bool) -> str:
+    try:
+        import PyPDF2  # type: ignore
+    except Exception as e:
+        raise ExtractionError(f'PDF support not available: {e}')
+    try:
+        if isinstance(src, (bytes, bytearray)):
+            src = BytesIO(src)
+        src.seek(0)
+        pdf_reader = PyPDF2.PdfReader(src)
+        pages = []
+        for p in pdf_reader.pages:
+            try:
+                pages.append(p.extract_text() or '')
+            except Exception:
+                pages.append('')
+    except Exception as e:
+        raise ExtractionError(f'pdf parse failed: {e}')
+    extracted = '\n\n'.join([p.strip() for p in pages if p and p.strip()])
+    # OCR fallback when no/low text or explicitly requested
+    if not (ocr_requested or len(extracted.strip()) < 40):
+        return extracted
+    try:
+        import pytesseract  # type: ignore  # noqa: F401
+        import pdf2image  # type: ignore  # noqa: F401
+    except Exception as e:
+        if not extracted.strip():
+            raise ExtractionError(f'no extractable text and OCR unavailable: {e}')
+        return extracted  # Keep extracted text only
+    try:
+        # pdf2image needs the bytes; only the OCR path pulls the whole upload into memory
+        ocr_text, ocr_errors = _ocr_pages(_read_all(src), len(pages))
+    except Exception as e:
+        if not extracted.strip():
+            raise ExtractionError(f'OCR process failed and no parser text: {e}')
+        return extracted
+    if not ocr_text:
+        if not extracted.strip():
+            raise ExtractionError('no extractable text found (parser & OCR)')
+        return extracted
+    # Merge original extracted (if any) plus OCR
+    combined = []
+    if extracted.strip():
+        combined.append('# Extracted Text (Parser)\n' + extracted.strip())
+    combined.append('\n'.join(ocr_text))
+    text = '\n\n'.join(combined)
+    if ocr_errors:
+        text += f"\n\n# OCR Warnings\n{'; '.join(ocr_errors)}"
+    return text
+
+
+def extract_pdf_text(src: Union[bytes, BinaryIO], ocr_requested: bool = False,
+                     digest: Optional[str] = None) -> str:
+    """Extract text from PDF bytes or a seekable binary stream, OCRing when the parser finds little or none.
+
+    digest is the upload's content_hash/hash_stream value when already known.
+
+    Raises:
+        ExtractionError: no usable text could be produced
+    """
+    if digest is None:
+        digest = content_hash(src) if isinstance(src, (bytes, bytearray)) else hash_stream(src)[0]
+    key = (digest, bool(ocr_requested))
+    with _CACHE_LOCK:
+        cached = _CACHE.get(key)
+        if cached is not None:
+            _CACHE.move_to_end(key)
+            return cached
+    text = _extract(src, ocr_requested)
+    with _CACHE_LOCK:
+        _CACHE[key] = text
+        while len(_CACHE) > EXTRACT_CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return text
@@ -34,17 +34,36 @@ can be configured through the LPS2_EMBED_MODEL environment variable.
 """
 
 import os
+import hashlib
+import logging
 import threading
-from typing import List, Optional, Any, Dict, Union
+from collections import OrderedDict
+from typing import List, Optional, Any, Dict, Tuple, Union
 import numpy as np
 from numpy.typing import NDArray
 
+logger = logging.getLogger("lps2")
+
 _EMBEDDING_MODEL = None
 _EMBEDDING_MODEL_LOCK = threading.Lock()
 
 _SENTENCE_TRANSFORMERS_AVAILABLE = False
 SentenceTransformer = None  # type: ignore
 
+try:
+    import hnswlib  # type: ignore
+    _HNSWLIB_AVAILABLE = True
+except ImportError:
+    hnswlib = None  # type: ignore
+    _HNSWLIB_AVAILABLE = False
+
+try:
+    import simsimd  # type: ignore
+    _SIMSIMD_AVAILABLE = True
+except ImportError:
+    simsimd = None  # type: ignore
+    _SIMSIMD_AVAILABLE = False
+
 # Default model if not specified in environment
 DEFAULT_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
 
@@ -54,6 +73,38 @@ CURRENT_EMBEDDING_MODEL_NAME = os.environ.get(
     DEFAULT_EMBEDDING_MODEL
 )
 
+# Texts per SentenceTransformer.encode call for batch embedding
+EMBED_BATCH_SIZE = int(os.environ.get('LPS2_EMBED_BATCH', '32'))
+
+# In-memory search index precision: '' (float32), 'fp16' (half the bytes) or 'int8'
+# (per-row scalar quantization, a quarter)
+EMBED_QUANT = os.environ.get('LPS2_EMBED_QUANT', '').strip().lower()
+
+# SentenceTransformer inference backend: 'onnx' (ONNX Runtime), 'openvino' or 'torch'.
+# Non-torch backends need sentence-transformers>=3.2 plus optimum; loading falls back to torch.
+EMBED_BACKEND = os.environ.get('LPS2_EMBED_BACKEND', 'onnx').strip().lower()
+# ONNX file inside the model repo; the int8 VNNI export is picked when LPS2_EMBED_QUANT=int8
+EMBED_ONNX_FILE = os.environ.get(
+    'LPS2_EMBED_ONNX_FILE',
+    'onnx/model_qint8_avx512_vnni.onnx' if EMBED_QUANT == 'int8' else ''
+)
+
+# Approximate search for KB/memory: 'hnsw' (needs hnswlib) or '' for exact brute force.
+# Below ANN_MIN_ROWS rows the exact matmul is already fast, so no graph is built.
+ANN_BACKEND = os.environ.get('LPS2_KB_ANN', '').strip().lower()
+ANN_MIN_ROWS = int(os.environ.get('LPS2_ANN_MIN_ROWS', '5000'))
+ANN_EF_SEARCH = int(os.environ.get('LPS2_ANN_EF', '64'))
+
+# Query embeddings kept per process (LRU), so repeated searches skip the model
+QUERY_CACHE_SIZE = int(os.environ.get('LPS2_QUERY_CACHE_SIZE', '4096'))
+_QUERY_CACHE: "OrderedDict[Tuple[str, str], NDArray[np.float32]]" = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+
+# Torch intra-op threads per process; by default the cores are split across gunicorn workers
+TORCH_THREADS = int(os.environ.get('LPS2_TORCH_THREADS', '0')) or max(
+    1, (os.cpu_count() or 1) // max(1, int(os.environ.get('LPS2_WORKERS', '1')))
+)
+
 def _lazy_import_embeddings() -> bool:
     """Lazily import sentence-transformers to avoid startup overhead."""
     global SentenceTransformer, np, _SENTENCE_TRANSFORMERS_AVAILABLE
@@ -75,10 +126,67 @@ def get_embedding_model() -> Any:
     
     with _EMBEDDING_MODEL_LOCK:
         if _EMBEDDING_MODEL is None:
-            _EMBEDDING_MODEL = SentenceTransformer(CURRENT_EMBEDDING_MODEL_NAME)
+            _configure_torch()
+            _EMBEDDING_MODEL = _load_model(CURRENT_EMBEDDING_MODEL_NAME)
     
     return _EMBEDDING_MODEL
 
+def _load_model(name: str) -> Any:
+    """Build the SentenceTransformer on EMBED_BACKEND, falling back to plain torch."""
+    if EMBED_BACKEND in ('onnx', 'openvino'):
+        model_kwargs: Dict[str, Any] = {}
+        if EMBED_BACKEND == 'onnx':
+            model_kwargs['provider'] = 'CPUExecutionProvider'
+        if EMBED_ONNX_FILE and EMBED_BACKEND == 'onnx':
+            model_kwargs['file_name'] = EMBED_ONNX_FILE
+        try:
+            return SentenceTransformer(name, backend=EMBED_BACKEND, model_kwargs=model_kwargs)
+        except Exception as e:  # old sentence-transformers, missing optimum/onnxruntime, no export
+            logger.warning("Embedding backend %s unavailable (%s); using torch", EMBED_BACKEND, e)
+    return SentenceTransformer(name)
+
+def _configure_torch() -> None:
+    """Apply TORCH_THREADS if torch is the backend in use."""
+    try:
+        import torch  # type: ignore
+    except ImportError:
+        return
+    try:
+        torch.set_num_threads(TORCH_THREADS)
+    except Exception:
+        pass
+
+def warm_embedding_model() -> None:
+    """Load the model and run one encode so the first real query skips init costs."""
+    try:
+        if get_embedding_model() is not None:
+            _configure_torch()  # thread settings are per process; re-apply after fork
+            generate_embedding("warmup")
+    except Exception:
+        pass
+
+def start_embedding_warmup() -> None:
+    """Run warm_embedding_model on a daemon thread."""
+    threading.Thread(target=warm_embedding_model, name='lps2-embed-warmup', daemon=True).start()
+
+def _reset_after_fork() -> None:
+    global _EMBEDDING_MODEL_LOCK
+    # A fork while the warmup thread held the lock would leave it locked forever in the child
+    _EMBEDDING_MODEL_LOCK = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _encode(model: Any, texts: List[str], batch_size: int) -> NDArray[np.float32]:
+    """Encode texts to L2-normalized float32 rows."""
+    return model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    ).astype(np.float32, copy=False)
+
 def generate_embedding(text: str) -> Optional[NDArray[np.float32]]:
     """Generate an embedding vector for the given text.
     
@@ -86,32 +194,64 @@ def generate_embedding(text: str) -> Optional[NDArray[np.float32]]:
         text: The text to embed
         
     Returns:
-        Numpy array embedding or None if embedding fails
+        Unit-length float32 embedding or None if embedding fails
     """
-    model = get_embedding_model()
-    if model is None:
-        return None
-    
-    try:
-        return model.encode(text, show_progress_bar=False)
-    except Exception:
-        return None
+    embeddings = generate_embeddings([text], batch_size=1)
+    return embeddings[0]
+
+def embed_query(text: str) -> Optional[NDArray[np.float32]]:
+    """generate_embedding for search queries, memoized by a hash of the whitespace-normalized text.
+
+    The returned array is shared between callers and marked read-only.
+    """
+    normalized = ' '.join(text.split())
+    key = (CURRENT_EMBEDDING_MODEL_NAME,
+           hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest())
+    with _QUERY_CACHE_LOCK:
+        cached = _QUERY_CACHE.get(key)
+        if cached is not None:
+            _QUERY_CACHE.move_to_end(key)
+            return cached
+    emb = generate_embedding(normalized)
+    if emb is None or QUERY_CACHE_SIZE <= 0:
+        return emb
+    emb.setflags(write=False)
+    with _QUERY_CACHE_LOCK:
+        _QUERY_CACHE[key] = emb
+        while len(_QUERY_CACHE) > QUERY_CACHE_SIZE:
+            _QUERY_CACHE.popitem(last=False)
+    return emb
 
-def generate_embeddings(texts: List[str]) -> List[Optional[NDArray[np.float32]]]:
+def generate_embeddings(texts: List[str], batch_size: Optional[int] = None) -> Union[NDArray[np.float32], List[None]]:
     """Generate embeddings for multiple texts.
+
+    Texts are length-sorted into micro-batches (less padding per batch) and
+    written into one preallocated (N, D) float32 matrix in input order.
     
     Args:
         texts: List of texts to embed
+        batch_size: Texts per model call (default LPS2_EMBED_BATCH, 32)
         
     Returns:
-        List of embedding vectors (or None for failed embeddings)
+        (N, D) array of unit-length embeddings, or a list of None when the
+        model is unavailable or encoding fails
     """
     model = get_embedding_model()
     if model is None:
         return [None] * len(texts)
-    
+    if not texts:
+        return np.empty((0, model.get_sentence_embedding_dimension() or 0), dtype=np.float32)
+    batch_size = batch_size or EMBED_BATCH_SIZE
     try:
-        return model.encode(texts, show_progress_bar=False)
+        order = np.argsort([len(t) for t in texts], kind='stable')
+        out = None
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            batch = _encode(model, [texts[i] for i in idx], batch_size)
+            if out is None:
+                out = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            out[idx] = batch
+        return out
     except Exception:
         return [None] * len(texts)
 
@@ -125,25 +265,195 @@ def cosine_similarity(a: NDArray[np.float32], b: NDArray[np.float32]) -> float:
         
     return np.dot(a, b) / (norm_a * norm_b)
 
+def normalize_rows(matrix: Union[NDArray[np.float32], List[Any]]) -> NDArray[np.float32]:
+    """Return matrix as a contiguous float32 array with unit-length rows (zero rows stay zero)."""
+    m = np.ascontiguousarray(matrix, dtype=np.float32)
+    if m.size == 0:
+        return m
+    return m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+
 def batch_cosine_similarity(query: NDArray[np.float32], 
-                           embeddings: List[NDArray[np.float32]]) -> List[float]:
-    """Calculate cosine similarity between a query and multiple embeddings."""
-    if not embeddings:
-        return []
-        
-    query_norm = np.linalg.norm(query)
-    if query_norm == 0:
-        return [0.0] * len(embeddings)
-    
-    normalized_query = query / query_norm
-    
-    similarities = []
-    for emb in embeddings:
-        emb_norm = np.linalg.norm(emb)
-        if emb_norm == 0:
-            similarities.append(0.0)
-        else:
-            normalized_emb = emb / emb_norm
-            similarities.append(float(np.dot(normalized_query, normalized_emb)))
-    
-    return similarities
\ No newline at end of file
+                           embeddings: Union[NDArray[np.float32], List[NDArray[np.float32]]],
+                           normalized: bool = False) -> NDArray[np.float32]:
+    """Calculate cosine similarity between a query and each row of embeddings.
+
+    A single matrix-vector product. Pass ``normalized=True`` when the rows are
+    already unit length (see normalize_rows) to skip re-normalizing per call.
+    """
+    if len(embeddings) == 0:
+        return np.empty(0, dtype=np.float32)
+    m = embeddings if normalized else normalize_rows(embeddings)
+    q = np.asarray(query, dtype=np.float32)
+    norm = float(np.linalg.norm(q))
+    if _SIMSIMD_AVAILABLE and norm > 0:
+        return _simsimd_similarity(q[None, :], m)[0]
+    return m @ (q / max(norm, 1e-12))
+
+def _simsimd_similarity(queries: NDArray[Any], matrix: NDArray[Any]) -> NDArray[np.float32]:
+    """(Q, N) cosine similarities via SimSIMD's runtime-dispatched (AVX-512/NEON) kernels.
+
+    Inputs must share a dtype (float32 or int8); cosine is scale-invariant, so
+    int8 rows from quantize_int8 are scored directly without dequantizing.
+    """
+    dists = simsimd.cdist(queries, matrix, metric='cosine', out_dtype='float32')
+    return 1.0 - np.asarray(dists, dtype=np.float32)
+
+def batch_cosine_similarity_many(queries: NDArray[np.float32],
+                                 embeddings: NDArray[np.float32]) -> NDArray[np.float32]:
+    """(Q, N) cosine similarities of several queries against unit rows in one call."""
+    qs = normalize_rows(np.atleast_2d(queries))
+    if len(embeddings) == 0 or len(qs) == 0:
+        return np.empty((len(qs), 0), dtype=np.float32)
+    if _SIMSIMD_AVAILABLE:
+        sims = _simsimd_similarity(qs, embeddings)
+        # SimSIMD reports zero-vs-zero as identical; match the matmul's 0 for empty queries
+        sims[~qs.any(axis=1)] = 0.0
+        return sims
+    return qs @ np.asarray(embeddings, dtype=np.float32).T
+
+def top_k_indices(scores: NDArray[np.float32], k: int) -> NDArray[np.intp]:
+    """Indices of the k highest scores, best first (argpartition, no full sort)."""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind='stable')]
+
+def quantize_int8(matrix: NDArray[np.float32]) -> Tuple[NDArray[np.int8], NDArray[np.float32]]:
+    """Scalar-quantize rows to int8 with a per-row scale (row ~= q * scale)."""
+    m = np.asarray(matrix, dtype=np.float32)
+    scales = np.maximum(np.abs(m).max(axis=1), 1e-12) / 127.0
+    q = np.rint(m / scales[:, None]).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+# Rows widened per block; bounds the transient float32 copy when scoring fp16/int8 rows
+_WIDEN_BLOCK_ROWS = 4096
+
+def _blocked_matvec(matrix: NDArray[Any], q: NDArray[np.float32]) -> NDArray[np.float32]:
+    # NumPy matmul on int8/float16 is not BLAS-backed (and int16 accumulators overflow
+    # at typical dimensions), so blocks are widened to float32 for the product
+    out = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), _WIDEN_BLOCK_ROWS):
+        stop = start + _WIDEN_BLOCK_ROWS
+        out[start:stop] = matrix[start:stop].astype(np.float32) @ q
+    return out
+
+def batch_cosine_similarity_int8(query: NDArray[np.float32], matrix: NDArray[np.int8],
+                                 scales: NDArray[np.float32]) -> NDArray[np.float32]:
+    """Cosine similarity against int8 unit rows from quantize_int8.
+
+    With SimSIMD the query is quantized too and scored by its int8 dot kernels;
+    otherwise rows are widened to float32 block by block.
+    """
+    n = len(matrix)
+    if n == 0:
+        return np.empty(0, dtype=np.float32)
+    q = np.asarray(query, dtype=np.float32)
+    norm = float(np.linalg.norm(q))
+    if _SIMSIMD_AVAILABLE and norm > 0:
+        q8 = quantize_int8(q[None, :])[0]
+        return _simsimd_similarity(q8, matrix)[0]
+    out = _blocked_matvec(matrix, q / max(norm, 1e-12))
+    out *= scales
+    return out
+
+def batch_cosine_similarity_fp16(query: NDArray[np.float32], matrix: NDArray[np.float16]) -> NDArray[np.float32]:
+    """Cosine similarity against float16 unit rows (SimSIMD f16 kernels when installed)."""
+    if len(matrix) == 0:
+        return np.empty(0, dtype=np.float32)
+    q = np.asarray(query, dtype=np.float32)
+    norm = float(np.linalg.norm(q))
+    if _SIMSIMD_AVAILABLE and norm > 0:
+        return _simsimd_similarity(q.astype(np.float16)[None, :], matrix)[0]
+    return _blocked_matvec(matrix, q / max(norm, 1e-12))
+
+class HnswIndex:
+    """HNSW graph over unit rows (cosine space); row ids are the original positions."""
+
+    def __init__(self, matrix: NDArray[np.float32], index: Any = None):
+        n, dim = matrix.shape
+        self._n = n
+        if index is None:
+            index = hnswlib.Index(space='cosine', dim=dim)
+            index.init_index(max_elements=n, ef_construction=200, M=16)
+            index.add_items(matrix, np.arange(n))
+        self._index = index
+
+    @classmethod
+    def cached(cls, matrix: NDArray[np.float32], prefix: str) -> 'HnswIndex':
+        """Load the graph saved for exactly these rows from `<prefix>.hnsw-<digest>`, else build and save it.
+
+        The file is keyed by a hash of the matrix, so any change to the rows (or their
+        order) misses and rebuilds; superseded graph files are removed after a save.
+        """
+        digest = hashlib.blake2b(np.ascontiguousarray(matrix).tobytes(), digest_size=8).hexdigest()
+        path = f"{prefix}.hnsw-{digest}"
+        if os.path.exists(path):
+            try:
+                index = hnswlib.Index(space='cosine', dim=matrix.shape[1])
+                index.load_index(path, max_elements=len(matrix))
+                if index.get_current_count() == len(matrix):
+                    return cls(matrix, index)
+            except Exception as e:
+                logger.warning("Ignoring unreadable HNSW graph %s: %s", path, e)
+        built = cls(matrix)
+        try:
+            tmp = path + '.tmp'
+            built._index.save_index(tmp)
+            os.replace(tmp, path)
+            folder, base = os.path.split(prefix)
+            for name in os.listdir(folder or '.'):
+                if name.startswith(base + '.hnsw-') and name != os.path.basename(path):
+                    os.remove(os.path.join(folder, name))
+        except OSError as e:
+            logger.warning("Could not save HNSW graph %s: %s", path, e)
+        return built
+
+    def query(self, query: NDArray[np.float32], k: int) -> Tuple[NDArray[np.intp], NDArray[np.float32]]:
+        k = min(k, self._n)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        self._index.set_ef(max(ANN_EF_SEARCH, k))
+        labels, dists = self._index.knn_query(np.asarray(query, dtype=np.float32), k=k)
+        return labels[0].astype(np.intp), (1.0 - dists[0]).astype(np.float32)
+
+def builds_dense_matrix(n_rows: int) -> bool:
+    """True when build_search_matrix returns a plain float32 unit matrix for n_rows rows."""
+    if ANN_BACKEND == 'hnsw' and _HNSWLIB_AVAILABLE and n_rows >= ANN_MIN_ROWS:
+        return False
+    return EMBED_QUANT not in ('int8', 'fp16')
+
+def build_search_matrix(vectors: Union[NDArray[np.float32], List[Any]],
+                        cache_prefix: Optional[str] = None) -> Any:
+    """Search structure for repeated scoring.
+
+    Unit-row float32 by default, float16 or int8-quantized per LPS2_EMBED_QUANT, or an
+    HnswIndex when LPS2_KB_ANN=hnsw and there are at least ANN_MIN_ROWS rows. With
+    cache_prefix the HNSW graph is persisted next to the store and reused on restart.
+    """
+    m = normalize_rows(vectors)
+    if ANN_BACKEND == 'hnsw' and _HNSWLIB_AVAILABLE and len(m) >= ANN_MIN_ROWS:
+        return HnswIndex.cached(m, cache_prefix) if cache_prefix else HnswIndex(m)
+    if EMBED_QUANT == 'int8' and m.size:
+        return quantize_int8(m)
+    if EMBED_QUANT == 'fp16' and m.size:
+        return m.astype(np.float16)
+    return m
+
+def score_search_matrix(query: NDArray[np.float32], matrix: Any) -> NDArray[np.float32]:
+    """Cosine similarity of query against a matrix from build_search_matrix."""
+    if isinstance(matrix, tuple):
+        return batch_cosine_similarity_int8(query, *matrix)
+    if matrix.dtype == np.float16:
+        return batch_cosine_similarity_fp16(query, matrix)
+    return batch_cosine_similarity(query, matrix, normalized=True)
+
+def search_top_k(query: NDArray[np.float32], matrix: Any, k: int) -> Tuple[NDArray[np.intp], NDArray[np.float32]]:
+    """Row indices of the k best matches (best first) and their cosine scores."""
+    if isinstance(matrix, HnswIndex):
+        return matrix.query(query, k)
+    sims = score_search_matrix(query, matrix)
+    idx = top_k_indices(sims, k)
+    return idx, sims[idx]
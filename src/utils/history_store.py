@@ -0,0 +1,80 @@
+"""Server-side conversation history keyed by an opaque per-session id.
+
+Keeps chat turns out of the signed session cookie, so the cookie stays small
+and is not re-serialized and re-signed with the whole history on every /chat.
+In-memory and per-process (like rate_limiter), so the app must run as a single
+process: with several workers, consecutive turns could land on workers holding
+different histories. gunicorn.conf.py refuses to start more than one worker.
+Histories idle for longer than HISTORY_TTL_SECONDS are evicted, and at most
+HISTORY_MAX_SESSIONS are kept (least recently used dropped first).
+"""
+from __future__ import annotations
+import time
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Deque, List, Optional, Tuple
+from config import HISTORY_TTL_SECONDS, HISTORY_MAX_MESSAGES, HISTORY_MAX_SESSIONS
+
+_LOCK = threading.Lock()
+# sid -> (last_used, messages), least recently appended first
+_HISTORY: "OrderedDict[str, Tuple[float, Deque[dict]]]" = OrderedDict()
+_SWEEP_INTERVAL = 60.0
+_last_sweep = 0.0
+
+
+def _sweep(now: float) -> None:
+    """Drop idle histories; runs at most once per _SWEEP_INTERVAL (caller holds _LOCK)."""
+    global _last_sweep
+    if now - _last_sweep < _SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+    cutoff = now - HISTORY_TTL_SECONDS
+    # Entries are in last-used order, so expired ones are all at the front
+    while _HISTORY:
+        sid, (ts, _) = next(iter(_HISTORY.items()))
+        if ts >= cutoff:
+            break
+        del _HISTORY[sid]
+
+
+def get_history(sid: Optional[str], limit: Optional[int] = None) -> List[dict]:
+    """Return a copy of the stored messages for sid (oldest first).
+
+    With limit, only the newest limit messages are copied.
+    """
+    if not sid:
+        return []
+    now = time.time()
+    with _LOCK:
+        entry = _HISTORY.get(sid)
+        if entry is None or entry[0] < now - HISTORY_TTL_SECONDS:
+            return []
+        history = entry[1]
+        if limit is not None and len(history) > limit:
+            return list(islice(history, len(history) - limit, None))
+        return list(history)
+
+
+def append_history(sid: Optional[str], *messages: dict) -> None:
+    """Append messages for sid, keeping only the last HISTORY_MAX_MESSAGES."""
+    if not sid:
+        return
+    now = time.time()
+    with _LOCK:
+        _sweep(now)
+        entry = _HISTORY.get(sid)
+        history = entry[1] if entry else deque(maxlen=HISTORY_MAX_MESSAGES)
+        history.extend(messages)
+        _HISTORY[sid] = (now, history)
+        _HISTORY.move_to_end(sid)
+        while len(_HISTORY) > HISTORY_MAX_SESSIONS:
+            _HISTORY.popitem(last=False)
+
+
+def clear_history(sid: Optional[str]) -> None:
+    """Forget the history for sid (e.g. on logout)."""
+    if not sid:
+        return
+    with _LOCK:
+        _HISTORY.pop(sid, None)
@@ -0,0 +1,86 @@
+"""Fast JSON helpers backed by orjson when it is installed.
+
+orjson encodes straight to bytes and is several times faster than the stdlib
+encoder Flask uses by default. It is optional: every helper here falls back to
+the stdlib ``json`` module so the app keeps working without it.
+
+Typical usage:
+    ```python
+    from utils.json_utils import dumps_bytes, loads, OrjsonProvider
+
+    app.json = OrjsonProvider(app)   # jsonify() now encodes with orjson
+    body = dumps_bytes({'status': 'ok'})
+    ```
+"""
+from __future__ import annotations
+
+import json
+from decimal import Decimal
+from typing import Any
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson  # type: ignore
+    _ORJSON_AVAILABLE = True
+    # Flask sorts keys by default; keep responses byte-identical in key order
+    _ORJSON_OPTS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+except ImportError:
+    orjson = None  # type: ignore
+    _ORJSON_AVAILABLE = False
+    _ORJSON_OPTS = 0
+
+
+def _default(obj: Any) -> Any:
+    """Handle the types Flask's provider supports that orjson does not."""
+    # Store scores are numpy scalars; orjson handles them natively, the stdlib path does not
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    return DefaultJSONProvider.default(obj)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Serialize obj to compact, key-sorted JSON bytes."""
+    if _ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTS)
+    return json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: str | bytes) -> Any:
+    """Parse JSON from str or bytes."""
+    if _ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson (stdlib fallback per call)."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        # Callers asking for stdlib-specific formatting (indent etc.) keep the default encoder
+        if not _ORJSON_AVAILABLE or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTS).decode('utf-8')
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if not _ORJSON_AVAILABLE or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if not _ORJSON_AVAILABLE or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=_ORJSON_OPTS | orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype
+        )
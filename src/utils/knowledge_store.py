@@ -1,22 +1,61 @@
 import os
-import json
 import threading
 import time
+import uuid
+import concurrent.futures
 import hashlib
+import sqlite3
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
 from utils.embeddings import (
     generate_embedding, 
-    generate_embeddings, 
-    batch_cosine_similarity,
+    generate_embeddings,
+    embed_query, 
     cosine_similarity,
     get_embedding_model,
+    build_search_matrix,
+    search_top_k,
     _lazy_import_embeddings,
     _SENTENCE_TRANSFORMERS_AVAILABLE,
     CURRENT_EMBEDDING_MODEL_NAME
 )
+from utils.json_utils import dumps_bytes, loads as json_loads
+from utils.security_utils import sanitize_text
+from config import QUARANTINE_ENABLED
 
+try:
+    import blake3  # type: ignore
+    _BLAKE3_AVAILABLE = True
+except ImportError:
+    blake3 = None  # type: ignore
+    _BLAKE3_AVAILABLE = False
+
+# Compact the quarantine log once remove ops exceed this share of its lines
+QUARANTINE_COMPACT_RATIO = 0.3
+# fsync quarantine log writes (off by default: trades durability on power loss for speed)
+DURABLE_QUARANTINE = os.environ.get('LPS2_DURABLE_QUARANTINE', '0') in ('1', 'true', 'yes')
+# On-disk precision of stored chunk vectors; float16 halves the database and the pages
+# read at load, and is well within cosine ranking tolerance for unit-scale embeddings
+VECTOR_DTYPE = np.dtype(os.environ.get('LPS2_KB_VECTOR_DTYPE', 'float16'))
+# Chunk texts (whole documents) embedded together per rebuild batch
+REBUILD_SLAB_TEXTS = 256
+
+
+def text_checksum(text: str) -> str:
+    """Checksum stored on each document: 'blake3:<hex>' when blake3 is installed, else bare sha256 hex."""
+    data = text.encode('utf-8')
+    if _BLAKE3_AVAILABLE:
+        return 'blake3:' + blake3.blake3(data).hexdigest()
+    return hashlib.sha256(data).hexdigest()
+
+def _uuid4_batch(n: int) -> List[str]:
+    """n random (version 4) UUID strings drawn from a single os.urandom call."""
+    buf = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=buf[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
+
+def _count_stale(docs: Iterable[Dict[str, Any]]) -> int:
+    return sum(1 for d in docs if d.get('embedding_model') != CURRENT_EMBEDDING_MODEL_NAME)
 
 def _simple_chunk(text: str, max_chars: int = 1200, overlap: int = 200) -> List[str]:
     """Naive text chunker with character windows + overlap.
@@ -36,11 +75,8 @@ def _simple_chunk(text: str, max_chars: int = 1200, overlap: int = 200) -> List[
                 chunks.append('\n'.join(buf))
             # start new buffer; if single paragraph longer than max, hard slice
             if len(p) > max_chars:
-                start = 0
-                while start < len(p):
-                    seg = p[start:start+max_chars]
-                    chunks.append(seg)
-                    start += max_chars - overlap if overlap < max_chars else max_chars
+                step = max_chars - overlap if overlap < max_chars else max_chars
+                chunks.extend(p[start:start + max_chars] for start in range(0, len(p), step))
                 buf = []
                 current_len = 0
             else:
@@ -66,11 +102,7 @@ def _heading_semantic_chunks(text: str, max_chars: int = 1200, overlap: int = 20
     current_buf: List[str] = []
     current_len = 0
     chunks: List[str] = []
-
-    def heading_prefix():
-        if not headings:
-            return ''
-        return '\n'.join([('#' * lvl) + ' ' + title for lvl, title in headings]) + '\n\n'
+    prefix = ''  # heading context for the current section, rebuilt only when headings change
 
     for raw in lines:
         line = raw.rstrip()
@@ -79,32 +111,33 @@ def _heading_semantic_chunks(text: str, max_chars: int = 1200, overlap: int = 20
         if line.startswith('#'):
             # Flush current buffer as chunk if has content
             if current_buf:
-                content = heading_prefix() + '\n'.join(current_buf)
+                content = prefix + '\n'.join(current_buf)
                 chunks.append(content)
                 current_buf = []
                 current_len = 0
             # Parse heading
-            hashes = 0
-            for ch in line:
-                if ch == '#':
-                    hashes += 1
-                else:
-                    break
+            title = line.lstrip('#')
+            hashes = len(line) - len(title)
             level = max(1, min(6, hashes))
-            title = line[hashes:].strip() or 'Untitled'
+            title = title.strip() or 'Untitled'
             # Trim stack to parent level-1
             headings = [h for h in headings if h[0] < level]
             headings.append((level, title))
+            prefix = '\n'.join([('#' * lvl) + ' ' + t for lvl, t in headings]) + '\n\n'
             continue
         # Normal paragraph line
         if current_len + len(line) + 1 > max_chars and current_buf:
             # Emit chunk
-            content = heading_prefix() + '\n'.join(current_buf)
+            content = prefix + '\n'.join(current_buf)
             chunks.append(content)
             # Overlap: keep last overlap chars
             if overlap > 0 and current_buf:
-                joined = '\n'.join(current_buf)
-                tail = joined[-overlap:]
+                # Join only the trailing lines that cover the overlap, not the whole buffer
+                start, covered = len(current_buf), -1
+                while start > 0 and covered < overlap:
+                    start -= 1
+                    covered += len(current_buf[start]) + 1
+                tail = '\n'.join(current_buf[start:])[-overlap:]
                 current_buf = [tail]
                 current_len = len(tail)
             else:
@@ -113,7 +146,7 @@ def _heading_semantic_chunks(text: str, max_chars: int = 1200, overlap: int = 20
         current_buf.append(line)
         current_len += len(line) + 1
     if current_buf:
-        content = heading_prefix() + '\n'.join(current_buf)
+        content = prefix + '\n'.join(current_buf)
         chunks.append(content)
     # Fallback if nothing produced
     if not chunks:
@@ -129,34 +162,172 @@ def _heading_semantic_chunks(text: str, max_chars: int = 1200, overlap: int = 20
 
 
 class KnowledgeStore:
+    """Chunked documents with embeddings, held in memory and persisted to SQLite.
+
+    Each document is one row: its metadata and chunk texts as a JSON blob plus a
+    raw VECTOR_DTYPE blob of its chunk embeddings, so a write touches only the
+    documents that changed. A legacy JSON store at `path` is imported on first use.
+    """
+
     def __init__(self, path: Optional[str] = None):
         if path is None:
             path = os.path.join(os.path.dirname(__file__), 'knowledge_store.json')
         self.path = path
+        self.db_path = os.path.splitext(path)[0] + '.sqlite3'
         self._lock = threading.Lock()
         self._data: Dict[str, Any] = {"documents": []}
+        # ([(doc, chunk), ...], search matrix, see build_search_matrix); rebuilt lazily after any mutation
+        self._index: Optional[Tuple[List[Tuple[Dict[str, Any], Dict[str, Any]]], Any]] = None
+        # Bumped with every invalidation so an index built from an older snapshot is not published
+        self._version = 0
+        self._index_build_lock = threading.Lock()
+        self._quarantine_lock = threading.Lock()
         self._load()
+        # Documents embedded with a model other than CURRENT_EMBEDDING_MODEL_NAME; kept in
+        # step under self._lock so ingest can check for a pending rebuild in O(1)
+        self._stale_docs = _count_stale(self._documents())
+
+    def _connect(self) -> sqlite3.Connection:
+        # Short-lived connections: nothing to re-open after gunicorn forks workers
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
 
     def _load(self):
         try:
-            if os.path.exists(self.path):
-                with open(self.path, 'r', encoding='utf-8') as f:
-                    self._data = json.load(f)
-                    if 'documents' not in self._data:
-                        self._data = {"documents": []}
+            if not os.path.exists(self.db_path):
+                self._import_legacy_json()
+                return
+            conn = self._connect()
+            try:
+                rows = conn.execute('SELECT doc, vectors, dim, dtype FROM documents ORDER BY seq').fetchall()
+            finally:
+                conn.close()
+            self._data = {"documents": [self._doc_from_row(*r) for r in rows]}
         except Exception:
             self._data = {"documents": []}
 
-    def _persist(self):
+    @staticmethod
+    def _doc_from_row(doc_blob: bytes, vectors: Optional[bytes], dim: int, dtype: Optional[str]) -> Dict[str, Any]:
+        doc = json_loads(doc_blob)
+        # Zero-copy read-only view over the blob; rows are converted only when scored
+        mat = np.frombuffer(vectors, dtype=dtype).reshape(-1, dim) if vectors and dim else None
+        for c in doc.get('chunks', []):
+            row = c.pop('vec', None)
+            if mat is not None and row is not None and row < len(mat):
+                c['embedding'] = mat[row]
+        return doc
+
+    def _import_legacy_json(self):
+        """Load a pre-SQLite JSON store (with optional .npy sidecar) and write it to the database."""
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                self._data = json_loads(f.read())
+            if 'documents' not in self._data:
+                self._data = {"documents": []}
+            self._attach_vectors()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS documents ('
+                    'doc_id TEXT PRIMARY KEY, seq INTEGER NOT NULL, doc BLOB NOT NULL, '
+                    'vectors BLOB, dim INTEGER, dtype TEXT)'
+                )
+                for seq, d in enumerate(self._data['documents']):
+                    conn.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)',
+                                 (d.get('doc_id'), seq, *self._doc_to_row(d)))
+        finally:
+            conn.close()
+
+    def _attach_vectors(self):
+        """Point each chunk's embedding at its row of the legacy JSON store's .npy sidecar."""
+        name = self._data.pop('vectors_file', None)
+        if not name:
+            return  # oldest format: embeddings inline in the JSON
+        try:
+            mat = np.load(os.path.join(os.path.dirname(self.path), name), mmap_mode='r')
+        except Exception:
+            mat = None  # sidecar lost; chunks stay unsearchable until a rebuild
+        for d in self._data.get('documents', []):
+            for c in d.get('chunks', []):
+                row = c.pop('vec', None)
+                if mat is not None and row is not None and row < len(mat):
+                    c['embedding'] = mat[row]
+
+    @staticmethod
+    def _doc_to_row(doc: Dict[str, Any]) -> Tuple[bytes, Optional[bytes], Optional[int], Optional[str]]:
+        """(doc json, vectors blob, dim, dtype) for one document."""
+        embedded = [c for c in doc.get('chunks', []) if c.get('embedding') is not None]
+        mat = None
+        if embedded:
+            try:
+                mat = np.asarray([c['embedding'] for c in embedded], dtype=VECTOR_DTYPE)
+            except ValueError:
+                mat = None  # ragged vectors; keep them inline in the JSON blob
+        rows = {id(c): i for i, c in enumerate(embedded)} if mat is not None and mat.ndim == 2 else {}
+
+        def _chunk_out(c):
+            if id(c) in rows:
+                out = {k: v for k, v in c.items() if k != 'embedding'}
+                out['vec'] = rows[id(c)]
+                return out
+            return c
+
+        blob = dumps_bytes({**doc, 'chunks': [_chunk_out(c) for c in doc.get('chunks', [])]})
+        if not rows:
+            return blob, None, None, None
+        return blob, np.ascontiguousarray(mat).tobytes(), int(mat.shape[1]), VECTOR_DTYPE.str
+
+    def _persist_docs(self, docs: List[Dict[str, Any]]):
+        """Insert or replace documents in one transaction; new doc_ids are appended after the existing ones."""
         try:
-            tmp = self.path + '.tmp'
-            with open(tmp, 'w', encoding='utf-8') as f:
-                json.dump(self._data, f)
-            os.replace(tmp, self.path)
+            rows = [(d.get('doc_id'), *self._doc_to_row(d)) for d in docs]
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO documents (doc_id, seq, doc, vectors, dim, dtype) '
+                        'VALUES (?, (SELECT COALESCE(MAX(seq), -1) + 1 FROM documents), ?, ?, ?, ?) '
+                        'ON CONFLICT(doc_id) DO UPDATE SET doc=excluded.doc, vectors=excluded.vectors, '
+                        'dim=excluded.dim, dtype=excluded.dtype',
+                        rows
+                    )
+            finally:
+                conn.close()
         except Exception:
             pass
 
-    def ingest_text(self, text: str, source: str, metadata: Optional[Dict[str, Any]] = None, doc_id: Optional[str] = None, replace: bool = False) -> Dict[str, Any]:
+    def _delete_rows(self, doc_ids: List[str]):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany('DELETE FROM documents WHERE doc_id = ?', [(i,) for i in doc_ids])
+            finally:
+                conn.close()
+        except Exception:
+            pass
+
+    def get_doc_id_by_text(self, text: str) -> Optional[str]:
+        """doc_id of a stored document with exactly this text (matches legacy sha256 checksums too)."""
+        doc_id = self.get_doc_id_by_hash(text_checksum(text))
+        if doc_id is None and _BLAKE3_AVAILABLE and any(
+                not d.get('checksum', 'blake3:').startswith('blake3:') for d in self._documents()):
+            doc_id = self.get_doc_id_by_hash(hashlib.sha256(text.encode('utf-8')).hexdigest())
+        return doc_id
+
+    def get_doc_id_by_hash(self, h: str) -> Optional[str]:
+        """doc_id of a stored document whose text checksum or upload raw_hash equals h."""
+        if not h:
+            return None
+        for d in self._documents():
+            if d.get('checksum') == h or d.get('raw_hash') == h:
+                return d.get('doc_id')
+        return None
+
+    def ingest_text(self, text: str, source: str, metadata: Optional[Dict[str, Any]] = None, doc_id: Optional[str] = None, replace: bool = False, raw_hash: Optional[str] = None) -> Dict[str, Any]:
         if not text.strip():
             return {"error": "empty text"}
         if not _lazy_import_embeddings():
@@ -164,18 +335,14 @@ class KnowledgeStore:
         model = get_embedding_model()
         if model is None:
             return {"error": "embedding model not loaded"}
-        # Prefer heading-aware when markdown indicators present
-        if '#' in text or '##' in text:
+        # Prefer heading-aware when markdown indicators present ('#' in is a memchr scan
+        # that stops at the first hit)
+        if '#' in text:
             chunks = _heading_semantic_chunks(text)
         else:
             # If existing documents have different embedding model and NEW model name differs, schedule background rebuild.
             try:
-                needs = False
-                for d in self._data.get('documents', []):
-                    if d.get('embedding_model') != CURRENT_EMBEDDING_MODEL_NAME:
-                        needs = True
-                        break
-                if needs:
+                if self._stale_docs > 0:
                     # Start rebuild non-blocking
                     threading.Thread(target=self.rebuild_embeddings, kwargs={'force': False}, daemon=True).start()
             except Exception:
@@ -184,9 +351,6 @@ class KnowledgeStore:
         if not chunks:
             return {"error": "no chunks produced"}
         # Sanitize each chunk and capture suspicious flags prior to embedding
-        from .security_utils import sanitize_text
-        from config import QUARANTINE_ENABLED
-        import json as _json
         sanitized_chunks = []
         suspicious_indexes = set()
         for idx, ch in enumerate(chunks):
@@ -194,16 +358,20 @@ class KnowledgeStore:
             if meta.get('suspicious'):
                 suspicious_indexes.add(idx)
             sanitized_chunks.append(sanitized)
-        embeds = model.encode(sanitized_chunks)
-        import uuid
+        embeds = generate_embeddings(sanitized_chunks)
+        if embeds[0] is None:
+            return {"error": "embedding failed"}
         if doc_id is None:
             doc_id = str(uuid.uuid4())
-        checksum = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        checksum = text_checksum(text)
         # If replace flag set, drop existing doc with same id
         if replace and doc_id:
             with self._lock:
                 prev_docs = self._data.get('documents', [])
                 self._data['documents'] = [d for d in prev_docs if d.get('doc_id') != doc_id]
+                self._stale_docs -= _count_stale(d for d in prev_docs if d.get('doc_id') == doc_id)
+                self._invalidate_index()
+                self._delete_rows([doc_id])
         doc = {
             'doc_id': doc_id,
             'source': source,
@@ -213,9 +381,11 @@ class KnowledgeStore:
             'checksum': checksum,
             'chunks': []
         }
+        if raw_hash:
+            # Hash of the uploaded bytes, so re-uploads dedupe before extraction
+            doc['raw_hash'] = raw_hash
         if suspicious_indexes and QUARANTINE_ENABLED:
-            # Write full original + sanitized doc to quarantine file instead of storing in main index
-            qpath = self.path + '.quarantine'
+            # Record the doc in the quarantine log instead of storing it in the main index
             record = {
                 'doc_id': doc_id,
                 'source': source,
@@ -225,24 +395,18 @@ class KnowledgeStore:
                 'chunk_count': len(sanitized_chunks)
             }
             try:
-                existing = []
-                if os.path.exists(qpath):
-                    with open(qpath, 'r', encoding='utf-8') as f:
-                        existing = _json.load(f)
-                existing.append(record)
-                with open(qpath + '.tmp', 'w', encoding='utf-8') as f:
-                    _json.dump(existing, f)
-                os.replace(qpath + '.tmp', qpath)
+                self._quarantine_append({'op': 'add', **record})
             except Exception:
                 pass
             return {"doc_id": doc_id, "quarantined": True, "chunks": len(sanitized_chunks), "checksum": checksum}
         else:
+            chunk_ids = _uuid4_batch(len(sanitized_chunks))
             for idx, (ch, emb) in enumerate(zip(sanitized_chunks, embeds)):
                 chunk_record = {
-                    'id': str(uuid.uuid4()),
+                    'id': chunk_ids[idx],
                     'index': idx,
                     'text': ch,
-                    'embedding': emb.tolist(),
+                    'embedding': emb,
                     'len': len(ch)
                 }
                 if idx in suspicious_indexes:
@@ -251,53 +415,141 @@ class KnowledgeStore:
             if suspicious_indexes:
                 doc['meta']['suspicious'] = True
             with self._lock:
-                self._data['documents'].append(doc)
-                self._persist()
+                self._data['documents'] = self._data['documents'] + [doc]
+                self._invalidate_index()
+                self._persist_docs([doc])
             return {"doc_id": doc_id, "chunks": len(doc['chunks']), "checksum": checksum, "replaced": replace}
 
+    # -------- Quarantine (append-only JSONL of add/remove ops) --------
+    def _quarantine_path(self) -> str:
+        return self.path + '.quarantine.jsonl'
+
+    def _migrate_legacy_quarantine(self):
+        """Convert the old whole-file JSON array (<store>.quarantine) to the JSONL log once."""
+        legacy = self.path + '.quarantine'
+        if not os.path.exists(legacy) or os.path.exists(self._quarantine_path()):
+            return
+        with open(legacy, 'rb') as f:
+            records = json_loads(f.read())
+        self._quarantine_rewrite(records)
+        os.remove(legacy)
+
+    def _quarantine_append(self, op: Dict[str, Any]):
+        with self._quarantine_lock:
+            self._migrate_legacy_quarantine()
+            self._quarantine_write_line(op)
+
+    def _quarantine_write_line(self, op: Dict[str, Any]):
+        """Append one op (caller holds _quarantine_lock)."""
+        fd = os.open(self._quarantine_path(), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, dumps_bytes(op) + b'\n')
+            if DURABLE_QUARANTINE:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _quarantine_rewrite(self, records: List[Dict[str, Any]]):
+        path = self._quarantine_path()
+        buf = b''.join(dumps_bytes({'op': 'add', **r}) + b'\n' for r in records)
+        fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, buf)
+            if DURABLE_QUARANTINE:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(path + '.tmp', path)
+
+    def _quarantine_fold(self) -> Tuple[Dict[str, Dict[str, Any]], int, int]:
+        """Replay the log: ({doc_id: record} in insertion order, total lines, remove lines)."""
+        live: Dict[str, Dict[str, Any]] = {}
+        lines = removes = 0
+        with open(self._quarantine_path(), 'rb') as f:
+            for ln in f:
+                try:
+                    op = json_loads(ln)
+                except Exception:
+                    continue
+                lines += 1
+                if op.pop('op', 'add') == 'remove':
+                    removes += 1
+                    live.pop(op.get('doc_id'), None)
+                else:
+                    live[op.get('doc_id')] = op
+        return live, lines, removes
+
+    def quarantine_records(self) -> Optional[List[Dict[str, Any]]]:
+        """Live quarantine records, or None when nothing was ever quarantined."""
+        with self._quarantine_lock:
+            self._migrate_legacy_quarantine()
+            if not os.path.exists(self._quarantine_path()):
+                return None
+            live, _, _ = self._quarantine_fold()
+        return list(live.values())
+
+    def quarantine_remove(self, doc_id: str) -> Optional[bool]:
+        """Drop doc_id from quarantine: True if removed, False if absent, None if no log.
+
+        Appends a remove op; the log is compacted once removes exceed
+        QUARANTINE_COMPACT_RATIO of its lines.
+        """
+        with self._quarantine_lock:
+            self._migrate_legacy_quarantine()
+            path = self._quarantine_path()
+            if not os.path.exists(path):
+                return None
+            live, lines, removes = self._quarantine_fold()
+            if doc_id not in live:
+                return False
+            del live[doc_id]
+            if (removes + 1) > QUARANTINE_COMPACT_RATIO * (lines + 1):
+                self._quarantine_rewrite(list(live.values()))
+            else:
+                self._quarantine_write_line({'op': 'remove', 'doc_id': doc_id, 'ts': time.time()})
+        return True
+
     def stats(self):
-        with self._lock:
-            docs = self._data.get('documents', [])
-            chunk_count = sum(len(d.get('chunks', [])) for d in docs)
-            return {
-                'documents': len(docs),
-                'chunks': chunk_count,
-                'path': self.path,
-                'embedding_enabled': _SENTENCE_TRANSFORMERS_AVAILABLE
-            }
+        docs = self._documents()
+        chunk_count = sum(len(d.get('chunks', [])) for d in docs)
+        return {
+            'documents': len(docs),
+            'chunks': chunk_count,
+            'path': self.path,
+            'embedding_enabled': _SENTENCE_TRANSFORMERS_AVAILABLE
+        }
+
+    def stats_full(self) -> Dict[str, Any]:
+        """stats() plus the distinct embedding models in use, in one pass over the docs."""
+        chunk_count = 0
+        models = set()
+        docs = self._documents()
+        for d in docs:
+            chunk_count += len(d.get('chunks', []))
+            if d.get('embedding_model'):
+                models.add(d['embedding_model'])
+        return {
+            'documents': len(docs),
+            'chunks': chunk_count,
+            'path': self.path,
+            'embedding_enabled': _SENTENCE_TRANSFORMERS_AVAILABLE,
+            'embedding_models': sorted(models)
+        }
 
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         if not query.strip():
             return []
         if not _lazy_import_embeddings():
             return []
-        model = get_embedding_model()
-        if model is None:
-            return []
-        try:
-            q = model.encode([query])[0]
-        except Exception:
-            return []
-        with self._lock:
-            docs = list(self._data.get('documents', []))
-        if not docs:
+        q = embed_query(query)
+        if q is None:
             return []
-        # Flatten chunks
-        all_chunks = []
-        for d in docs:
-            for c in d.get('chunks', []):
-                all_chunks.append((d, c))
+        all_chunks, mat = self._search_index()
         if not all_chunks:
             return []
-        import numpy as _np
-        mat = _np.array([c['embedding'] for _, c in all_chunks])
-        qv = _np.array(q)
-        mat_norm = mat / (_np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9)
-        qv_norm = qv / (_np.linalg.norm(qv) + 1e-9)
-        sims = mat_norm @ qv_norm
-        idxs = sims.argsort()[::-1][:top_k]
+        idxs, scores = search_top_k(q, mat, top_k)
         results: List[Dict[str, Any]] = []
-        for i in idxs:
+        for i, score in zip(idxs, scores):
             d, c = all_chunks[i]
             results.append({
                 'chunk_id': c['id'],
@@ -305,14 +557,50 @@ class KnowledgeStore:
                 'source': d['source'],
                 'index': c['index'],
                 'text': c['text'],
-                'score': float(sims[i])
+                'score': float(score)
             })
         return results
 
+    def _documents(self) -> List[Dict[str, Any]]:
+        """Current document list, read without locking.
+
+        Writers never mutate a published list: they build a new one and assign it
+        under self._lock, so a reader's reference stays a consistent snapshot.
+        """
+        return self._data.get('documents', [])
+
+    def _invalidate_index(self):
+        # Callers hold self._lock
+        self._index = None
+        self._version += 1
+
+    def _search_index(self):
+        """Return ([(doc, chunk), ...], normalized embedding matrix), built once per mutation.
+
+        Readers grab the published tuple without locking. A rebuild snapshots the chunks
+        under the store lock but builds the matrix outside it, so ingests and deletes are
+        not blocked behind quantization or an HNSW build.
+        """
+        index = self._index
+        if index is not None:
+            return index
+        with self._index_build_lock:
+            with self._lock:
+                if self._index is not None:
+                    return self._index
+                version = self._version
+                all_chunks = [(d, c) for d in self._data.get('documents', []) for c in d.get('chunks', []) if c.get('embedding') is not None]
+                vectors = [c['embedding'] for _, c in all_chunks]
+            mat = build_search_matrix(vectors, cache_prefix=self.path) if all_chunks else None
+            index = (all_chunks, mat)
+            with self._lock:
+                if self._version == version:
+                    self._index = index
+            return index
+
     # -------- Document Management --------
     def list_documents(self) -> List[Dict[str, Any]]:
-        with self._lock:
-            docs = list(self._data.get('documents', []))
+        docs = self._documents()
         out = []
         for d in docs:
             out.append({
@@ -325,6 +613,16 @@ class KnowledgeStore:
             })
         return out
 
+    def chunk_stats(self) -> Tuple[int, int, int]:
+        """(documents, chunks, suspicious chunks) counts."""
+        docs = self._documents()
+        chunks = suspicious = 0
+        for d in docs:
+            doc_chunks = d.get('chunks', [])
+            chunks += len(doc_chunks)
+            suspicious += sum(1 for c in doc_chunks if c.get('suspicious'))
+        return len(docs), chunks, suspicious
+
     def delete_documents(self, doc_ids: List[str]) -> int:
         if not doc_ids:
             return 0
@@ -335,14 +633,15 @@ class KnowledgeStore:
             removed = len(docs) - len(new_docs)
             if removed:
                 self._data['documents'] = new_docs
-                self._persist()
+                self._stale_docs -= _count_stale(d for d in docs if d.get('doc_id') in ids)
+                self._invalidate_index()
+                self._delete_rows(list(ids))
             return removed
 
     def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
-        with self._lock:
-            for d in self._data.get('documents', []):
-                if d.get('doc_id') == doc_id:
-                    return d
+        for d in self._documents():
+            if d.get('doc_id') == doc_id:
+                return d
         return None
 
     # -------- Rebuild Embeddings (Background) --------
@@ -388,38 +687,66 @@ class KnowledgeStore:
         th.start()
         return self.rebuild_status()
 
+    def _rebuild_slabs(self, targets: List[str]) -> List[List[Dict[str, Any]]]:
+        """Group target docs (whole documents) into slabs of about REBUILD_SLAB_TEXTS chunks each."""
+        with self._lock:
+            by_id = {d.get('doc_id'): d for d in self._data.get('documents', [])}
+        slabs: List[List[Dict[str, Any]]] = []
+        slab: List[Dict[str, Any]] = []
+        size = 0
+        for doc_id in targets:
+            doc = by_id.get(doc_id)
+            if not doc:
+                continue
+            slab.append(doc)
+            size += len(doc.get('chunks', []))
+            if size >= REBUILD_SLAB_TEXTS:
+                slabs.append(slab)
+                slab, size = [], 0
+        if slab:
+            slabs.append(slab)
+        return slabs
+
+    def _persist_rebuilt(self, slab: List[Dict[str, Any]]):
+        with self._lock:
+            live = {id(d) for d in self._data.get('documents', [])}
+            # skip docs deleted or replaced while they were being re-embedded
+            self._persist_docs([d for d in slab if id(d) in live])
+        self._rebuild_state['rebuilt_docs'] += len(slab)
+        self._rebuild_state['updated_at'] = time.time()
+
     def _rebuild_worker(self, targets: List[str]):
+        # Chunk texts of several documents share one batched encode; each slab is written on a
+        # single background writer so the next slab embeds while the previous one is stored
+        writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='kb-rebuild')
         try:
             model = get_embedding_model()
             if model is None:
                 raise RuntimeError('Embedding model unavailable')
-            for doc_id in targets:
-                with self._lock:
-                    doc = None
-                    for d in self._data.get('documents', []):
-                        if d.get('doc_id') == doc_id:
-                            doc = d
-                            break
-                if not doc:
-                    continue
-                # Re-embed chunk texts
-                texts = [c['text'] for c in doc.get('chunks', [])]
-                try:
-                    embs = model.encode(texts)
-                except Exception as e:
-                    self._rebuild_state['errors'].append(f"{doc_id[:8]}: {e}")
+            for slab in self._rebuild_slabs(targets):
+                texts = [c['text'] for d in slab for c in d.get('chunks', [])]
+                embs = generate_embeddings(texts)
+                if len(texts) and embs[0] is None:
+                    self._rebuild_state['errors'].extend(f"{d.get('doc_id', '')[:8]}: embedding failed" for d in slab)
                     continue
-                # Update embeddings
-                for c, emb in zip(doc.get('chunks', []), embs):
-                    c['embedding'] = emb.tolist()
-                doc['embedding_model'] = CURRENT_EMBEDDING_MODEL_NAME
+                # Scatter embeddings back to their documents
+                pos = 0
                 with self._lock:
-                    self._persist()
-                self._rebuild_state['rebuilt_docs'] += 1
-                self._rebuild_state['updated_at'] = time.time()
+                    live = {id(d) for d in self._documents()}
+                    for d in slab:
+                        chunks = d.get('chunks', [])
+                        for c, emb in zip(chunks, embs[pos:pos + len(chunks)]):
+                            c['embedding'] = emb
+                        pos += len(chunks)
+                        if id(d) in live:  # a deleted doc was already uncounted
+                            self._stale_docs -= _count_stale([d])
+                        d['embedding_model'] = CURRENT_EMBEDDING_MODEL_NAME
+                    self._invalidate_index()
+                writer.submit(self._persist_rebuilt, slab)
         except Exception as e:
             self._rebuild_state['errors'].append(str(e))
         finally:
+            writer.shutdown(wait=True)
             self._rebuild_state['running'] = False
             self._rebuild_state['updated_at'] = time.time()
 
@@ -1,68 +1,345 @@
 import requests
-import os
+from requests.adapters import HTTPAdapter
 import time
-from config import MAX_OUTPUT_TOKENS, AUTO_CONTINUE, CONTINUE_ROUNDS, GEN_TEMPERATURE, TOP_P
+import base64
+import urllib.parse
+import hashlib
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (MAX_OUTPUT_TOKENS, AUTO_CONTINUE, CONTINUE_ROUNDS, GEN_TEMPERATURE, TOP_P,
+                    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL, EXACT_CACHE_SIZE)
+from utils.embeddings import embed_query
+from utils.json_utils import loads as json_loads, dumps_bytes
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+# Keep-alive connections to the LLM server per process; sized above gunicorn's threads per worker
+_POOL_SIZE = 32
+# Tool definitions sent with every completion request (built once)
+_TOOLS = (
+    {
+        "type": "function",
+        "function": {
+            "name": "search_web",
+            "description": "Search Wikipedia and fetch the introduction of the most relevant article.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "Search query for Wikipedia"}
+                },
+                "required": ["query"]
+            }
+        }
+    },
+)
+_TOOL_NAMES = [t["function"]["name"] for t in _TOOLS]
+_WIKI_API = "https://en.wikipedia.org/w/api.php"
+_WIKI_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; CopilotBot/1.0)"}
+# Keep-alive connection to Wikipedia shared by all tool calls
+_WIKI_SESSION = requests.Session()
+# Seconds a /v1/models listing is reused by get_current_model/get_model_info
+_MODEL_TTL = 30.0
+
+
+def _b64_text(data) -> str:
+    """Base64 text for image data. str input is assumed to be base64 already."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return base64.b64encode(data).decode('ascii')
+    return data or ''
+
+
+def _b64_len(data) -> int:
+    """Length of the base64 text for data without encoding it."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return 4 * ((len(data) + 2) // 3)
+    return len(data) if data else 0
+
+
+def _image_text_fallback(prompt, file_content) -> list:
+    """Messages for servers that reject multimodal parts: the prompt plus truncated image base64."""
+    truncated_limit = 8192  # chars of base64 to include
+    total_len = _b64_len(file_content)
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        # Only encode the bytes that fit in the limit (3 raw bytes per 4 chars)
+        truncated = _b64_text(file_content[:truncated_limit // 4 * 3])
+    else:
+        truncated = file_content[:truncated_limit]
+    omitted = total_len - truncated_limit if total_len > truncated_limit else 0
+    note = f"(base64 truncated, {omitted} chars omitted)" if omitted > 0 else ""
+    augmented = f"{prompt}\n\n---\nAttached image base64:\n{truncated}{'...' if omitted>0 else ''}\n{note}\n---"
+    return [{"role": "user", "content": augmented}]
+
+def _approx_count(text: str) -> int:
+    # Simple heuristic: whitespace split * 1.3 typical char/token ratio fudge (optional)
+    # We'll just use whitespace count as baseline to avoid overestimation.
+    if not text:
+        return 0
+    return max(1, len(text.strip().split()))
+
+
+def _message_texts(messages):
+    """Yield the text of each user/system message (text parts only for multimodal)."""
+    for m in (messages or []):
+        c = m.get('content')
+        if isinstance(c, str):
+            yield c
+        elif isinstance(c, list):
+            # multimodal: count text parts only
+            for part in c:
+                if isinstance(part, dict) and part.get('type') == 'text':
+                    yield part.get('text', '')
+
+
+def _approx_prompt_tokens(messages, prompt) -> int:
+    """Approximate prompt tokens from user/system messages."""
+    # Parts are counted one by one (same total as counting them newline-joined)
+    # so the whole conversation is never copied into one string
+    words = parts = 0
+    nonempty = False
+    for text in _message_texts(messages):
+        words += len(text.split())
+        parts += 1
+        nonempty = nonempty or bool(text)
+    if prompt:
+        words += len(prompt.split())
+        parts += 1
+        nonempty = True
+    # The joined text is empty only for a single empty part
+    return max(1, words) if parts > 1 or nonempty else 0
+
+def _response_json(response):
+    """Parse a response body with json_utils (orjson when installed).
+
+    Bodies it rejects (e.g. a non-UTF-8 charset) go through response.json(), which
+    also keeps its RequestException-derived error for truly invalid JSON.
+    """
+    try:
+        return json_loads(response.content)
+    except ValueError:
+        return response.json()
+
+def _cacheable(result) -> bool:
+    # Tool calls must run again, and errors or cut-off answers are not worth replaying
+    return not result.get('tool_calls') and result.get('finish_reason') in ('stop', None) and result.get('raw') is not None
+
+
+def _as_cache_hit(result):
+    return {**result, "metrics": {**result["metrics"], "duration": 0.0, "ttft": 0.0, "cache_hit": True}}
+
+
+class SemanticCache:
+    """LRU of finished answers looked up by the embedding of the final user message.
+
+    An entry only matches under byte-identical preceding messages (system prompt with
+    its retrieved context, earlier turns), so a hit never crosses conversations or
+    contexts; only the wording of the last question may differ.
+    """
+
+    def __init__(self, threshold: float, maxsize: int, ttl: int):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # context key -> OrderedDict[user text, (unit embedding, result, stored at)]
+        self._entries: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        self._count = 0
+
+    @staticmethod
+    def key(messages):
+        """(context digest, final user text, its embedding), or None when the call is not cacheable."""
+        if not messages or messages[-1].get('role') != 'user' or not isinstance(messages[-1].get('content'), str):
+            return None
+        vec = embed_query(messages[-1]['content'])
+        if vec is None:
+            return None
+        return hashlib.sha256(dumps_bytes(messages[:-1])).hexdigest(), messages[-1]['content'], vec
+
+    def get(self, context, text, vec):
+        now = time.time()
+        with self._lock:
+            bucket = self._entries.get(context)
+            if not bucket:
+                return None
+            expired = [t for t, (_, _, ts) in bucket.items() if now - ts > self.ttl]
+            for t in expired:
+                del bucket[t]
+            self._count -= len(expired)
+            if not bucket:
+                del self._entries[context]
+                return None
+            texts = list(bucket)
+            sims = np.stack([bucket[t][0] for t in texts]) @ vec
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            bucket.move_to_end(texts[best])
+            self._entries.move_to_end(context)
+            result = bucket[texts[best]][1]
+        return _as_cache_hit(result)
+
+    def put(self, context, text, vec, result):
+        if not _cacheable(result):
+            return
+        with self._lock:
+            bucket = self._entries.setdefault(context, OrderedDict())
+            if text not in bucket:
+                self._count += 1
+            bucket[text] = (vec, result, time.time())
+            bucket.move_to_end(text)
+            self._entries.move_to_end(context)
+            while self._count > self.maxsize:
+                oldest = next(iter(self._entries.values()))
+                oldest.popitem(last=False)
+                self._count -= 1
+                if not oldest:
+                    self._entries.popitem(last=False)
+
+
+_SEMANTIC_CACHE = (SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL)
+                   if SEMANTIC_CACHE_THRESHOLD > 0 else None)
+
+
+@lru_cache(maxsize=512)
+def _wiki_lookup(query: str) -> str:
+    """Intro of the best Wikipedia match for query, formatted for the model.
+
+    One API call: generator=search picks the top result and prop=extracts returns
+    its introduction. Failures raise (and so are not cached).
+    """
+    params = {
+        "action": "query",
+        "format": "json",
+        "generator": "search",
+        "gsrsearch": query,
+        "gsrlimit": 1,
+        "prop": "extracts",
+        "exintro": "true",
+        "explaintext": "true",
+        "redirects": 1,
+    }
+    response = _WIKI_SESSION.get(_WIKI_API, params=params, headers=_WIKI_HEADERS, timeout=15)
+    response.raise_for_status()
+    pages = (json_loads(response.content).get("query") or {}).get("pages") or {}
+    page = next(iter(pages.values()), None)
+    if not page or "missing" in page:
+        return f"No Wikipedia article found for '{query}'"
+    content = (page.get("extract") or "").strip()
+    title = page["title"]
+    # Add Wikipedia source link (plain text and markdown clickable)
+    wiki_url = f"https://en.wikipedia.org/wiki/{urllib.parse.quote(title.replace(' ', '_'))}"
+    return f"Wikipedia article: {title}\n---\n{content}\n\nSource: [{wiki_url}]({wiki_url})"
 
-# Clean up duplicate imports and unused modules.
 
 class LLMClient:
     def __init__(self, server_url):
         self.api_url = server_url.rstrip('/') + '/v1/chat/completions'
         self.server_base = server_url.rstrip('/')
+        # Temperature-0 answers by request digest (see _exact_key), oldest first
+        self._exact_cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._exact_lock = threading.Lock()
+        # (models url, /v1/models entries, fetched at); failed fetches are not cached
+        self._model_cache = None
+        self._model_lock = threading.Lock()
+        # Pooled session: completions reuse TCP (and TLS) connections instead of one handshake per call
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=_POOL_SIZE)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
 
-    def get_tools(self):
-        # Only support Wikipedia web search tool
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_web",
-                    "description": "Search Wikipedia and fetch the introduction of the most relevant article.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {"type": "string", "description": "Search query for Wikipedia"}
-                        },
-                        "required": ["query"]
-                    }
-                }
+    def build_user_message(self, prompt, file_content=None, file_type=None):
+        """Build the user turn for prompt plus an optional attachment.
+
+        Images may be passed as raw bytes; they are base64-encoded here, once,
+        as the data URL is built, so callers never hold a second encoded copy.
+        """
+        if file_content and file_type and file_type.startswith('image'):
+            data_url = f"data:{file_type};base64,{_b64_text(file_content)}"
+            return {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": data_url}}
+                ]
             }
-        ]
+        if file_content and file_type and file_type.startswith('text'):
+            augmented = f"{prompt}\n\n---\nAttached file content:\n{file_content}\n---"
+        else:
+            augmented = prompt
+        return {"role": "user", "content": augmented}
+
+    def get_tools(self):
+        # Only support Wikipedia web search tool; shared constant, do not mutate
+        return _TOOLS
 
     def send_prompt(self, prompt, file_content=None, file_type=None, messages=None, system_content=None,
-                    auto_continue=None, continue_rounds=None,
-                    _continuation_round=0, _accumulated=None,
-                    _start_time=None, _first_token_time=None,
-                    _usage_acc=None):
-        """Send a prompt to the local LLM with optional auto continuation overrides."""
-        attempted_multimodal = False
+                    auto_continue=None, continue_rounds=None):
+        """Send a prompt to the local LLM with optional auto continuation overrides.
+
+        At temperature 0, text-only calls are first looked up in the exact-match cache,
+        then in the semantic cache (when LPS2_SEMANTIC_CACHE is set); hits carry
+        metrics['cache_hit'] = True.
+        """
+        exact_key = cache_key = None
+        if not file_content and GEN_TEMPERATURE == 0 and (EXACT_CACHE_SIZE > 0 or _SEMANTIC_CACHE is not None):
+            if messages is None:
+                messages = ([{"role": "system", "content": system_content}] if system_content else []) + \
+                    [self.build_user_message(prompt)]
+            if EXACT_CACHE_SIZE > 0:
+                exact_key = self._exact_key(messages, auto_continue, continue_rounds)
+                with self._exact_lock:
+                    hit = self._exact_cache.get(exact_key)
+                    if hit is not None:
+                        self._exact_cache.move_to_end(exact_key)
+                if hit is not None:
+                    return _as_cache_hit(hit)
+            if _SEMANTIC_CACHE is not None:
+                cache_key = _SEMANTIC_CACHE.key(messages)
+                if cache_key is not None:
+                    hit = _SEMANTIC_CACHE.get(*cache_key)
+                    if hit is not None:
+                        return hit
+        result = self._send_prompt(prompt, file_content=file_content, file_type=file_type, messages=messages,
+                                   system_content=system_content, auto_continue=auto_continue,
+                                   continue_rounds=continue_rounds)
+        if exact_key is not None and _cacheable(result):
+            with self._exact_lock:
+                self._exact_cache[exact_key] = result
+                while len(self._exact_cache) > EXACT_CACHE_SIZE:
+                    self._exact_cache.popitem(last=False)
+        if cache_key is not None:
+            _SEMANTIC_CACHE.put(*cache_key, result)
+        return result
+
+    def _exact_key(self, messages, auto_continue, continue_rounds) -> str:
+        """Digest of everything that determines a temperature-0 completion."""
+        return hashlib.sha256(dumps_bytes({
+            "url": self.api_url,
+            "messages": messages,
+            "tools": _TOOL_NAMES,
+            "max_tokens": MAX_OUTPUT_TOKENS,
+            "top_p": TOP_P,
+            "auto_continue": AUTO_CONTINUE if auto_continue is None else auto_continue,
+            "continue_rounds": CONTINUE_ROUNDS if continue_rounds is None else continue_rounds,
+        })).hexdigest()
+
+    def _send_prompt(self, prompt, file_content=None, file_type=None, messages=None, system_content=None,
+                     auto_continue=None, continue_rounds=None,
+                     _continuation_round=0, _accumulated=None,
+                     _start_time=None, _first_token_time=None,
+                     _usage_acc=None):
+        # First try OpenAI-style multimodal parts for images (also when the caller built the
+        # messages); continuation rounds already carry whichever form was accepted
+        attempted_multimodal = _continuation_round == 0 and bool(file_content and file_type and file_type.startswith('image'))
         if _start_time is None:
             _start_time = time.time()
         if messages is None:
-            if file_content and file_type and file_type.startswith('image'):
-                # First try OpenAI-style multimodal parts
-                attempted_multimodal = True
-                data_url = f"data:{file_type};base64,{file_content}"
-                user_msg = {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": data_url}}
-                    ]
-                }
-                messages = []
-                if system_content:
-                    messages.append({"role": "system", "content": system_content})
-                messages.append(user_msg)
-            else:
-                if file_content and file_type and file_type.startswith('text'):
-                    augmented = f"{prompt}\n\n---\nAttached file content:\n{file_content}\n---"
-                else:
-                    augmented = prompt
-                messages = []
-                if system_content:
-                    messages.append({"role": "system", "content": system_content})
-                messages.append({"role": "user", "content": augmented})
+            messages = []
+            if system_content:
+                messages.append({"role": "system", "content": system_content})
+            messages.append(self.build_user_message(prompt, file_content, file_type))
         payload = {
             "model": "gpt-3.5-turbo",  # Adjust / override if LM Studio exposes a different id
             "messages": messages,
@@ -77,23 +354,17 @@ class LLMClient:
         data = None
         request_start = time.time()
         try:
-            import copy
-            send_payload = copy.deepcopy(payload)
-            response = requests.post(self.api_url, json=send_payload)
+            # Serialized straight to bytes (no defensive deepcopy); orjson encodes a
+            # multi-MB image data URL in C rather than via the stdlib encoder
+            response = self._session.post(self.api_url, data=dumps_bytes(payload), headers=_JSON_HEADERS)
             if response.status_code == 400 and attempted_multimodal:
                 # Fallback: embed truncated base64 inside text to satisfy legacy server
-                truncated_limit = 8192  # chars of base64 to include
-                total_len = len(file_content) if file_content else 0
-                truncated = file_content[:truncated_limit]
-                omitted = total_len - truncated_limit if total_len > truncated_limit else 0
-                note = f"(base64 truncated, {omitted} chars omitted)" if omitted > 0 else ""
-                augmented = f"{prompt}\n\n---\nAttached image base64:\n{truncated}{'...' if omitted>0 else ''}\n{note}\n---"
-                messages = [{"role": "user", "content": augmented}]
+                messages = _image_text_fallback(prompt, file_content)
                 payload["messages"] = messages
                 fallback_used = True
-                response = requests.post(self.api_url, json=payload)
+                response = self._session.post(self.api_url, data=dumps_bytes(payload), headers=_JSON_HEADERS)
             response.raise_for_status()
-            data = response.json()
+            data = _response_json(response)
         except requests.exceptions.RequestException as e:
             now = time.time()
             duration = now - _start_time
@@ -129,13 +400,6 @@ class LLMClient:
             _first_token_time = time.time()
 
         # --- Token accounting ---
-        def approx_count(text: str) -> int:
-            # Simple heuristic: whitespace split * 1.3 typical char/token ratio fudge (optional)
-            # We'll just use whitespace count as baseline to avoid overestimation.
-            if not text:
-                return 0
-            return max(1, len(text.strip().split()))
-
         if _usage_acc is None:
             _usage_acc = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "approx": False}
         if usage:
@@ -150,23 +414,10 @@ class LLMClient:
             _usage_acc['total_tokens'] = _usage_acc['prompt_tokens'] + _usage_acc['completion_tokens']
         else:
             # Approximate tokens for this segment only (output)
-            seg_tokens = approx_count(segment)
+            seg_tokens = _approx_count(segment)
             _usage_acc['completion_tokens'] += seg_tokens
             if _continuation_round == 0 and _usage_acc['prompt_tokens'] == 0:
-                # Approximate prompt tokens from user/system messages
-                joined = []
-                for m in (messages or []):
-                    c = m.get('content')
-                    if isinstance(c, str):
-                        joined.append(c)
-                    elif isinstance(c, list):
-                        # multimodal: count text parts only
-                        for part in c:
-                            if isinstance(part, dict) and part.get('type') == 'text':
-                                joined.append(part.get('text',''))
-                if prompt:
-                    joined.append(prompt)
-                _usage_acc['prompt_tokens'] = approx_count("\n".join(joined))
+                _usage_acc['prompt_tokens'] = _approx_prompt_tokens(messages, prompt)
             _usage_acc['total_tokens'] = _usage_acc['prompt_tokens'] + _usage_acc['completion_tokens']
             _usage_acc['approx'] = True
 
@@ -184,10 +435,10 @@ class LLMClient:
                 # merge content if assistant already last
                 cont_messages[-1]['content'] = (cont_messages[-1].get('content','') or '') + segment
             cont_messages.append({"role": "user", "content": "Continue."})
-            return self.send_prompt(prompt, file_content=file_content, file_type=file_type, messages=cont_messages,
-                                     system_content=system_content, auto_continue=effective_auto, continue_rounds=effective_rounds,
-                                     _continuation_round=_continuation_round+1, _accumulated=accumulated,
-                                     _start_time=_start_time, _first_token_time=_first_token_time, _usage_acc=_usage_acc)
+            return self._send_prompt(prompt, file_content=file_content, file_type=file_type, messages=cont_messages,
+                                      system_content=system_content, auto_continue=effective_auto, continue_rounds=effective_rounds,
+                                      _continuation_round=_continuation_round+1, _accumulated=accumulated,
+                                      _start_time=_start_time, _first_token_time=_first_token_time, _usage_acc=_usage_acc)
         completed_time = time.time()
         duration = completed_time - _start_time
         ttft = (_first_token_time - _start_time) if _first_token_time else duration
@@ -212,76 +463,217 @@ class LLMClient:
             "metrics": metrics
         }
 
+    def send_prompt_stream(self, prompt, messages, auto_continue=None, continue_rounds=None,
+                           file_content=None, file_type=None):
+        """Stream a completion as it is generated, with the same tools, auto
+        continuation and image fallback as send_prompt.
+
+        Yields ``{'delta': str}`` for each content fragment and ``{'tool_result':
+        {'name', 'result'}}`` after each executed tool call, then a final
+        ``{'done': True, 'response', 'tool_results', 'finish_reason',
+        'continuation_rounds', 'multimodal_fallback', 'metrics'}`` event (with
+        ``'error'`` set when the upstream request fails). As in send_prompt, one
+        round of tool calls is executed and only the reply that follows is the
+        response; if text was already streamed before the tool calls, a
+        ``{'reset': True}`` event tells the client to discard it first. Pass the
+        attachment as file_content/file_type so a server that rejects the image
+        parts with a 400 is retried with the truncated-base64 text prompt.
+        """
+        start = time.time()
+        effective_auto = AUTO_CONTINUE if auto_continue is None else auto_continue
+        effective_rounds = CONTINUE_ROUNDS if continue_rounds is None else continue_rounds
+        state = {'first_token_time': None}
+        segments = []
+        tool_results = []
+        usage_acc = {"prompt_tokens": 0, "completion_tokens": 0, "approx": False}
+        round_messages = messages
+        fallback = None
+        if file_content and file_type and file_type.startswith('image'):
+            fallback = _image_text_fallback(prompt, file_content)
+        fallback_used = False
+        tools_done = False
+        continuation_round = 0
+        finish_reason = None
+        error = None
+        while True:
+            parts = []
+            finish_reason, usage, tool_calls, error, rejected = yield from self._stream_round(
+                round_messages, parts, state, separate=bool(segments), allow_reject=fallback is not None)
+            if rejected:
+                # Same as send_prompt: the text-only prompt replaces the whole conversation
+                round_messages, fallback, fallback_used = fallback, None, True
+                continue
+            fallback = None  # only the first request may fall back
+            segment = ''.join(parts)
+            segments.append(segment)
+            # Prompt tokens are counted once; continuations and tool rounds add output only
+            if usage:
+                if not usage_acc['prompt_tokens']:
+                    usage_acc['prompt_tokens'] = usage.get('prompt_tokens') or 0
+                usage_acc['completion_tokens'] += usage.get('completion_tokens') or 0
+            else:
+                if not usage_acc['prompt_tokens']:
+                    usage_acc['prompt_tokens'] = _approx_prompt_tokens(round_messages, prompt)
+                usage_acc['completion_tokens'] += _approx_count(segment)
+                usage_acc['approx'] = True
+            if error:
+                break
+            if tool_calls and not tools_done:
+                tools_done = True
+                round_messages = list(round_messages)
+                for call in tool_calls:
+                    result = self.execute_tool(call)
+                    tool_results.append({"name": call["function"]["name"], "result": result})
+                    yield {'tool_result': tool_results[-1]}
+                    round_messages.append({"role": "assistant", "tool_calls": [call]})
+                    round_messages.append({"role": "tool", "content": result, "tool_call_id": call["id"]})
+                # send_prompt's tool round-trip returns only the follow-up reply
+                if ''.join(segments):
+                    yield {'reset': True}
+                segments = []
+                continue
+            if finish_reason == 'length' and effective_auto and continuation_round < effective_rounds:
+                continuation_round += 1
+                round_messages = list(round_messages) + [{"role": "assistant", "content": segment},
+                                                         {"role": "user", "content": "Continue."}]
+                continue
+            break
+        completed = time.time()
+        accumulated = ''.join(segments)
+        first_token_time = state['first_token_time']
+        final = {
+            'done': True,
+            'response': accumulated if not error or accumulated else error,
+            'tool_results': tool_results,
+            'finish_reason': finish_reason,
+            'continuation_rounds': continuation_round,
+            'multimodal_fallback': fallback_used,
+            'metrics': {
+                "started": start,
+                "completed": completed,
+                "duration": completed - start,
+                "ttft": (first_token_time - start) if first_token_time else completed - start,
+                "token_total": usage_acc['prompt_tokens'] + usage_acc['completion_tokens'],
+                "token_input": usage_acc['prompt_tokens'],
+                "token_output": usage_acc['completion_tokens'],
+                "approx": usage_acc['approx']
+            }
+        }
+        if error:
+            final['error'] = error
+        yield final
+
+    def _stream_round(self, messages, parts, state, separate=False, allow_reject=False):
+        """Stream one completion request, yielding delta events and appending text to parts.
+
+        Returns (finish_reason, usage, tool_calls, error, rejected). With separate, a
+        newline is emitted before the text unless it already starts with one (send_prompt
+        joins continuation segments the same way). With allow_reject, a 400 response
+        returns rejected=True before anything is yielded, so the caller can fall back.
+        """
+        payload = {
+            "model": "gpt-3.5-turbo",
+            "messages": messages,
+            "tools": self.get_tools(),
+            "stream": True,
+            "max_tokens": MAX_OUTPUT_TOKENS,
+            "max_new_tokens": MAX_OUTPUT_TOKENS,
+            "temperature": GEN_TEMPERATURE,
+            "top_p": TOP_P
+        }
+        finish_reason = None
+        usage = None
+        calls = {}  # tool call index -> call assembled from its streamed fragments
+        try:
+            with self._session.post(self.api_url, data=dumps_bytes(payload), headers=_JSON_HEADERS, stream=True) as response:
+                if response.status_code == 400 and allow_reject:
+                    return None, None, None, None, True
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    # Server-sent events: only "data: {...}" lines carry chunks
+                    if not line or not line.startswith(b'data:'):
+                        continue
+                    chunk = line[5:].strip()
+                    if chunk == b'[DONE]':
+                        break
+                    try:
+                        event = json_loads(chunk)
+                    except Exception:
+                        continue
+                    if event.get('usage'):
+                        usage = event['usage']
+                    choices = event.get('choices') or []
+                    if not choices:
+                        continue
+                    choice0 = choices[0]
+                    finish_reason = choice0.get('finish_reason') or finish_reason
+                    delta = choice0.get('delta') or {}
+                    for frag in delta.get('tool_calls') or ():
+                        call = calls.setdefault(frag.get('index', 0), {
+                            "id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                        if frag.get('id'):
+                            call['id'] = frag['id']
+                        fn = frag.get('function') or {}
+                        call['function']['name'] += fn.get('name') or ''
+                        call['function']['arguments'] += fn.get('arguments') or ''
+                    text = delta.get('content')
+                    if text:
+                        if state['first_token_time'] is None:
+                            state['first_token_time'] = time.time()
+                        if separate and not parts and not text.startswith('\n'):
+                            parts.append('\n')
+                            yield {'delta': '\n'}
+                        parts.append(text)
+                        yield {'delta': text}
+        except requests.exceptions.RequestException as e:
+            return finish_reason, usage, None, f"Request error: {e}", False
+        tool_calls = [calls[i] for i in sorted(calls)] or None
+        return finish_reason, usage, tool_calls, None, False
+
     def execute_tool(self, tool_call):
-        import datetime, math, os
         name = tool_call["function"]["name"]
         args = tool_call["function"].get("arguments")
-        import json
         try:
-            args = json.loads(args) if args else {}
+            args = json_loads(args) if args else {}
         except Exception:
             args = {}
         if name == "search_web":
             # Wikipedia search
-            import urllib.parse, urllib.request, json
             query = args.get("query", "")
             try:
-                # Search for most relevant article
-                search_url = "https://en.wikipedia.org/w/api.php"
-                search_params = {
-                    "action": "query",
-                    "format": "json",
-                    "list": "search",
-                    "srsearch": query,
-                    "srlimit": 1,
-                }
-                url = f"{search_url}?{urllib.parse.urlencode(search_params)}"
-                req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (compatible; CopilotBot/1.0)"})
-                with urllib.request.urlopen(req) as response:
-                    search_data = json.loads(response.read().decode())
-                if not search_data["query"]["search"]:
-                    return f"No Wikipedia article found for '{query}'"
-                normalized_title = search_data["query"]["search"][0]["title"]
-                # Fetch the actual content
-                content_params = {
-                    "action": "query",
-                    "format": "json",
-                    "titles": normalized_title,
-                    "prop": "extracts",
-                    "exintro": "true",
-                    "explaintext": "true",
-                    "redirects": 1,
-                }
-                url = f"{search_url}?{urllib.parse.urlencode(content_params)}"
-                req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (compatible; CopilotBot/1.0)"})
-                with urllib.request.urlopen(req) as response:
-                    data = json.loads(response.read().decode())
-                pages = data["query"]["pages"]
-                page_id = list(pages.keys())[0]
-                if page_id == "-1":
-                    return f"No Wikipedia article found for '{query}'"
-                content = pages[page_id]["extract"].strip()
-                title = pages[page_id]["title"]
-                # Add Wikipedia source link (plain text and markdown clickable)
-                wiki_url = f"https://en.wikipedia.org/wiki/{urllib.parse.quote(title.replace(' ', '_'))}"
-                return f"Wikipedia article: {title}\n---\n{content}\n\nSource: [{wiki_url}]({wiki_url})"
+                return _wiki_lookup(query)
             except Exception as e:
                 return f"Error fetching Wikipedia content: {str(e)}"
         else:
             return "Tool not implemented."
 
+    def _list_models(self):
+        """Entries of /v1/models (possibly empty), cached for _MODEL_TTL; None when the fetch fails."""
+        url = self.server_base.rstrip('/') + '/v1/models'
+        now = time.time()
+        with self._model_lock:
+            cached = self._model_cache
+        if cached is not None and cached[0] == url and now - cached[2] < _MODEL_TTL:
+            return cached[1]
+        try:
+            resp = self._session.get(url, timeout=5)
+            if resp.status_code != 200:
+                models = None
+            else:
+                models = _response_json(resp).get('data') or []
+        except Exception:
+            models = None
+        with self._model_lock:
+            self._model_cache = (url, models, now) if models is not None else None
+        return models
+
     def get_current_model(self):
         """Attempt to fetch current model id from LM Studio server via /v1/models.
 
         Returns the first model id if available, else None.
         """
         try:
-            url = self.server_base.rstrip('/') + '/v1/models'
-            resp = requests.get(url, timeout=5)
-            if resp.status_code != 200:
-                return None
-            data = resp.json()
-            models = data.get('data') or []
+            models = self._list_models()
             if not models:
                 return None
             # Prefer a single model; if multiple, take the first
@@ -296,12 +688,7 @@ class LLMClient:
         Keys: model, created, object, raw_fields (original dict minus noisy large fields if any).
         """
         try:
-            url = self.server_base.rstrip('/') + '/v1/models'
-            resp = requests.get(url, timeout=5)
-            if resp.status_code != 200:
-                return {}
-            data = resp.json()
-            models = data.get('data') or []
+            models = self._list_models()
             if not models:
                 return {}
             first = models[0] if isinstance(models[0], dict) else {}
@@ -1,18 +1,29 @@
 import os
-import json
+import heapq
 import threading
+import time
+import uuid
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
 from utils.embeddings import (
     generate_embedding,
     generate_embeddings,
-    batch_cosine_similarity,
+    embed_query,
     cosine_similarity,
     get_embedding_model,
+    build_search_matrix,
+    builds_dense_matrix,
+    normalize_rows,
+    search_top_k,
     _lazy_import_embeddings,
     _SENTENCE_TRANSFORMERS_AVAILABLE
 )
+from utils.json_utils import dumps_bytes, loads as json_loads
+
+# The change log is folded into the snapshot once it outgrows twice the snapshot size
+# (and this floor, so small stores are not rewritten every few inserts)
+_COMPACT_MIN_BYTES = 1 << 20
 
 
 class MemoryStore:
@@ -24,6 +35,15 @@ class MemoryStore:
             {"id": "..", "text": "..", "metadata": {...}, "embedding": [..floats..]}
         ]
     }
+
+    Snapshots written by this version keep the embeddings out of the JSON: they are
+    stored as one float32 matrix in a sidecar (`"embeddings_file":
+    "memory_store-<token>.npy"`, row i belongs to memories[i]) that is memory-mapped
+    on load. Files that still inline "embedding" lists load as before.
+
+    Changes since that snapshot are appended to a JSON-lines log next to it
+    (memory_store.log): one full record per add/update, {"id": .., "tombstone": true}
+    per delete. Loading replays the log over the snapshot.
     """
 
     def __init__(self, path=None):
@@ -31,59 +51,159 @@ class MemoryStore:
         if path is None:
             path = os.path.join(os.path.dirname(__file__), 'memory_store.json')
         self.path = path
+        self.log_path = os.path.splitext(path)[0] + '.log'
+        self._snapshot_bytes = 0
+        self._log_bytes = 0
         self._lock = threading.Lock()
         self._data: Dict[str, Any] = {"memories": []}
+        # (memories snapshot, search matrix, see build_search_matrix); rebuilt lazily after any mutation
+        self._index: Optional[Tuple[List[Dict[str, Any]], Any]] = None
         self._load()
 
     # ---------------- Persistence ----------------
     def _load(self):
         try:
             if os.path.exists(self.path):
-                with open(self.path, 'r', encoding='utf-8') as f:
-                    self._data = json.load(f)
-                    if 'memories' not in self._data:
-                        self._data = {"memories": []}
+                with open(self.path, 'rb') as f:
+                    self._data = json_loads(f.read())
+                if 'memories' not in self._data:
+                    self._data = {"memories": []}
+                self._snapshot_bytes = os.path.getsize(self.path)
+                self._attach_embeddings()
         except Exception:
             # Corrupt file fallback
             self._data = {"memories": []}
+        self._replay_log()
+
+    def _attach_embeddings(self):
+        name = self._data.pop('embeddings_file', None)
+        if not name:
+            return
+        memories = self._data['memories']
+        try:
+            path = os.path.join(os.path.dirname(self.path), name)
+            mat = np.load(path, mmap_mode='r')
+            self._snapshot_bytes += os.path.getsize(path)
+        except Exception:
+            mat = None
+        if mat is None or mat.ndim != 2 or mat.shape[0] != len(memories):
+            # Sidecar missing or out of step: keep only records that carry their own vectors
+            self._data['memories'] = [m for m in memories if m.get('embedding') is not None]
+            return
+        for m, row in zip(memories, mat):
+            m['embedding'] = row  # read-only view into the mapped file
+
+    def _replay_log(self):
+        try:
+            with open(self.log_path, 'rb+') as f:
+                raw = f.read()
+                if raw and not raw.endswith(b'\n'):
+                    # Drop a torn last line so the next append starts on a fresh line
+                    raw = raw[:raw.rfind(b'\n') + 1]
+                    f.truncate(len(raw))
+        except OSError:
+            return
+        self._log_bytes = len(raw)
+        lines = raw.splitlines()
+        if not lines:
+            return
+        by_id = {m.get('id'): m for m in self._data['memories']}
+        for ln in lines:
+            try:
+                rec = json_loads(ln)
+            except Exception:
+                continue
+            if rec.get('tombstone'):
+                by_id.pop(rec.get('id'), None)
+            else:
+                by_id[rec.get('id')] = rec  # updates keep the record's original position
+        self._data['memories'] = list(by_id.values())
+
+    def _append_log(self, records: List[Dict[str, Any]]):
+        # Callers hold self._lock
+        try:
+            chunk = b''.join(dumps_bytes(r) + b'\n' for r in records)
+            with open(self.log_path, 'ab') as f:
+                f.write(chunk)
+            self._log_bytes += len(chunk)
+            if self._log_bytes > max(_COMPACT_MIN_BYTES, 2 * self._snapshot_bytes):
+                self._persist()
+        except Exception:
+            pass  # Best effort persistence
+
+    def _log_deletes(self, ids):
+        self._append_log([{'id': i, 'tombstone': True} for i in ids])
 
     def _persist(self):
+        """Write a full snapshot (JSON + embeddings sidecar) and empty the change log."""
         try:
+            memories = self._data.get('memories', [])
+            directory = os.path.dirname(self.path)
+            base = os.path.splitext(os.path.basename(self.path))[0]
+            # A fresh sidecar name per snapshot: the old JSON keeps pointing at its own matrix
+            # until the rename below, so a crash never pairs records with the wrong rows
+            npy_name = f"{base}-{uuid.uuid4().hex[:12]}.npy"
+            npy_path = os.path.join(directory, npy_name)
+            mat = np.asarray([m['embedding'] for m in memories], dtype=np.float32)
+            np.save(npy_path, mat)
+            snapshot = dict(self._data)
+            snapshot['memories'] = [{k: v for k, v in m.items() if k != 'embedding'} for m in memories]
+            snapshot['embeddings_file'] = npy_name
             tmp_path = self.path + '.tmp'
-            with open(tmp_path, 'w', encoding='utf-8') as f:
-                json.dump(self._data, f)
+            with open(tmp_path, 'wb') as f:
+                f.write(dumps_bytes(snapshot))
             os.replace(tmp_path, self.path)
+            for name in os.listdir(directory or '.'):
+                if name.startswith(base + '-') and name.endswith('.npy') and name != npy_name:
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass
+            self._snapshot_bytes = os.path.getsize(self.path) + os.path.getsize(npy_path)
+            # Swap the in-memory lists for views into the new file
+            if len(memories):
+                mapped = np.load(npy_path, mmap_mode='r')
+                for m, row in zip(memories, mapped):
+                    m['embedding'] = row
+            # A crash before this truncate only leaves entries that replay idempotently
+            open(self.log_path, 'wb').close()
+            self._log_bytes = 0
         except Exception:
             pass  # Best effort persistence
 
     # ---------------- Core API ----------------
     def add_memory(self, text: str, metadata: Dict[str, Any] = None) -> str:
         """Add a memory with optional metadata."""
-        if not text.strip():
-            return ''
-        if not _lazy_import_embeddings():
-            return ''
-        model = get_embedding_model()
-        if model is None:
-            return ''
-        try:
-            emb = model.encode([text])[0].tolist()
-        except Exception:
-            return ''
-        import uuid
-        mem_id = str(uuid.uuid4())
-        import time
-        record = {
-            "id": mem_id,
-            "text": text,
-            "metadata": metadata or {},
-            "embedding": emb,
-            "created": time.time()
-        }
+        return self.add_memories([text], [metadata])[0]
+
+    def add_memories(self, texts: List[str], metadatas: Optional[List[Optional[Dict[str, Any]]]] = None) -> List[str]:
+        """Add several memories with one batched embedding call and one write.
+
+        Returns an id per text, '' for blank texts or when embedding is unavailable.
+        """
+        ids = [''] * len(texts)
+        keep = [i for i, t in enumerate(texts) if t and t.strip()]
+        if not keep or not _lazy_import_embeddings():
+            return ids
+        embs = generate_embeddings([texts[i] for i in keep])
+        if embs[0] is None:
+            return ids
+        now = time.time()
+        records = []
+        for i, emb in zip(keep, embs):
+            ids[i] = str(uuid.uuid4())
+            records.append({
+                "id": ids[i],
+                "text": texts[i],
+                "metadata": (metadatas[i] if metadatas else None) or {},
+                "embedding": np.asarray(emb, dtype=np.float32),
+                "created": now
+            })
         with self._lock:
-            self._data["memories"].append(record)
-            self._persist()
-        return mem_id
+            self._data["memories"].extend(records)
+            self._extend_index(records)
+            self._append_log(records)
+        return ids
 
     # New helper to update metadata of a memory (e.g., to mark suspicious after sanitization)
     def update_metadata(self, mem_id: str, new_meta: Dict[str, Any]):
@@ -93,7 +213,7 @@ class MemoryStore:
                     meta = m.get('metadata', {})
                     meta.update(new_meta)
                     m['metadata'] = meta
-                    self._persist()
+                    self._append_log([m])
                     return True
         return False
 
@@ -101,6 +221,20 @@ class MemoryStore:
         with self._lock:
             return list(self._data.get('memories', []))
 
+    def recent_memories(self, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Newest `limit` memories (by created) and the total count, without a full sort."""
+        with self._lock:
+            memories = self._data.get('memories', [])
+            top = heapq.nlargest(max(0, limit), memories, key=lambda m: m.get('created') or 0)
+            return top, len(memories)
+
+    def count_suspicious(self) -> Tuple[int, int]:
+        """(total, suspicious) memory counts."""
+        with self._lock:
+            memories = self._data.get('memories', [])
+            suspicious = sum(1 for m in memories if m.get('metadata', {}).get('suspicious'))
+            return len(memories), suspicious
+
     def delete_memory(self, mem_id: str) -> bool:
         removed = False
         with self._lock:
@@ -109,7 +243,8 @@ class MemoryStore:
             if len(new_list) != len(memories):
                 removed = True
                 self._data['memories'] = new_list
-                self._persist()
+                self._shrink_index({mem_id})
+                self._log_deletes([mem_id])
         return removed
 
     def delete_many(self, ids: List[str]) -> int:
@@ -122,7 +257,8 @@ class MemoryStore:
             removed = len(memories) - len(new_list)
             if removed:
                 self._data['memories'] = new_list
-                self._persist()
+                self._shrink_index(ids_set)
+                self._log_deletes(ids_set)
             return removed
 
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
@@ -130,41 +266,66 @@ class MemoryStore:
             return []
         if not _lazy_import_embeddings():
             return []
-        model = get_embedding_model()
-        if model is None:
+        q_emb = embed_query(query)
+        if q_emb is None:
             return []
         try:
-            q_emb = model.encode([query])[0]
-        except Exception:
-            return []
-        with self._lock:
-            memories = list(self._data.get('memories', []))
-        if not memories:
-            return []
-        # Compute cosine similarity
-        try:
-            import numpy as _np
-            mat = _np.array([m['embedding'] for m in memories])
-            qv = _np.array(q_emb)
-            # Normalize
-            mat_norm = mat / ( _np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9 )
-            qv_norm = qv / ( _np.linalg.norm(qv) + 1e-9 )
-            sims = mat_norm @ qv_norm
-            # argsort descending
-            idxs = sims.argsort()[::-1][:top_k]
+            memories, mat = self._search_index()
+            if not memories:
+                return []
+            idxs, scores = search_top_k(q_emb, mat, top_k)
             results = []
-            for i in idxs:
+            for i, score in zip(idxs, scores):
                 m = memories[i]
                 results.append({
                     'id': m['id'],
                     'text': m['text'],
                     'metadata': m.get('metadata', {}),
-                    'score': float(sims[i])
+                    'score': float(score)
                 })
             return results
         except Exception:
             return []
 
+    def _dense_index(self):
+        """The cached index when it is a plain float32 unit matrix (patchable in place), else None."""
+        if self._index is None:
+            return None
+        memories, mat = self._index
+        if isinstance(mat, np.ndarray) and mat.dtype == np.float32 and mat.ndim == 2:
+            return memories, mat
+        return None
+
+    def _extend_index(self, records: List[Dict[str, Any]]):
+        # Callers hold self._lock. Append normalized rows instead of rebuilding the matrix;
+        # quantized/HNSW indexes (and a dimension change) fall back to a lazy rebuild
+        dense = self._dense_index()
+        rows = normalize_rows([r['embedding'] for r in records])
+        if dense is None or dense[1].shape[1] != rows.shape[1] or not builds_dense_matrix(len(dense[0]) + len(rows)):
+            self._index = None
+            return
+        memories, mat = dense
+        self._index = (memories + records, np.vstack([mat, rows]))
+
+    def _shrink_index(self, ids: set):
+        # Callers hold self._lock
+        dense = self._dense_index()
+        if dense is None:
+            self._index = None
+            return
+        memories, mat = dense
+        keep = [i for i, m in enumerate(memories) if m.get('id') not in ids]
+        self._index = ([memories[i] for i in keep], mat[keep]) if keep else ([], None)
+
+    def _search_index(self) -> Tuple[List[Dict[str, Any]], Any]:
+        """Return (memories, normalized embedding matrix), building it once per mutation."""
+        with self._lock:
+            if self._index is None:
+                memories = list(self._data.get('memories', []))
+                mat = build_search_matrix([m['embedding'] for m in memories], cache_prefix=self.path) if memories else None
+                self._index = (memories, mat)
+            return self._index
+
     def stats(self):
         with self._lock:
             return {
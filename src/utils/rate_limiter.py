@@ -1,10 +1,12 @@
 """Enhanced in-memory rate limiter for Flask.
 
 Supports both IP-based and user-based rate limiting with different tiers.
-Implements fixed window + lightweight burst tracking.
+Implements two token buckets per key: one refilling max_requests per window and
+a burst bucket refilling burst_limit per second. State is a single tuple per key.
 Not production-grade (single-process only). For production, use Redis-based implementation.
 """
 from __future__ import annotations
+import math
 import time
 import threading
 from typing import Dict, Tuple, Optional, NamedTuple
@@ -39,9 +41,11 @@ DEFAULT_TIERS = {
     )
 }
 
-_LOCK = threading.Lock()
-_STATE: Dict[str, Dict[str, float]] = {}  # key -> {timestamp -> time}
-_BURST: Dict[str, Tuple[int, float]] = {}  # key -> (count, last_ts)
+# Striped locks: unrelated keys rarely share a stripe, so concurrent checks seldom contend
+_LOCK_STRIPES = 64
+_LOCKS = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+# key -> (window tokens, burst tokens, last refill time)
+_STATE: Dict[str, Tuple[float, float, float]] = {}
 
 def check_rate(identifier: str, tier: str = 'ip') -> Tuple[bool, Optional[Dict]]:
     """
@@ -60,56 +64,44 @@ def check_rate(identifier: str, tier: str = 'ip') -> Tuple[bool, Optional[Dict]]
     # Create a composite key that includes the tier
     key = f"{tier}:{identifier}"
     
+    cap = limit_config.max_requests
+    burst_cap = limit_config.burst_limit
+    rate = cap / limit_config.window_seconds  # window tokens per second
     now = time.time()
-    window_start = now - limit_config.window_seconds
     
-    with _LOCK:
-        bucket = _STATE.setdefault(key, {})
-        
-        # Prune old entries
-        old_keys = [k for k, ts in bucket.items() if ts < window_start]
-        for k in old_keys:
-            del bucket[k]
-            
-        # Current request count in window
-        current_count = len(bucket)
-        
-        # Add new request entry keyed by precise timestamp id
-        bucket[str(now)] = now
+    with _LOCKS[hash(key) % _LOCK_STRIPES]:
+        tokens, burst, last_ts = _STATE.get(key, (cap, burst_cap, now))
+        elapsed = max(0.0, now - last_ts)
+        tokens = min(cap, tokens + elapsed * rate)
+        burst = min(burst_cap, burst + elapsed * burst_cap)
         
         # Check window-based rate limit
-        if current_count >= limit_config.max_requests:
-            # Calculate reset time
-            oldest_ts = min(bucket.values()) if bucket else now
-            reset_after = int(limit_config.window_seconds - (now - oldest_ts))
-            
+        if tokens < 1:
+            _STATE[key] = (tokens, burst, now)
             return False, {
-                'X-RateLimit-Limit': limit_config.max_requests,
+                'X-RateLimit-Limit': cap,
                 'X-RateLimit-Remaining': 0,
-                'X-RateLimit-Reset': reset_after,
-                'X-RateLimit-Used': current_count
+                'X-RateLimit-Reset': math.ceil((1 - tokens) / rate),
+                'X-RateLimit-Used': cap
             }
-            
-        # Burst logic: collapse last second counts
-        cnt, last_ts = _BURST.get(key, (0, 0.0))
-        if now - last_ts <= 1.0:
-            cnt += 1
-        else:
-            cnt = 1
-        _BURST[key] = (cnt, now)
         
-        if cnt > limit_config.burst_limit:
+        if burst < 1:
+            _STATE[key] = (tokens, burst, now)
             return False, {
-                'X-RateLimit-Limit': limit_config.max_requests,
-                'X-RateLimit-Remaining': limit_config.max_requests - current_count,
-                'X-RateLimit-Reset': limit_config.window_seconds,
-                'X-RateLimit-Burst-Limit': limit_config.burst_limit,
-                'X-RateLimit-Burst-Count': cnt
+                'X-RateLimit-Limit': cap,
+                'X-RateLimit-Remaining': int(tokens),
+                # Seconds until the burst bucket holds a whole token again
+                'X-RateLimit-Reset': math.ceil((1 - burst) / burst_cap),
+                'X-RateLimit-Burst-Limit': burst_cap,
+                'X-RateLimit-Burst-Remaining': 0
             }
+        
+        tokens -= 1
+        _STATE[key] = (tokens, burst - 1, now)
             
     # Request allowed
     return True, {
-        'X-RateLimit-Limit': limit_config.max_requests,
-        'X-RateLimit-Remaining': limit_config.max_requests - current_count,
+        'X-RateLimit-Limit': cap,
+        'X-RateLimit-Remaining': int(tokens),
         'X-RateLimit-Reset': limit_config.window_seconds
     }
@@ -94,4 +94,15 @@ class ProfileDeleteSchema(Schema):
     """Schema for profile deletion requests."""
     name = fields.Str(required=True, validate=validate.Length(min=1, max=100))
     persist = fields.Bool(missing=False)
-    csrf_token = fields.Str(allow_none=True)
\ No newline at end of file
+    csrf_token = fields.Str(allow_none=True)
+
+
+# Shared instances; Schema objects are reusable across requests and threads
+LOGIN_SCHEMA = LoginSchema()
+CHAT_MESSAGE_SCHEMA = ChatMessageSchema()
+SEARCH_MEMORY_SCHEMA = SearchMemorySchema()
+ADD_MEMORY_SCHEMA = AddMemorySchema()
+ENDPOINT_TEST_SCHEMA = EndpointTestSchema()
+PROFILE_UPSERT_SCHEMA = ProfileUpsertSchema()
+PROFILE_ACTIVATE_SCHEMA = ProfileActivateSchema()
+PROFILE_DELETE_SCHEMA = ProfileDeleteSchema()
@@ -18,12 +18,19 @@ import secrets
 import hmac
 import hashlib
 import time
-from functools import wraps
-from typing import Tuple, Dict, Any, Callable, Optional
+from functools import lru_cache, wraps
+from typing import Tuple, Dict, Any, Callable, Optional, List
 from flask import request, session, jsonify, Response
-from config import PII_PATTERNS, PII_REDACT_ENABLED, REDACTION_REPLACEMENT, CSRF_TOKEN_EXPIRY
+from config import PII_COMBINED, PII_REDACT_ENABLED, REDACTION_REPLACEMENT, CSRF_TOKEN_EXPIRY
 from utils.error_handler import error_response, ErrorCode
 
+try:
+    import re2  # type: ignore
+    # Linear-time DFA scan; texts without PII (the common case) never reach the backtracking engine
+    _PII_PREFILTER = re2.compile(PII_COMBINED.pattern)
+except Exception:  # not installed, or a pattern outside RE2's syntax
+    _PII_PREFILTER = None
+
 INJECTION_PATTERNS = [
     r"(?i)ignore previous",
     r"(?i)disregard (all|previous)",
@@ -36,6 +43,38 @@ INJECTION_PATTERNS = [
 ]
 
 CONTROL_CHARS_RE = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F]")
+# The same characters as a str.translate table. translate has a fixed ~2.5 us setup per
+# call but then runs ~3-4x faster than the regex, so it only pays off on longer texts.
+_CONTROL_CHARS_TABLE = dict.fromkeys([*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20)])
+_TRANSLATE_MIN_CHARS = 512
+_INJECTION_RES = [(pat, re.compile(pat)) for pat in INJECTION_PATTERNS]
+# A literal every match of the same-index pattern contains (lowercase). Valid as a
+# reject test only for ASCII text: (?i) also folds e.g. U+017F to 's', which
+# str.lower() does not.
+_INJECTION_MARKERS = (
+    "ignore previous",
+    "disregard ",
+    "reset ",
+    "you are now",
+    "act as ",
+    "system:",
+    "role: system",
+    "begin",
+)
+# sanitize_text memoizes inputs shorter than this (knowledge chunks are <= 1200 chars), which
+# bounds the cache to _SANITIZE_CACHE_SIZE * ~2 * 4k chars; longer inputs are scanned every time
+_SANITIZE_CACHE_MAX_CHARS = 4096
+_SANITIZE_CACHE_SIZE = 4096
+# Boundaries str.splitlines() honours besides "\n" that survive CONTROL_CHARS_RE
+_OTHER_LINE_BREAKS = ("\r", "\x85", "\u2028", "\u2029")
+
+
+def _normalize_line_ends(text: str, ascii_only: bool) -> str:
+    """text with every str.splitlines() boundary turned into "\n"."""
+    if "\r" in text or (not ascii_only and any(b in text for b in _OTHER_LINE_BREAKS[1:])):
+        return "\n".join(text.splitlines())
+    # splitlines() also drops one final newline (exposed when a control char after it was removed)
+    return text[:-1] if text.endswith("\n") else text
 
 
 def sanitize_text(raw: str) -> Tuple[str, Dict[str, Any]]:
@@ -46,29 +85,64 @@ def sanitize_text(raw: str) -> Tuple[str, Dict[str, Any]]:
       * Remove control characters (non-printing) except newlines & tabs
       * Neutralize suspicious lines by quoting them
       * Collect pattern hits
+
+    Results for inputs under _SANITIZE_CACHE_MAX_CHARS are memoized (re-ingested
+    chunks skip the scan); the metadata dict is built fresh on every call.
     """
-    meta: Dict[str, Any] = {"suspicious": False, "patterns": []}
     if not raw:
-        return raw, meta
+        return raw, {"suspicious": False, "patterns": []}
+    if len(raw) < _SANITIZE_CACHE_MAX_CHARS:
+        sanitized, patterns = _sanitize_cached(raw)
+    else:
+        sanitized, patterns = _sanitize(raw)
+    return sanitized, {"suspicious": bool(patterns), "patterns": list(patterns)}
+
+
+def _sanitize(raw: str) -> Tuple[str, Tuple[str, ...]]:
+    """(sanitized_text, sorted distinct pattern hits) for a non-empty raw."""
     text = raw.strip()
-    text = CONTROL_CHARS_RE.sub("", text)
-    lines = text.splitlines()
+    if len(text) >= _TRANSLATE_MIN_CHARS:
+        text = text.translate(_CONTROL_CHARS_TABLE)
+    else:
+        text = CONTROL_CHARS_RE.sub("", text)
+    ascii_only = text.isascii()
+    text = _normalize_line_ends(text, ascii_only)
+    # A pattern matching some line matches the text too, so a whole-text scan per
+    # pattern narrows the work to the few patterns that hit (none for clean text).
+    # Separate scans beat one fused alternation here: CPython's engine tries every
+    # branch at each position, which measured ~2x slower on clean documents.
+    if ascii_only:
+        # Substring checks run far faster than a regex scan and clear most texts
+        low = text.lower()
+        candidates = [pr for pr, marker in zip(_INJECTION_RES, _INJECTION_MARKERS) if marker in low]
+    else:
+        candidates = _INJECTION_RES
+    active = [(pat, rx) for pat, rx in candidates if rx.search(text)]
+    if not active:
+        return text, ()
+    # Per-line pass only for texts that hit. Collecting hit offsets with finditer
+    # (no line list) measured ~2x slower than this loop on heavily injected text,
+    # since a line stops at its first matching pattern.
     sanitized_lines = []
     pattern_hits = []
-    for line in lines:
-        original_line = line
-        for pat in INJECTION_PATTERNS:
-            if re.search(pat, line):
+    for line in text.split("\n"):
+        for pat, rx in active:
+            if rx.search(line):
                 pattern_hits.append(pat)
                 # Neutralize by rendering as quoted data (prevent directive execution)
                 line = f"> {line}"
                 break
         sanitized_lines.append(line)
-    if pattern_hits:
-        meta["suspicious"] = True
-        meta["patterns"] = list(sorted(set(pattern_hits)))
     sanitized = "\n".join(sanitized_lines)
-    return sanitized, meta
+    return sanitized, tuple(sorted(set(pattern_hits)))
+
+
+_sanitize_cached = lru_cache(maxsize=_SANITIZE_CACHE_SIZE)(_sanitize)
+
+
+def sanitize_texts(raws: List[str]) -> List[Tuple[str, Dict[str, Any]]]:
+    """sanitize_text over a batch, in order."""
+    return [sanitize_text(raw) for raw in raws]
 
 
 def build_guardrail_preamble() -> str:
@@ -86,36 +160,42 @@ def redact_pii(text: str) -> Tuple[str, Dict[str, int]]:
     """Redact simple PII/secret patterns. Returns (redacted_text, stats)."""
     if not PII_REDACT_ENABLED or not text:
         return text, {}
-    import re
+    if _PII_PREFILTER is not None and not _PII_PREFILTER.search(text):
+        return text, {}
+    stats: Dict[str, int] = {}
+
+    def _replace(match):
+        name = match.lastgroup
+        stats[name] = stats.get(name, 0) + 1
+        return REDACTION_REPLACEMENT
+
+    redacted = PII_COMBINED.sub(_replace, text)
+    return redacted, stats
 
 # ---- CSRF Protection ----
 
 def generate_csrf_token() -> str:
     """Generate a new CSRF token and store it in the session."""
-    if 'csrf_token' not in session:
-        session['csrf_token'] = secrets.token_urlsafe(32)
-        session['csrf_timestamp'] = int(time.time())
-    elif 'csrf_timestamp' in session:
-        # Check if token has expired
-        if int(time.time()) - session.get('csrf_timestamp', 0) > CSRF_TOKEN_EXPIRY:
-            # Generate new token if expired
-            session['csrf_token'] = secrets.token_urlsafe(32)
-            session['csrf_timestamp'] = int(time.time())
-            
-    return session['csrf_token']
+    now = int(time.time())
+    token = session.get('csrf_token')
+    issued = session.get('csrf_timestamp')
+    # New token when missing or expired (a token without a timestamp never expires)
+    if token is None or (issued is not None and now - issued > CSRF_TOKEN_EXPIRY):
+        token = secrets.token_urlsafe(32)
+        session['csrf_token'] = token
+        session['csrf_timestamp'] = now
+    return token
 
 def validate_csrf_token(token: str) -> bool:
     """Validate that the provided token matches the one in session."""
-    if not token or not session.get('csrf_token'):
-        return False
-    
-    # Check if token has expired
-    if 'csrf_timestamp' in session:
-        if int(time.time()) - session.get('csrf_timestamp', 0) > CSRF_TOKEN_EXPIRY:
-            return False
-    
-    # Use constant-time comparison to prevent timing attacks
-    return hmac.compare_digest(token, session.get('csrf_token', ''))
+    # One read of each session value, and the comparison always runs, so the work
+    # done does not reveal which check failed
+    stored = session.get('csrf_token') or ''
+    issued = session.get('csrf_timestamp')
+    expired = issued is not None and int(time.time()) - issued > CSRF_TOKEN_EXPIRY
+    # Use constant-time comparison to prevent timing attacks (bytes: str input must be ASCII)
+    matches = hmac.compare_digest((token or '').encode('utf-8'), stored.encode('utf-8'))
+    return bool(matches and stored and not expired)
 
 def csrf_protect(f: Callable) -> Callable:
     """Decorator to enforce CSRF protection on routes."""
@@ -142,10 +222,10 @@ def csrf_protect(f: Callable) -> Callable:
         return f(*args, **kwargs)
     return decorated_function
 
-def secure_headers(response: Response) -> Response:
-    """Add security headers to all responses."""
+# Added to every response by secure_headers
+_SECURE_HEADERS = {
     # Content Security Policy
-    response.headers['Content-Security-Policy'] = (
+    'Content-Security-Policy': (
         "default-src 'self'; "
         "script-src 'self' 'unsafe-inline'; "
         "style-src 'self' 'unsafe-inline'; "
@@ -156,21 +236,16 @@ def secure_headers(response: Response) -> Response:
         "media-src 'self'; "
         "frame-src 'self'; "
         "form-action 'self';"
-    )
-    
+    ),
     # Other security headers
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'SAMEORIGIN'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-    response.headers['Permissions-Policy'] = 'camera=(), microphone=(), geolocation=()'
-    
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'SAMEORIGIN',
+    'X-XSS-Protection': '1; mode=block',
+    'Referrer-Policy': 'strict-origin-when-cross-origin',
+    'Permissions-Policy': 'camera=(), microphone=(), geolocation=()',
+}
+
+def secure_headers(response: Response) -> Response:
+    """Add security headers to all responses."""
+    response.headers.update(_SECURE_HEADERS)
     return response
-    stats: Dict[str, int] = {}
-    redacted = text
-    for name, pattern in PII_PATTERNS.items():
-        matches = re.findall(pattern, redacted)
-        if matches:
-            stats[name] = len(matches)
-            redacted = re.sub(pattern, REDACTION_REPLACEMENT, redacted)
-    return redacted, stats
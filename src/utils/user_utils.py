@@ -11,6 +11,7 @@ import secrets
 import string
 from typing import Dict, Any, Optional, List, Tuple
 from werkzeug.security import generate_password_hash, check_password_hash
+from config import PASSWORD_HASH_METHOD
 
 # Password requirements
 MIN_PASSWORD_LENGTH = 8
@@ -20,6 +21,16 @@ REQUIRE_DIGITS = True
 REQUIRE_SPECIAL = True
 SPECIAL_CHARS = string.punctuation
 
+# Character classes for ASCII passwords, where str.isupper/islower/isdigit reduce to these
+_UPPER = frozenset(string.ascii_uppercase)
+_LOWER = frozenset(string.ascii_lowercase)
+_DIGITS = frozenset(string.digits)
+_SPECIAL = frozenset(SPECIAL_CHARS)
+
+# Alphabet for the free positions of generated passwords, and one shared CSPRNG for shuffling
+_PW_ALPHABET = string.ascii_letters + string.digits + SPECIAL_CHARS
+_SYSRAND = secrets.SystemRandom()
+
 def validate_password_strength(password: str) -> Tuple[bool, List[str]]:
     """
     Validate password strength against security requirements.
@@ -35,42 +46,46 @@ def validate_password_strength(password: str) -> Tuple[bool, List[str]]:
     if len(password) < MIN_PASSWORD_LENGTH:
         errors.append(f"Password must be at least {MIN_PASSWORD_LENGTH} characters long")
         
-    if REQUIRE_UPPER and not any(c.isupper() for c in password):
+    chars = set(password)
+    if password.isascii():
+        has_upper = not chars.isdisjoint(_UPPER)
+        has_lower = not chars.isdisjoint(_LOWER)
+        has_digit = not chars.isdisjoint(_DIGITS)
+    else:
+        # Unicode letters and digits count too
+        has_upper = any(c.isupper() for c in chars)
+        has_lower = any(c.islower() for c in chars)
+        has_digit = any(c.isdigit() for c in chars)
+        
+    if REQUIRE_UPPER and not has_upper:
         errors.append("Password must contain at least one uppercase letter")
         
-    if REQUIRE_LOWER and not any(c.islower() for c in password):
+    if REQUIRE_LOWER and not has_lower:
         errors.append("Password must contain at least one lowercase letter")
         
-    if REQUIRE_DIGITS and not any(c.isdigit() for c in password):
+    if REQUIRE_DIGITS and not has_digit:
         errors.append("Password must contain at least one digit")
         
-    if REQUIRE_SPECIAL and not any(c in SPECIAL_CHARS for c in password):
+    if REQUIRE_SPECIAL and chars.isdisjoint(_SPECIAL):
         errors.append(f"Password must contain at least one special character ({SPECIAL_CHARS})")
         
     return len(errors) == 0, errors
 
 def generate_secure_password() -> str:
     """Generate a secure random password that meets all requirements."""
-    while True:
-        # Generate a 16-character password with at least one character from each required group
-        password = ''.join([
-            secrets.choice(string.ascii_uppercase),
-            secrets.choice(string.ascii_lowercase),
-            secrets.choice(string.digits),
-            secrets.choice(SPECIAL_CHARS),
-            *[secrets.choice(string.ascii_letters + string.digits + SPECIAL_CHARS) 
-              for _ in range(12)]
-        ])
-        
-        # Shuffle to avoid predictable pattern
-        password_list = list(password)
-        secrets.SystemRandom().shuffle(password_list)
-        password = ''.join(password_list)
-        
-        # Ensure it meets all requirements (should always be true, but double-check)
-        is_valid, _ = validate_password_strength(password)
-        if is_valid:
-            return password
+    # Generate a 16-character password with at least one character from each required group;
+    # the construction guarantees the policy, so there is nothing to validate or retry
+    password_list = [
+        secrets.choice(string.ascii_uppercase),
+        secrets.choice(string.ascii_lowercase),
+        secrets.choice(string.digits),
+        secrets.choice(SPECIAL_CHARS),
+        *[secrets.choice(_PW_ALPHABET) for _ in range(12)]
+    ]
+    
+    # Shuffle to avoid predictable pattern
+    _SYSRAND.shuffle(password_list)
+    return ''.join(password_list)
 
 def hash_password(password: str) -> str:
     """
@@ -82,7 +97,9 @@ def hash_password(password: str) -> str:
     Returns:
         Securely hashed password
     """
-    # Using pbkdf2:sha256 with 50000 iterations (Werkzeug's default method)
+    # LPS2_PASSWORD_HASH_METHOD when set, else Werkzeug's default method (scrypt)
+    if PASSWORD_HASH_METHOD:
+        return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
     return generate_password_hash(password)
 
 def verify_password(stored_hash: str, provided_password: str) -> bool:
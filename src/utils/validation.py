@@ -12,25 +12,33 @@ It uses marshmallow for schema validation, which provides:
 from __future__ import annotations
 
 import logging
-from functools import wraps
+from functools import lru_cache, wraps
 from typing import Dict, Any, Callable, Optional, Type, Union, get_type_hints
 from flask import request, jsonify
 from marshmallow import Schema, ValidationError
 
 logger = logging.getLogger("validation")
 
-def validate_schema(data: Dict[str, Any], schema_class: Type[Schema]) -> tuple[Dict[str, Any], bool, Any]:
+@lru_cache(maxsize=None)
+def _cached_schema(schema_class: Type[Schema]) -> Schema:
+    """One shared instance per schema class; load() keeps no per-call state on it."""
+    return schema_class()
+
+def _schema_instance(schema: Union[Type[Schema], Schema]) -> Schema:
+    return schema if isinstance(schema, Schema) else _cached_schema(schema)
+
+def validate_schema(data: Dict[str, Any], schema_class: Union[Type[Schema], Schema]) -> tuple[Dict[str, Any], bool, Any]:
     """Validate data against a schema without relying on decorators.
     
     Args:
         data: The data to validate
-        schema_class: Marshmallow schema class to use for validation
+        schema_class: Marshmallow schema class (or instance) to use for validation
         
     Returns:
         Tuple of (validated_data, is_valid, error_messages)
     """
     try:
-        schema = schema_class()
+        schema = _schema_instance(schema_class)
         validated_data = schema.load(data)
         return validated_data, True, None
     except ValidationError as err:
@@ -39,6 +47,24 @@ def validate_schema(data: Dict[str, Any], schema_class: Type[Schema]) -> tuple[D
         logger.exception(f"Unexpected error during validation: {str(e)}")
         return {}, False, {"_general": f"Validation error: {str(e)}"}
 
+def _json_data() -> Dict[str, Any]:
+    # Gracefully handle non-JSON requests; an empty body is {} without invoking the parser
+    # (a Content-Length of 0, or none on a request that is not chunked)
+    if not request.is_json:
+        return {}
+    length = request.content_length
+    if length == 0 or (length is None and 'chunked' not in request.headers.get('Transfer-Encoding', '').lower()):
+        return {}
+    return request.json or {}
+
+# Request data accessor per validate_request location, resolved once per decorated route
+_DATA_GETTERS: Dict[str, Callable[[], Dict[str, Any]]] = {
+    'json': _json_data,
+    'form': lambda: request.form.to_dict(),
+    'args': lambda: request.args.to_dict(),
+    'files': lambda: request.files.to_dict(),
+}
+
 def validate_request(schema_class: Type[Schema], location: str = 'json'):
     """Decorator to validate request data against a schema.
     
@@ -49,6 +75,9 @@ def validate_request(schema_class: Type[Schema], location: str = 'json'):
     Returns:
         Decorator function
         
+    Raises:
+        ValueError: location is not one of the above (at decoration time)
+        
     Example:
         ```python
         class LoginSchema(Schema):
@@ -63,26 +92,17 @@ def validate_request(schema_class: Type[Schema], location: str = 'json'):
             ...
         ```
     """
+    get_data = _DATA_GETTERS.get(location)
+    if get_data is None:
+        raise ValueError(f"Unknown validation location: {location!r}")
+    # Degraded path after an unexpected validation error: the unvalidated data
+    fallback = {'json': lambda: request.json or {}, 'form': get_data}.get(location, dict)
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             try:
-                # Get request data based on location
-                if location == 'json':
-                    if request.is_json:
-                        data = request.json or {}
-                    else:
-                        # Gracefully handle non-JSON requests
-                        data = {}
-                elif location == 'form':
-                    data = request.form.to_dict()
-                elif location == 'args':
-                    data = request.args.to_dict()
-                elif location == 'files':
-                    data = request.files.to_dict()
-                else:
-                    # Default to JSON
-                    data = request.json or {}
+                data = get_data()
                 
                 # Validate against schema
                 validated_data, is_valid, errors = validate_schema(data, schema_class)
@@ -100,30 +120,25 @@ def validate_request(schema_class: Type[Schema], location: str = 'json'):
                 # Log but continue with the request
                 logger.exception(f"Error during validation: {str(e)}")
                 # Attempt to get data anyway - degraded experience but won't break existing code
-                if location == 'json':
-                    request.validated_data = request.json or {}
-                elif location == 'form':
-                    request.validated_data = request.form.to_dict()
-                else:
-                    request.validated_data = {}
+                request.validated_data = fallback()
             
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
 # Stand-alone validator function that doesn't need decorators
-def validate_data(data: Dict[str, Any], schema_class: Type[Schema]) -> tuple[bool, Dict[str, Any], Any]:
+def validate_data(data: Dict[str, Any], schema_class: Union[Type[Schema], Schema]) -> tuple[bool, Dict[str, Any], Any]:
     """Validate data against a schema without modifying request objects.
     
     Args:
         data: The data to validate
-        schema_class: Marshmallow schema class to use for validation
+        schema_class: Marshmallow schema class (or instance) to use for validation
         
     Returns:
         Tuple of (is_valid, validated_data, error_messages)
     """
     try:
-        schema = schema_class()
+        schema = _schema_instance(schema_class)
         validated_data = schema.load(data)
         return True, validated_data, None
     except ValidationError as err: